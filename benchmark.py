@@ -0,0 +1,264 @@
+"""Deterministic benchmarks for the simulation's hot paths, driven by the mock LLM backend.
+
+No Ollama server is needed: text comes from _mock_ollama_response, embeddings are fixed per text and
+every agent draws from its own seeded agent_rng, so two runs on the same machine (with the same --workers)
+do the same work. Everything the simulation
+writes (embedding cache, logs, memory buffers) goes to a scratch directory.
+
+    python benchmark.py                               # full suite -> benchmark_results.json
+    python benchmark.py --quick                       # smaller sizes for a fast check
+    python benchmark.py --compare old_results.json    # flag metrics that got worse than --threshold
+    python benchmark.py --check-scheduling            # event-scheduled run must end exactly like --every-minute
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED = 1234
+QUERIES = ["What should I eat today?", "Who did I talk to recently?", "What is broken in town?",
+           "How is my work going?", "Where can I rest?", "What happened at the Common_Space?"]
+
+def _metric(value, unit, better="lower"):
+    return {'value': value, 'unit': unit, 'better': better}
+
+def _percentile_ms(samples, q):
+    return 1000 * float(np.percentile(samples, q))
+
+def load_simulation(workdir):
+    """Imports v1 inside a scratch directory with the mock backend; returns (module, import seconds)."""
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    start = time.perf_counter()
+    import v1
+    elapsed = time.perf_counter() - start
+    v1.set_llm_backend("mock", seed=SEED)
+    v1.PROFILER.enabled = False
+    v1.PROFILE_FILE = None
+    return v1, elapsed
+
+def reset_world(v1):
+    """Fresh clock, random stream, classifiers and town: the same starting point for every benchmark."""
+    random.seed(SEED)
+    v1.set_game_time(v1.GAME_START_DATETIME)
+    v1.IMPORTANCE_CLASSIFIER = v1.PrototypeClassifier("Importance", numeric=True) # Otherwise later runs start from earlier runs' examples
+    v1.EMOTION_CLASSIFIER = v1.PrototypeClassifier("Emotion", numeric=False)
+    tick_executor = v1.TickExecutor(1)
+    agents = v1.start_or_resume(tick_executor)
+    tick_executor.shutdown()
+    return agents
+
+def bench_startup(v1):
+    start = time.perf_counter()
+    reset_world(v1)
+    return {'startup_s': _metric(time.perf_counter() - start, "s")}
+
+def bench_ticks(v1, minutes, workers):
+    """Simulated game minutes per second (the event scheduler may cover several minutes per step)."""
+    agents = reset_world(v1)
+    tick_executor = v1.TickExecutor(workers)
+    simulated = 0
+    start = time.perf_counter()
+    while simulated < minutes:
+        simulated += v1.step_simulation(agents, tick_executor, days_to_run=10**6)
+    elapsed = time.perf_counter() - start
+    tick_executor.shutdown()
+    return {f'game_minutes_per_s_workers_{workers}': _metric(simulated / elapsed, "min/s", better="higher")}
+
+def bench_retrieve(v1, sizes, repeats):
+    """retrieve_memories latency as one agent's memory stream grows through add_memory, so archival keeps
+    the hot store under MEMORY_HOT_CAPACITY and the rest lands in the cold tier (sizes are hot + cold)."""
+    reset_world(v1)
+    agent = v1.Agent("Bench_Retriever", "Mayor", "Benchmarks memory retrieval.", "Common_Space", v1.BLACK, ["Bench_Retriever"])
+    rng = np.random.default_rng(SEED)
+    base_dt = v1.get_current_game_time_as_datetime()
+    for query in QUERIES: # Query embeddings are cached once so the timings cover the scan, not the embed
+        v1._call_ollama_embedding(query)
+    results = {}
+    added = 0
+    for size in sizes:
+        while added < size:
+            dt_obj = base_dt - v1.timedelta(minutes=int(rng.integers(0, 60 * 24 * 30)))
+            agent.add_memory(f"Synthetic memory {added}", "Observation", importance_score=int(rng.integers(1, 11)),
+                             location_context="Common_Space", dt_obj=dt_obj, defer_embedding=True)
+            added += 1
+            if len(agent.pending_embeddings) >= 512:
+                v1.flush_pending_embeddings([agent])
+        v1.flush_pending_embeddings([agent])
+        agent.retrieve_memories(QUERIES[0]) # Warm-up
+        samples = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            agent.retrieve_memories(QUERIES[i % len(QUERIES)], count=10)
+            samples.append(time.perf_counter() - start)
+        results[f'retrieve_p50_ms_at_{size}'] = _metric(_percentile_ms(samples, 50), "ms")
+        results[f'retrieve_p95_ms_at_{size}'] = _metric(_percentile_ms(samples, 95), "ms")
+        samples = []
+        for i in range(repeats): # What reflection runs per question: hot + cold, hits promoted
+            start = time.perf_counter()
+            agent.retrieve_memories(QUERIES[i % len(QUERIES)], count=15, include_cold=True)
+            samples.append(time.perf_counter() - start)
+            if len(agent.memory_store) > v1.MEMORY_HOT_CAPACITY: # As the next add_memory would
+                agent.consolidate_memories()
+        results[f'retrieve_cold_p50_ms_at_{size}'] = _metric(_percentile_ms(samples, 50), "ms")
+        results[f'retrieve_cold_p95_ms_at_{size}'] = _metric(_percentile_ms(samples, 95), "ms")
+        agent.retrieve_memories(QUERIES[0], count=10, standing=True) # Registers the standing query (one full scan)
+        samples = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            agent.retrieve_memories(QUERIES[0], count=10, standing=True)
+            samples.append(time.perf_counter() - start)
+        results[f'retrieve_standing_p50_ms_at_{size}'] = _metric(_percentile_ms(samples, 50), "ms")
+    v1.WORLD_INDEX.remove_agent(agent)
+    return results
+
+def bench_perceive(v1, counts, rounds):
+    """perceive_environment for N agents sharing one location (the worst case: everyone sees everyone)."""
+    results = {}
+    for count in counts:
+        reset_world(v1)
+        v1.WORLD_INDEX.clear_agents()
+        names = [f"Bench_{i}" for i in range(count)]
+        crowd = [v1.Agent(name, "Farmer", "Benchmarks perception.", "Common_Space", v1.BLACK, names) for name in names]
+        start = time.perf_counter()
+        for _ in range(rounds):
+            v1.advance_game_time(minutes=10)
+            for agent in crowd:
+                agent.publish_observable_state()
+            for agent in crowd:
+                agent.perceive_environment(crowd)
+            v1.flush_pending_embeddings(crowd)
+        elapsed = time.perf_counter() - start
+        results[f'perceive_ms_per_agent_at_{count}'] = _metric(1000 * elapsed / (rounds * count), "ms")
+    return results
+
+def run_suite(quick=False, workers=None):
+    with tempfile.TemporaryDirectory(prefix="town_bench_") as workdir:
+        v1, import_s = load_simulation(workdir)
+        workers = workers or v1.TICK_WORKERS
+        results = {'import_s': _metric(import_s, "s")}
+        with contextlib.redirect_stdout(io.StringIO()): # The simulation narrates a lot; keep the report readable
+            results.update(bench_startup(v1))
+            for worker_count in sorted({1, workers}):
+                results.update(bench_ticks(v1, 120 if quick else 600, worker_count))
+            results.update(bench_retrieve(v1, [1000, 10000] if quick else [1000, 10000, 50000], 50 if quick else 200))
+            results.update(bench_perceive(v1, [5, 20] if quick else [5, 20, 50], 3 if quick else 10))
+            v1.SIMULATION_LOG.close()
+            v1.EMBEDDING_CACHE.close()
+        os.chdir(REPO_DIR)
+    return results
+
+def _diff_fields(a, b, path=""):
+    """JSON paths at which two decoded JSON documents differ."""
+    if type(a) is not type(b):
+        return [path]
+    if isinstance(a, dict):
+        return [diff for key in sorted(set(a) | set(b))
+                for diff in ([f"{path}.{key}"] if key not in a or key not in b else _diff_fields(a[key], b[key], f"{path}.{key}"))]
+    if isinstance(a, list):
+        return ([f"{path}[len]"] if len(a) != len(b) else []) + [diff for i, (x, y) in enumerate(zip(a, b)) for diff in _diff_fields(x, y, f"{path}[{i}]")]
+    return [] if a == b else [path]
+
+def _headless_run(workdir, days, seed, workers, lod, every_minute):
+    """v1.py --headless with the mock backend in workdir; returns (final checkpoint state, minutes, steps, agent updates)."""
+    command = [sys.executable, os.path.join(REPO_DIR, "v1.py"), "--headless", "--backend", "mock", "--seed", str(seed),
+               "--days", str(days), "--workers", str(workers)] + (["--lod"] if lod else []) + (["--every-minute"] if every_minute else [])
+    output = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True).stdout
+    minutes, steps = map(int, re.search(r"Headless run: (\d+) game minutes in (\d+) steps", output).groups())
+    with open(os.path.join(workdir, "checkpoint", "state.json")) as f:
+        state = json.load(f)
+    with open(os.path.join(workdir, "simulation_profile.json")) as f:
+        phases = json.load(f)['phases']
+    updates = sum(phases.get(phase, {}).get('count', 0) for phase in ("agent.needs", "agent.reduced_policy"))
+    return state, minutes, steps, updates
+
+def check_scheduling(days=1, seed=SEED, workers=1, lod=False) -> bool:
+    """Runs the same seeded mock simulation event-scheduled and with --every-minute and compares the final
+    checkpoints field by field. Passes only if they match and the event-scheduled run actually skipped minutes."""
+    runs = {}
+    for every_minute in (False, True):
+        with tempfile.TemporaryDirectory(prefix="town_sched_") as workdir:
+            runs[every_minute] = _headless_run(workdir, days, seed, workers, lod, every_minute)
+    differing = _diff_fields(runs[False][0], runs[True][0])
+    for every_minute, (_, minutes, steps, updates) in runs.items():
+        print(f"{'every minute' if every_minute else 'event-scheduled':<16}{minutes:>6} game minutes in {steps:>6} steps, {updates:>6} agent updates")
+    print(f"{len(differing)} differing checkpoint fields" + (": " + ", ".join(differing[:10]) if differing else ""))
+    skipped = runs[False][3] < runs[True][3]
+    if not skipped:
+        print("The event-scheduled run skipped no agent updates, so it checked nothing.")
+    return skipped and not differing
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Prints each shared metric against the baseline; returns the names that regressed past threshold."""
+    regressions = []
+    print(f"\n{'metric':<36}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, metric in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['value'], metric['value']
+        change = (new - old) / old if old else 0.0
+        worse = change > threshold if metric['better'] == "lower" else change < -threshold
+        if worse:
+            regressions.append(name)
+        print(f"{name:<36}{old:>12.3f}{new:>12.3f}{change:>+9.0%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deterministic simulation benchmarks (mock LLM backend)")
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer repeats")
+    parser.add_argument("--workers", type=int, default=None, help="Tick workers for the concurrent throughput run (default: TICK_WORKERS)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the results")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative change that counts as a regression")
+    parser.add_argument("--check-scheduling", action="store_true", help="Instead of benchmarking, compare an event-scheduled run with --every-minute")
+    parser.add_argument("--days", type=int, default=1, help="Game days for --check-scheduling")
+    parser.add_argument("--lod", action="store_true", help="Run --check-scheduling with cognitive level of detail on")
+    args = parser.parse_args(argv)
+    if args.check_scheduling:
+        return 0 if check_scheduling(args.days, SEED, args.workers or 1, args.lod) else 1
+    output = os.path.abspath(args.output)
+
+    results = run_suite(args.quick, args.workers)
+    report = {
+        'meta': {'timestamp': datetime.now().isoformat(), 'git_revision': _git_revision(), 'seed': SEED, 'quick': args.quick,
+                 'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+        'results': results,
+    }
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, metric in results.items():
+        print(f"{name:<36}{metric['value']:>12.3f} {metric['unit']}")
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != args.quick:
+            print("\nWarning: baseline was run with a different --quick setting; sizes and tick counts differ.")
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,15 +7,26 @@ import math # For distance calculations
 import ollama # Import the ollama library
 import numpy as np # For vector operations (cosine similarity)
 import os # For file operations
+import hashlib # For content-addressed cache keys
+import sqlite3 # Persistent embedding cache
+import threading
+import re # For parsing numbered LLM lists
+import argparse # Command-line runner options
+import gzip # Optional compression of rotated log files
+import queue # Background log sink
+import shutil # Checkpoint directory management
+import multiprocessing # Region-sharded headless runs
+import traceback
+import heapq # Event scheduler
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Pygame Initialization ---
-pygame.init()
-
+# The display is only created by init_display() (GUI mode); headless runs never touch SDL video.
 # Screen dimensions
 SCREEN_WIDTH = 1200
 SCREEN_HEIGHT = 900
-SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("AI Town Simulation (Advanced Cognitive & World State)")
+SCREEN = None
 
 # Colors
 WHITE = (255, 255, 255)
@@ -33,10 +44,20 @@ PURPLE = (128, 0, 128)
 CYAN = (0, 255, 255)
 DARK_GREY = (100, 100, 100)
 
-# Fonts
-FONT = pygame.font.Font(None, 24)
-BIG_FONT = pygame.font.Font(None, 36)
-SMALL_FONT = pygame.font.Font(None, 18)
+# Fonts (created by init_display)
+FONT = None
+BIG_FONT = None
+SMALL_FONT = None
+
+def init_display():
+    """Initializes pygame, the window and fonts for GUI mode."""
+    global SCREEN, FONT, BIG_FONT, SMALL_FONT
+    pygame.init()
+    SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption("AI Town Simulation (Advanced Cognitive & World State)")
+    FONT = pygame.font.Font(None, 24)
+    BIG_FONT = pygame.font.Font(None, 36)
+    SMALL_FONT = pygame.font.Font(None, 18)
 
 # --- Game Parameters ---
 FPS = 30
@@ -45,31 +66,262 @@ GAME_MINUTES_PER_HOUR = 60
 GAME_HOURS_PER_DAY = 24
 GAME_DAYS_TO_RUN = 1 # Keep very short for testing
 SIMULATION_TOTAL_MINUTES = GAME_DAYS_TO_RUN * GAME_HOURS_PER_DAY * GAME_MINUTES_PER_HOUR
+TICK_WORKERS = 8 # Agents whose cognition runs concurrently per tick (1 = serial)
+EVENT_SCHEDULING = True # Only agents with something due run each minute; headless clocks jump to the next event
+
+# Scheduled cognition (minute of the hour)
+SUMMARY_EVERY_MINUTES = 30
+PERCEPTION_EVERY_MINUTES = 10
+EMOTION_EVERY_MINUTES = 15
+REFLECTION_MINUTE = 5
+COGNITION_MINUTES = sorted(m for m in range(60) if m % SUMMARY_EVERY_MINUTES == 0 or m % PERCEPTION_EVERY_MINUTES == 0
+                           or m % EMOTION_EVERY_MINUTES == 0 or m == REFLECTION_MINUTE)
+
+# Needs: passive drift per game minute, and the levels that trigger address_critical_need
+NEED_GROWTH_PER_MINUTE = {'hunger': 0.01, 'rest': 0.01, 'social': 0.005, 'fulfillment': 0.002}
+SICKNESS_CHANCE_PER_MINUTE = 0.0001
+# (need, level, fires above the level (else below), statuses that suppress it)
+CRITICAL_NEED_RULES = (
+    ('hunger', 7, True, ("moving", "eating", "addressing_need")),
+    ('rest', 7, True, ("moving", "resting", "addressing_need")),
+    ('social', 7, True, ("moving", "communicating", "addressing_need")),
+    ('fulfillment', 3, False, ("moving", "addressing_need")), # Low fulfillment
+)
+
+# Cognitive level of detail: low-salience agents fall back to a rule-based policy with no LLM calls
+LOD_ENABLED = False
+LOD_DEMOTE_AFTER_MINUTES = 15 # Consecutive low-salience minutes before dropping to reduced cognition
+LOD_CRITICAL_NEED = 7 # Hunger/rest/social above this promotes back to full cognition
+LOD_NEED_ACTION_THRESHOLD = 5 # Reduced agents go eat/rest once a need passes this
+LOD_MEAL_MINUTES = 20
+LOD_REST_MINUTES = 60
 
 # Ollama Configuration
 OLLAMA_MODEL = 'llama2'
 OLLAMA_EMBEDDING_MODEL = 'nomic-embed-text'
-REFLECTION_IMPORTANCE_THRESHOLD = 150
+LLM_BACKEND = "ollama" # "mock" = deterministic offline stand-in (benchmarks, runs without a server)
+SIMULATION_SEED = None # Set by --seed: each agent's random stream is seeded from (this, agent name)
+MOCK_EMBEDDING_DIM = 768
+
+# LLM request scheduling: urgent generate calls go first, background ones degrade to defaults under load
+LLM_MAX_CONCURRENT = 4 # Generate requests in flight at once (match the server's OLLAMA_NUM_PARALLEL)
+PRIORITY_CRITICAL, PRIORITY_DIALOGUE, PRIORITY_PLANNING, PRIORITY_BACKGROUND = range(4) # Lower is served first
+LLM_CALL_PRIORITY = {
+    'need_plan': PRIORITY_CRITICAL, 'reaction': PRIORITY_CRITICAL, 'reaction_context': PRIORITY_CRITICAL,
+    'dialogue': PRIORITY_DIALOGUE, 'dialogue_turn': PRIORITY_DIALOGUE, 'message_interpretation': PRIORITY_DIALOGUE, 'relationship_update': PRIORITY_DIALOGUE,
+    'daily_plan': PRIORITY_PLANNING, 'plan_decomposition': PRIORITY_PLANNING, 'object_interaction': PRIORITY_PLANNING, 'agent_summary': PRIORITY_PLANNING,
+    'emotional_update': PRIORITY_BACKGROUND, 'importance': PRIORITY_BACKGROUND, 'plan_speculation': PRIORITY_BACKGROUND,
+    'reflection_questions': PRIORITY_BACKGROUND, 'reflection_insights': PRIORITY_BACKGROUND,
+}
+# Seconds into a tick after which a class's requests get their default instead of a call (None = always served)
+LLM_LATENCY_BUDGET_SECONDS = {PRIORITY_CRITICAL: None, PRIORITY_DIALOGUE: None, PRIORITY_PLANNING: None, PRIORITY_BACKGROUND: 10.0}
+LLM_QUEUE_LIMIT = 16 # Waiting requests per class; when full, budgeted classes degrade and the rest block the caller
+
+# Structured output for the JSON call sites (object interaction, relationship update, message interpretation)
+STRUCTURED_OUTPUT_ENABLED = True # Send each call site's JSON schema as Ollama's `format` constraint (False = prompt only)
+STRUCTURED_REPAIR_RETRIES = 1 # Re-asks when required fields can't be salvaged from an answer; then defaults fill in
+FUSED_DIALOGUE_TURNS = True # One structured generation per utterance: reply, listener's reading and reaction, both relationship deltas
+
+# Speculative plan decomposition: upcoming high-level steps are decomposed in the background
+SPECULATIVE_DECOMPOSITION = True
+SPECULATIVE_LOOKAHEAD_STEPS = 2 # High-level steps after the current one decomposed ahead of time
+SPECULATIVE_WORKERS = 2 # Background threads issuing look-ahead calls (admitted by LLM_SCHEDULER as background work)
+
+# Plan templates: generated decompositions and urgent need plans reused across agents and days
+PLAN_TEMPLATES_ENABLED = True
+PLAN_TEMPLATE_CAPACITY = 1024 # Templates kept (least recently used dropped first)
+PLAN_TEMPLATE_MIN_SIMILARITY = 0.95 # Cosine between normalized step texts for a non-verbatim match
+PLAN_TEMPLATE_TTL_HOURS = 72 # Game hours a template stays usable after it was generated (None = no limit)
+PLAN_TEMPLATE_MAX_USES = 50 # Reuses before the plan is generated afresh, for some variety (None = no limit)
+
+# Local importance/emotion classifiers: nearest labelled embeddings answer routine calls, the LLM the rest
+LOCAL_CLASSIFIERS_ENABLED = True
+CLASSIFIER_FILE = "local_classifiers.npz" # Labelled examples kept across runs (None = learn from scratch each run)
+CLASSIFIER_CAPACITY = 4096 # Labelled examples kept per classifier (oldest replaced first)
+CLASSIFIER_NEIGHBORS = 5
+CLASSIFIER_MIN_SIMILARITY = 0.92 # Only labelled examples at least this close (cosine) may vote
+CLASSIFIER_MAX_IMPORTANCE_SPREAD = 1.0 # Voting importance labels must agree within this (weighted std)
+CLASSIFIER_MIN_VOTE_SHARE = 0.8 # Share of the voting weight behind the winning emotion
+CLASSIFIER_AUDIT_RATE = 0.02 # Confident predictions still sent to the LLM, to measure and correct drift
+REFLECTION_IMPORTANCE_THRESHOLD = 150 # Summed importance of memories added since the last reflection
+
+# Memory consolidation and cold-tier archival
+MEMORY_MERGE_MAX_IMPORTANCE = 2 # Repeated observations at or below this importance merge into one memory
+MEMORY_HOT_CAPACITY = 5000 # Per-agent in-memory memories before archival kicks in
+MEMORY_HOT_TARGET_FRACTION = 0.75 # Archive down to this fraction of capacity (hysteresis)
+MEMORY_ARCHIVE_MAX_IMPORTANCE = 3 # These are archived first (oldest access first), then anything oldest
+MEMORY_COLD_DIR = "memory_cold" # Per-agent on-disk cold tier (reached by reflection's per-question retrievals, see retrieve_memories)
+MEMORY_COLD_COMPACT_FRACTION = 0.25 # Rewrite a cold tier's files once this share of its rows were promoted back
+MEMORY_BUFFER_DIR = "memory_buffers" # Per-agent memory-mapped hot embedding buffers (None = keep in RAM)
+MEMORY_EMBEDDING_DTYPE = "float32" # Storage precision for embedding rows; "float16" halves it again at some scoring cost
+MEMORY_SCAN_CHUNK_ROWS = 65536 # Rows converted to float32 at a time when scoring
+
+# Approximate nearest-neighbour (IVF) relevance search over the hot store and each cold tier (where large stores end up)
+ANN_ENABLED = True
+ANN_MIN_MEMORIES = 4096 # Brute force below this many memories (per hot store / alive cold rows)
+ANN_NLIST = 0 # Number of clusters; 0 = about 4*sqrt(n) at train time
+ANN_NPROBE = 8 # Clusters scanned per query (higher = better recall, slower)
+ANN_PRIOR_CANDIDATES = 4 # Also rescore count*this best memories by recency+importance alone
+ANN_TRAIN_SAMPLE = 16384
+ANN_RETRAIN_FRACTION = 0.5 # Retrain once rows amounting to this share of the store at the last training were added
+ANN_KMEANS_ITERATIONS = 8
+ANN_SEED = 0
+
+# Standing queries: fixed retrieval strings keep an incrementally maintained candidate set per agent
+STANDING_QUERIES_ENABLED = True
+STANDING_QUERY_CANDIDATE_FACTOR = 4 # Candidates kept per requested result
+STANDING_QUERY_MIN_CANDIDATES = 64
+
+# Embedding cache (in-memory LRU in front of a persistent on-disk store)
+EMBEDDING_CACHE_SIZE = 4096 # Max entries kept in memory
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite3" # Set to None to disable persistence
+EMBEDDING_CACHE_COMMIT_EVERY = 64 # Batch disk writes; pending rows are also committed on close()
 
 # File for persisting object states
 OBJECT_STATE_FILE = "world_objects_state.json"
 
+# Full simulation checkpoints (clock, agents with memories/embeddings, world objects)
+CHECKPOINT_DIR = "checkpoint"
+CHECKPOINT_INTERVAL_MINUTES = 60 # Game minutes between periodic checkpoints (0 = only on exit)
+CHECKPOINT_VERSION = 1
+
+# Profiling (LLM call sites and tick phases)
+PROFILE_ENABLED = True
+PROFILE_FILE = "simulation_profile.json" # Written by finish_simulation (None = report only)
+PROFILE_SAMPLE_SIZE = 2048 # Latency samples kept per call site/phase for percentiles (reservoir)
+
+# Simulation log sink (streamed JSONL, rotated by size)
+SIMULATION_LOG_DIR = "."
+SIMULATION_LOG_MAX_BYTES = 64 * 1024 * 1024 # Rotate to a new part file after this many (uncompressed) bytes
+SIMULATION_LOG_GZIP = False
+SIMULATION_LOG_BATCH_SIZE = 256 # Records written per batch
+SIMULATION_LOG_QUEUE_SIZE = 10000 # Producers block when the writer falls this far behind
+SIMULATION_LOG_FLUSH_SECONDS = 1.0
+
+class SimulationLogWriter:
+    """Background sink that streams log records as compact JSONL with size-based rotation.
+
+    append() only enqueues the record, so memory use is bounded by the queue size no matter how
+    long the run is, and everything written so far survives a crash.
+    """
+    _STOP = object()
+
+    def __init__(self, log_dir=SIMULATION_LOG_DIR, max_bytes=SIMULATION_LOG_MAX_BYTES, use_gzip=SIMULATION_LOG_GZIP,
+                 batch_size=SIMULATION_LOG_BATCH_SIZE, queue_size=SIMULATION_LOG_QUEUE_SIZE):
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes
+        self.use_gzip = use_gzip
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._file_bytes = 0
+        self._run_stamp = None
+        self.paths = [] # Every part file written, in order
+        self.records_written = 0
+        self.failed = False # Set once a write fails; later records are dropped instead of queued
+        self.records_dropped = 0
+
+    def append(self, record: dict):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._worker, name="simulation-log", daemon=True)
+                    self._thread.start()
+        while not self.failed and self._thread.is_alive():
+            try:
+                self._queue.put(record, timeout=SIMULATION_LOG_FLUSH_SECONDS) # Blocks (backpressure) if the writer is behind
+                return
+            except queue.Full:
+                continue
+        self.records_dropped += 1
+
+    def _open_next_part(self):
+        if self._file is not None:
+            self._file.close()
+        if self._run_stamp is None:
+            self._run_stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            os.makedirs(self.log_dir, exist_ok=True)
+        path = os.path.join(self.log_dir, f"simulation_log_{self._run_stamp}.{len(self.paths) + 1:04d}.jsonl")
+        if self.use_gzip:
+            path += ".gz"
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+        self._file_bytes = 0
+        self.paths.append(path)
+
+    def _write_batch(self, batch):
+        if self._file is None or self._file_bytes >= self.max_bytes:
+            self._open_next_part()
+        lines = "".join(json.dumps(record, separators=(',', ':'), default=str) + "\n" for record in batch)
+        self._file.write(lines)
+        self._file.flush()
+        self._file_bytes += len(lines.encode('utf-8'))
+        self.records_written += len(batch)
+
+    def _worker(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                record = self._queue.get(timeout=SIMULATION_LOG_FLUSH_SECONDS)
+            except queue.Empty:
+                continue
+            while True:
+                if record is self._STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch and self.failed: # Keep draining so producers and close() never wait on a dead writer
+                self.records_dropped += len(batch)
+            elif batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    self.failed = True
+                    self.records_dropped += len(batch)
+                    print(f"Simulation log disabled after a write error in {self.log_dir}: {e}")
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def close(self):
+        """Drains pending records and closes the current part file."""
+        if self._thread is not None:
+            if self._thread.is_alive():
+                self._queue.put(self._STOP)
+                self._thread.join()
+            self._thread = None
+
 # Global simulation log and object registry
-SIMULATION_LOG = []
+SIMULATION_LOG = SimulationLogWriter()
 WORLD_OBJECTS = {} # To store Object instances
 
 # Global message box
 MESSAGE_BOX_MESSAGES = []
 MESSAGE_BOX_TIMER = 0
 MESSAGE_BOX_DURATION_FRAMES = 5 * FPS
+MESSAGE_BOX_LOCK = threading.Lock() # Agents may post messages from tick worker threads
 
 def show_message_box(message, color=BLACK):
     """Displays a temporary message on the screen."""
     global MESSAGE_BOX_MESSAGES, MESSAGE_BOX_TIMER
-    MESSAGE_BOX_MESSAGES.append((message, color))
-    MESSAGE_BOX_TIMER = MESSAGE_BOX_DURATION_FRAMES
-    if len(MESSAGE_BOX_MESSAGES) > 5:
-        MESSAGE_BOX_MESSAGES = MESSAGE_BOX_MESSAGES[-5:]
+    with MESSAGE_BOX_LOCK:
+        MESSAGE_BOX_MESSAGES.append((message, color))
+        MESSAGE_BOX_TIMER = MESSAGE_BOX_DURATION_FRAMES
+        if len(MESSAGE_BOX_MESSAGES) > 5:
+            MESSAGE_BOX_MESSAGES = MESSAGE_BOX_MESSAGES[-5:]
 
 # --- Map Definition ---
 # Added 'provides_food', 'provides_rest' flags to locations
@@ -105,6 +357,8 @@ LOCATIONS = {
     "Town_South": {'rect': pygame.Rect(0, 790, SCREEN_WIDTH, SCREEN_HEIGHT-790), 'color': (240,240,240), 'parent': 'World', 'objects': []},
     "World": {'rect': pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT), 'color': (255,255,255), 'parent': None, 'objects': []}
 }
+for loc_name, loc_data in LOCATIONS.items(): # Add location name to its own data
+    loc_data['name'] = loc_name
 
 # --- Object Class Definition ---
 class WorldObject:
@@ -137,6 +391,56 @@ class WorldObject:
             obj.current_user = agents_dict.get(data['current_user_name'])
         return obj
 
+# --- World State Index ---
+class LocationIndex:
+    """Incrementally maintained location -> agents and location -> objects maps.
+
+    Agents move in via update_position (deferred like other world mutations, so a concurrent
+    tick sees the tick-start occupancy); objects are added when created or loaded.
+    """
+    def __init__(self):
+        self._agents = {} # location -> {agent name: agent}, arrival order
+        self._agent_locations = {} # agent name -> indexed location
+        self._objects = {} # location -> [WorldObject], creation order
+
+    def place_agent(self, agent, location_name: str):
+        previous = self._agent_locations.get(agent.name)
+        if previous == location_name:
+            return
+        if previous is not None:
+            self._agents[previous].pop(agent.name, None)
+        self._agents.setdefault(location_name, {})[agent.name] = agent
+        self._agent_locations[agent.name] = location_name
+
+    def remove_agent(self, agent):
+        previous = self._agent_locations.pop(agent.name, None)
+        if previous is not None:
+            self._agents[previous].pop(agent.name, None)
+
+    def clear_agents(self):
+        self._agents.clear()
+        self._agent_locations.clear()
+
+    def agents_at(self, location_name: str) -> list:
+        return list(self._agents.get(location_name, {}).values())
+
+    def add_object(self, obj):
+        self._objects.setdefault(obj.location_name, []).append(obj)
+
+    def rebuild_objects(self, world_objects: dict):
+        self._objects.clear()
+        for obj in world_objects.values():
+            self.add_object(obj)
+
+    def objects_at(self, location_name: str) -> list:
+        return self._objects.get(location_name, [])
+
+WORLD_INDEX = LocationIndex()
+
+def register_world_object(obj):
+    WORLD_OBJECTS[obj.id] = obj
+    WORLD_INDEX.add_object(obj)
+
 def initialize_world_objects(agents_dict=None): # Now accepts agents_dict for resolving users
     global WORLD_OBJECTS
     if os.path.exists(OBJECT_STATE_FILE):
@@ -144,16 +448,16 @@ def initialize_world_objects(agents_dict=None): # Now accepts agents_dict for re
             with open(OBJECT_STATE_FILE, 'r') as f:
                 objects_data = json.load(f)
                 WORLD_OBJECTS = {obj_id: WorldObject.from_dict(data, agents_dict) for obj_id, data in objects_data.items()}
+                WORLD_INDEX.rebuild_objects(WORLD_OBJECTS)
                 print(f"Loaded {len(WORLD_OBJECTS)} object states from {OBJECT_STATE_FILE}")
                 return
         except Exception as e:
             print(f"Error loading object states: {e}. Initializing fresh.")
             WORLD_OBJECTS = {} # Reset if error
+    WORLD_INDEX.rebuild_objects(WORLD_OBJECTS)
 
     # If no file or error, initialize from LOCATIONS
     for loc_name, loc_data in LOCATIONS.items():
-        # Add location name to its own data
-        LOCATIONS[loc_name]['name'] = loc_name
         if loc_data.get('objects'):
             for obj_name in loc_data['objects']:
                 obj_id = f"{loc_name}_{obj_name}"
@@ -164,66 +468,427 @@ def initialize_world_objects(agents_dict=None): # Now accepts agents_dict for re
                 if "bed" in obj_name: props = {'is_occupied': False}
                 if "bench" in obj_name or "table" in obj_name: can_multiple = True
                 
-                WORLD_OBJECTS[obj_id] = WorldObject(obj_name, loc_name, properties=props, can_be_used_by_multiple_agents=can_multiple)
+                register_world_object(WorldObject(obj_name, loc_name, properties=props, can_be_used_by_multiple_agents=can_multiple))
     print(f"Initialized {len(WORLD_OBJECTS)} fresh object states.")
 
 
-def save_world_objects():
-    with open(OBJECT_STATE_FILE, 'w') as f:
+def save_world_objects(serializable_objects=None):
+    if serializable_objects is None:
         serializable_objects = {obj_id: obj.to_dict() for obj_id, obj in WORLD_OBJECTS.items()}
+    with open(OBJECT_STATE_FILE, 'w') as f:
         json.dump(serializable_objects, f, indent=2)
     # print(f"Saved {len(WORLD_OBJECTS)} object states to {OBJECT_STATE_FILE}")
 
 # --- Game Time Management ---
-current_datetime = datetime(2023, 2, 13, 7, 0, 0) # Start at 7 AM, Feb 13, 2023
+GAME_START_DATETIME = datetime(2023, 2, 13, 7, 0, 0) # Start at 7 AM, Feb 13, 2023 (Day 1)
+current_datetime = GAME_START_DATETIME
 game_day, game_hour, game_minute = 0,0,0 # Will be updated
 
 def get_current_game_time_as_datetime():
     return current_datetime
 
-def advance_game_time(minutes=1):
+def game_day_of(dt_obj: datetime) -> int:
+    return (dt_obj.date() - GAME_START_DATETIME.date()).days + 1 # Feb 13 is Day 1; keeps counting across months
+
+def set_game_time(dt_obj: datetime):
     global current_datetime, game_day, game_hour, game_minute
-    current_datetime += timedelta(minutes=minutes)
-    game_day = current_datetime.day - 12 # Assuming Feb 13 is Day 1
+    current_datetime = dt_obj
+    game_day = game_day_of(current_datetime)
     game_hour = current_datetime.hour
     game_minute = current_datetime.minute
 
+def advance_game_time(minutes=1):
+    set_game_time(current_datetime + timedelta(minutes=minutes))
+
+# --- Profiling ---
+class _TimingStat:
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, seconds: float, rng: random.Random):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < PROFILE_SAMPLE_SIZE:
+            self.samples.append(seconds)
+        else: # Reservoir sampling keeps percentiles honest on long runs
+            slot = rng.randrange(self.count)
+            if slot < PROFILE_SAMPLE_SIZE:
+                self.samples[slot] = seconds
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+        return {'count': self.count, 'total_s': self.total, 'mean_ms': 1000 * self.total / self.count if self.count else 0.0,
+                'p50_ms': 1000 * pick(0.5), 'p95_ms': 1000 * pick(0.95), 'max_ms': 1000 * self.max}
+
+class Profiler:
+    """Thread-safe counters for LLM call sites (latency, sizes, errors, fallbacks) and timed phases."""
+    def __init__(self, enabled=PROFILE_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._rng = random.Random(0) # Own RNG so profiling never perturbs the simulation's random stream
+        self.started = time.perf_counter()
+        self.calls = {} # call site -> _TimingStat
+        self.call_sizes = {} # call site -> {'prompt_chars', 'response_chars', 'errors', 'fallbacks'}
+        self.parses = {} # call site -> {'clean', 'salvaged', 'repaired', 'failed'} (structured output)
+        self.phases = {} # phase name -> _TimingStat
+
+    def record_call(self, call_site: str, seconds: float, prompt_chars: int = 0, response_chars: int = 0, error: bool = False, fallback: bool = False):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.calls.setdefault(call_site, _TimingStat()).add(seconds, self._rng)
+            sizes = self.call_sizes.setdefault(call_site, {'prompt_chars': 0, 'response_chars': 0, 'errors': 0, 'fallbacks': 0})
+            sizes['prompt_chars'] += prompt_chars
+            sizes['response_chars'] += response_chars
+            sizes['errors'] += error
+            sizes['fallbacks'] += fallback
+
+    def record_fallback(self, call_site: str):
+        """Counts a response that could not be used and was replaced by a default."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.call_sizes.setdefault(call_site, {'prompt_chars': 0, 'response_chars': 0, 'errors': 0, 'fallbacks': 0})['fallbacks'] += 1
+
+    def record_parse(self, call_site: str, outcome: str):
+        """Counts how a structured answer was parsed: clean, salvaged, repaired (after a re-ask) or failed."""
+        if not self.enabled:
+            return
+        with self._lock:
+            counts = self.parses.setdefault(call_site, {'clean': 0, 'salvaged': 0, 'repaired': 0, 'failed': 0})
+            counts[outcome] += 1
+
+    def record_phase(self, phase: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.phases.setdefault(phase, _TimingStat()).add(seconds, self._rng)
+
+    def phase(self, name: str):
+        return _PhaseTimer(self, name)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'wall_s': time.perf_counter() - self.started,
+                'llm_calls': {site: {**stat.summary(), **self.call_sizes.get(site, {})} for site, stat in self.calls.items()},
+                'phases': {name: stat.summary() for name, stat in self.phases.items()},
+                'structured_output': {site: dict(counts) for site, counts in self.parses.items()},
+            }
+
+    def report(self) -> str:
+        profile = self.to_dict()
+        lines = [f"--- Profile ({profile['wall_s']:.1f}s wall) ---",
+                 f"{'LLM call site':<28}{'calls':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}{'prompt':>10}{'resp':>8}{'err':>6}{'fallbk':>7}"]
+        for site, stat in sorted(profile['llm_calls'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f"{site:<28}{stat['count']:>8}{stat['total_s']:>10.2f}{stat['mean_ms']:>10.1f}{stat['p95_ms']:>10.1f}"
+                         f"{stat['prompt_chars'] // max(1, stat['count']):>10}{stat['response_chars'] // max(1, stat['count']):>8}{stat['errors']:>6}{stat['fallbacks']:>7}")
+        if profile['structured_output']:
+            lines.append(f"{'Structured output':<28}{'clean':>8}{'salvaged':>10}{'repaired':>10}{'failed':>8}")
+            for site, counts in sorted(profile['structured_output'].items()):
+                lines.append(f"{site:<28}{counts['clean']:>8}{counts['salvaged']:>10}{counts['repaired']:>10}{counts['failed']:>8}")
+        lines.append(f"{'Phase (agent phases summed over workers)':<44}{'count':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}")
+        for name, stat in sorted(profile['phases'].items(), key=lambda item: -item[1]['total_s']):
+            lines.append(f"{name:<44}{stat['count']:>8}{stat['total_s']:>10.2f}{stat['mean_ms']:>10.3f}{stat['p95_ms']:>10.3f}")
+        return "\n".join(lines)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+class _PhaseTimer:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+PROFILER = Profiler()
+
+# --- LLM Request Scheduling ---
+class LLMRequestScheduler:
+    """Admits generate calls in priority order, at most max_concurrent at a time.
+
+    Classes with a latency budget (see LLM_LATENCY_BUDGET_SECONDS) are refused once the current tick
+    has run past it, or when their queue is full, so callers can substitute a default and the tick
+    stays bounded. Classes without one always get through, waiting for a slot (backpressure).
+    """
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT, budgets=None, queue_limit=LLM_QUEUE_LIMIT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.budgets = dict(LLM_LATENCY_BUDGET_SECONDS if budgets is None else budgets)
+        self.queue_limit = queue_limit
+        self._cond = threading.Condition()
+        self._waiting = [] # Heap of (priority, ticket)
+        self._queued = {} # priority -> waiting requests
+        self._tickets = 0
+        self._in_flight = 0
+        self.tick_started = time.perf_counter()
+        self.stats = {} # priority -> {'served', 'degraded', 'queue_full', 'wait_s'}
+
+    def begin_tick(self):
+        with self._cond:
+            self.tick_started = time.perf_counter()
+
+    def _stat(self, priority):
+        return self.stats.setdefault(priority, {'served': 0, 'degraded': 0, 'queue_full': 0, 'wait_s': 0.0})
+
+    def _budget_left(self, priority):
+        budget = self.budgets.get(priority)
+        return None if budget is None else budget - (time.perf_counter() - self.tick_started)
+
+    def acquire(self, priority: int) -> bool:
+        """Blocks until the request may be sent (True) or it should use its default instead (False)."""
+        start = time.perf_counter()
+        with self._cond:
+            stat = self._stat(priority)
+            budget_left = self._budget_left(priority)
+            if budget_left is not None and (budget_left <= 0 or self._queued.get(priority, 0) >= self.queue_limit):
+                stat['degraded'] += 1
+                stat['queue_full'] += budget_left > 0
+                return False
+            while self._queued.get(priority, 0) >= self.queue_limit:
+                self._cond.wait()
+            self._tickets += 1
+            entry = (priority, self._tickets)
+            heapq.heappush(self._waiting, entry)
+            self._queued[priority] = self._queued.get(priority, 0) + 1
+            while self._in_flight >= self.max_concurrent or self._waiting[0] != entry:
+                budget_left = self._budget_left(priority)
+                if budget_left is not None and budget_left <= 0: # Ran out of tick while queued
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._queued[priority] -= 1
+                    stat['degraded'] += 1
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(budget_left)
+            heapq.heappop(self._waiting)
+            self._queued[priority] -= 1
+            self._in_flight += 1
+            stat['served'] += 1
+            stat['wait_s'] += time.perf_counter() - start
+            self._cond.notify_all() # The next head may also fit
+            return True
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def report(self) -> str:
+        names = {PRIORITY_CRITICAL: "critical", PRIORITY_DIALOGUE: "dialogue", PRIORITY_PLANNING: "planning", PRIORITY_BACKGROUND: "background"}
+        with self._cond:
+            parts = [f"{names.get(priority, priority)} {stat['served']} served"
+                     f" ({1000 * stat['wait_s'] / max(1, stat['served']):.0f} ms mean wait), {stat['degraded']} degraded"
+                     + (f" ({stat['queue_full']} queue full)" if stat['queue_full'] else "")
+                     for priority, stat in sorted(self.stats.items())]
+        return "LLM requests: " + ("; ".join(parts) or "none")
+
+LLM_SCHEDULER = LLMRequestScheduler()
+_LLM_CALL_STATE = threading.local() # Whether this thread's last generate call was degraded or failed
+
+def last_call_degraded() -> bool:
+    return getattr(_LLM_CALL_STATE, 'degraded', False)
+
+def last_call_errored() -> bool:
+    """True when this thread's last generate call failed and returned the canned mock response instead."""
+    return getattr(_LLM_CALL_STATE, 'errored', False)
+
 # --- Ollama Integration Functions ---
-def _call_ollama(prompt: str, agent_name: str = "Agent") -> str:
-    """Makes a call to the local Ollama server for text generation."""
+def _call_ollama(prompt: str, agent_name: str = "Agent", call_site: str = "generate", default: str = None, format=None) -> str:
+    """Makes a call to the local Ollama server for text generation (timed per call_site in PROFILER).
+
+    Requests are admitted by LLM_SCHEDULER at the call site's priority; a degraded request returns
+    `default` (or the canned mock response) without calling the server. `format` ("json" or a JSON
+    schema dict) constrains the server's output.
+    """
+    _LLM_CALL_STATE.errored = False
+    _LLM_CALL_STATE.degraded = not LLM_SCHEDULER.acquire(LLM_CALL_PRIORITY.get(call_site, PRIORITY_PLANNING))
+    if _LLM_CALL_STATE.degraded:
+        PROFILER.record_fallback(call_site)
+        return default if default is not None else _mock_ollama_response(prompt, agent_name)
+    start = time.perf_counter()
     try:
         # print(f"\n--- Ollama Prompt for {agent_name} ---\n{prompt}\n--- End ---")
-        response = ollama.generate(model=OLLAMA_MODEL, prompt=prompt, stream=False)
+        response = LLM_CLIENT.generate(model=OLLAMA_MODEL, prompt=prompt, stream=False, **({'format': format} if format is not None else {}))
         # print(f"--- Ollama Resp for {agent_name} ---\n{response['response'].strip()}\n--- End ---")
-        return response['response'].strip()
+        text = response['response'].strip()
+        PROFILER.record_call(call_site, time.perf_counter() - start, len(prompt), len(text))
+        return text
     except Exception as e:
         print(f"Error calling Ollama Gen for {agent_name}: {e}")
         show_message_box(f"Ollama Gen Error: {e}", RED)
-        return _mock_ollama_response(prompt, agent_name) # Fallback
+        text = _mock_ollama_response(prompt, agent_name) # Fallback
+        _LLM_CALL_STATE.errored = True
+        PROFILER.record_call(call_site, time.perf_counter() - start, len(prompt), len(text), error=True, fallback=True)
+        return text
+    finally:
+        LLM_SCHEDULER.release()
+
+class EmbeddingCache:
+    """Bounded LRU of embeddings keyed by (model, text), backed by a SQLite file so restarts stay warm."""
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, db_path=EMBEDDING_CACHE_FILE):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._uncommitted = 0
+        self.hits = 0 # Served from memory
+        self.disk_hits = 0 # Served from the on-disk store (then promoted to memory)
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha1(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        if self._db is None and self.db_path:
+            try:
+                self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB)")
+            except sqlite3.Error as e:
+                print(f"Embedding cache disabled persistence ({self.db_path}): {e}")
+                self.db_path = None
+                self._db = None
+        return self._db
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, model: str, text: str):
+        key = self.make_key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            db = self._connect()
+            if db is not None:
+                row = db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, model: str, text: str, embedding):
+        key = self.make_key(model, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            db = self._connect()
+            if db is not None:
+                db.execute("INSERT OR REPLACE INTO embeddings (key, model, vector) VALUES (?, ?, ?)", (key, model, vector.tobytes()))
+                self._uncommitted += 1
+                if self._uncommitted >= EMBEDDING_CACHE_COMMIT_EVERY:
+                    db.commit()
+                    self._uncommitted = 0
+        return vector
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries_in_memory': len(self._entries)}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+EMBEDDING_CACHE = EmbeddingCache()
+ZERO_EMBEDDING = np.zeros(768, dtype=np.float32) # Shared error fallback (common dimension for nomic-embed-text)
+ZERO_EMBEDDING.flags.writeable = False
 
 def _call_ollama_embedding(text: str, agent_name: str = "Agent") -> list[float]:
-    """Makes a call to the local Ollama server for embeddings."""
+    """Makes a call to the local Ollama server for embeddings (served from EMBEDDING_CACHE when possible)."""
+    cached = EMBEDDING_CACHE.get(OLLAMA_EMBEDDING_MODEL, text)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
     try:
-        response = ollama.embeddings(model=OLLAMA_EMBEDDING_MODEL, prompt=text)
-        return response['embedding']
+        response = LLM_CLIENT.embeddings(model=OLLAMA_EMBEDDING_MODEL, prompt=text)
+        PROFILER.record_call("embedding", time.perf_counter() - start, len(text))
+        return EMBEDDING_CACHE.put(OLLAMA_EMBEDDING_MODEL, text, response['embedding'])
     except Exception as e:
+        PROFILER.record_call("embedding", time.perf_counter() - start, len(text), error=True, fallback=True)
         print(f"Error calling Ollama Embed for {agent_name}: {e}")
         show_message_box(f"Ollama Embed Error: {e}", RED)
-        return [0.0] * 768 # Common embedding dimension for nomic-embed-text
+        return ZERO_EMBEDDING
+
+def _call_ollama_embeddings_batch(texts: list[str], agent_name: str = "Agent") -> list:
+    """Embeds many texts with a single batched Ollama request (cache hits and duplicates are not re-sent)."""
+    results = [EMBEDDING_CACHE.get(OLLAMA_EMBEDDING_MODEL, text) for text in texts]
+    to_embed = list(dict.fromkeys(text for text, vec in zip(texts, results) if vec is None)) # Unique, order kept
+    if to_embed:
+        start = time.perf_counter()
+        try:
+            response = LLM_CLIENT.embed(model=OLLAMA_EMBEDDING_MODEL, input=to_embed)
+            PROFILER.record_call("embedding_batch", time.perf_counter() - start, sum(map(len, to_embed)))
+            embedded = {text: EMBEDDING_CACHE.put(OLLAMA_EMBEDDING_MODEL, text, vec) for text, vec in zip(to_embed, response['embeddings'])}
+        except Exception as e:
+            PROFILER.record_call("embedding_batch", time.perf_counter() - start, sum(map(len, to_embed)), error=True, fallback=True)
+            print(f"Error calling Ollama batch Embed for {agent_name} ({len(to_embed)} texts): {e}")
+            show_message_box(f"Ollama Embed Error: {e}", RED)
+            embedded = {}
+        results = [vec if vec is not None else embedded.get(text, ZERO_EMBEDDING) for text, vec in zip(texts, results)]
+    return results
+
+def flush_pending_embeddings(agents):
+    """Resolves every agent's deferred memory embeddings with one batched embed call (run once per tick)."""
+    pending = [(agent, idx, text, unscored) for agent in agents for idx, text, unscored in agent.pending_embeddings]
+    if not pending:
+        return
+    vectors = _call_ollama_embeddings_batch([text for _, _, text, _ in pending], "Tick")
+    for (agent, idx, text, unscored), vec in zip(pending, vectors):
+        if unscored: # Added without a score: classified from the batched vector
+            agent.score_deferred_memory(idx, text, vec)
+        agent.memory_store.set_embedding(idx, vec)
+    for agent in agents:
+        agent.pending_embeddings.clear()
 
 def _mock_ollama_response(prompt: str, agent_name: str = "Agent") -> str:
     """ Fallback mock responses. Updated for new features. """
-    if "rate the likely poignancy" in prompt: return str(random.randint(3, 7))
+    if "rate the likely poignancy" in prompt: # 3-7, the same for a memory text whoever asks
+        return str(3 + hashlib.sha1(prompt.split("Memory:", 1)[-1].encode('utf-8')).digest()[0] % 5)
     if "Sketch out a plan for the day" in prompt:
         return "1. Morning routine. 2. Go to work and interact with objects. 3. Lunch break (fulfill hunger). 4. Continue work, considering relationships. 5. Evening relaxation, update emotional state."
     if "Decompose this high-level plan step" in prompt:
         if "interact with objects" in prompt: return "1. Walk to workbench. 2. Use workbench for 10 minutes. 3. Check tool_rack status."
         if "fulfill hunger" in prompt: return "1. Walk to Farmer_Shop. 2. Buy apple from produce_stand. 3. Eat apple."
-        return "1. Initiate sub-task A. 2. Perform sub-task B. 3. Complete sub-task C."
+        return "1. Initiate sub-task A. 2. Perform sub-task B for 15 minutes. 3. Complete sub-task C."
+    if "takes it, in one JSON object" in prompt:
+        return ("{\"utterance\": \"Interesting. Tell me more.\", \"intent\": \"The sender is sharing information.\", \"tone\": \"friendly\", "
+                "\"listener_reacts\": false, \"listener_reaction\": \"\", \"speaker_friendship_delta\": 5, \"speaker_trust_delta\": 2, "
+                "\"listener_friendship_delta\": 5, \"listener_trust_delta\": 2, \"importance\": 4}")
     if "Should they react?" in prompt:
         return "No, continue current plan."
     if "interpreting the message" in prompt:
-        return "Intent: The sender is sharing information. Tone: friendly."
+        return "{\"intent\": \"The sender is sharing information.\", \"tone\": \"friendly\"}"
     if "What are 3 most salient high-level questions" in prompt:
         return "1. How can I improve my skills today? 2. How are my relationships affecting my mood? 3. What object interaction would be most beneficial now?"
     if "What 5 high-level insights can you infer" in prompt:
@@ -234,15 +899,53 @@ def _mock_ollama_response(prompt: str, agent_name: str = "Agent") -> str:
     if "core characteristics" in prompt: return f"{agent_name} is a complex individual with evolving traits."
     if "current daily occupation" in prompt: return "Engaging in varied tasks and interactions."
     if "feeling about his recent progress" in prompt: return "Feeling content with personal growth and social bonds."
-    if "What happens to the state of" in prompt: return "{\"agent_outcome\": \"Agent used the object successfully.\", \"object_new_state\": \"used\", \"object_property_changes\": {\"count\": 9}}"
-    if "What is the new emotional state" in prompt: return "neutral"
-    if "How should the relationship scores" in prompt: return "friendship_delta: +5; trust_delta: +2"
-    if "What should" in prompt and "do to fulfill the need for" in prompt:
+    if "Object's current state" in prompt: return "{\"agent_outcome\": \"Agent used the object successfully.\", \"object_new_state\": \"used\", \"object_property_changes\": {\"count\": 9}}"
+    if "new emotional state" in prompt: return "neutral"
+    if "How should these scores change" in prompt: return "{\"friendship_delta\": 5, \"trust_delta\": 2}"
+    if "to fulfill this need for" in prompt:
         if "hunger" in prompt: return "1. Go to Farmer_Shop. 2. Buy food from produce_stand. 3. Eat food."
         if "rest" in prompt: return "1. Go to Handyman_Workshop. 2. Use bed. 3. Sleep for 60 minutes."
         return "1. Identify resource. 2. Go to resource. 3. Use resource."
     return "Ollama mock response: Processed with new logic."
 
+class MockLLMBackend:
+    """Drop-in for the ollama client: canned _mock_ollama_response text and fixed per-text embeddings."""
+    def __init__(self, dim=MOCK_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little') # Same text -> same vector, every run
+        vec = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vec / np.linalg.norm(vec)
+
+    def generate(self, model, prompt, stream=False, **kwargs):
+        return {'model': model, 'response': _mock_ollama_response(prompt)}
+
+    def embeddings(self, model, prompt, **kwargs):
+        return {'embedding': self._vector(prompt)}
+
+    def embed(self, model, input, **kwargs):
+        texts = [input] if isinstance(input, str) else input
+        return {'model': model, 'embeddings': [self._vector(text) for text in texts]}
+
+LLM_CLIENT = MockLLMBackend() if LLM_BACKEND == "mock" else ollama
+
+def set_llm_backend(name: str, seed: int = None):
+    """Selects "ollama" or "mock"; a seed also fixes the simulation's random streams (see agent_rng)."""
+    global LLM_BACKEND, LLM_CLIENT, SIMULATION_SEED
+    if name not in ("ollama", "mock"):
+        raise ValueError(f"Unknown LLM backend: {name}")
+    LLM_BACKEND = name
+    LLM_CLIENT = MockLLMBackend() if name == "mock" else ollama
+    SIMULATION_SEED = seed
+    if seed is not None:
+        random.seed(seed)
+
+def agent_rng(name: str) -> random.Random:
+    """An agent's own random stream, seeded from (SIMULATION_SEED, name): what it draws does not depend on
+    which thread, shard or tick order runs it (unseeded without a SIMULATION_SEED)."""
+    return random.Random(None if SIMULATION_SEED is None else f"{SIMULATION_SEED}:{name}")
+
 def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
     """Calculates cosine similarity between two vectors."""
     vec1 = np.array(vec1)
@@ -254,71 +957,1457 @@ def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
     if norm_a == 0 or norm_b == 0: return 0.0
     return dot_product / (norm_a * norm_b)
 
-# --- New Ollama Call Functions for Enhanced Sophistication ---
-def call_ollama_for_emotional_update(agent_name: str, current_emotion: str, recent_events_summary: str) -> str:
-    prompt = (
-        f"Agent {agent_name}'s current emotional state is '{current_emotion}'.\n"
-        f"Recent significant events for {agent_name}:\n{recent_events_summary}\n"
-        f"Based on these events, what is {agent_name}'s new emotional state? (Choose from: neutral, happy, sad, angry, surprised, anxious, content). Respond with only the emotional state."
-    )
-    return _call_ollama(prompt, agent_name).lower()
+def _parse_numbered_list(text: str) -> list[str]:
+    """Splits '1. foo 2. bar' or one-item-per-line LLM output into clean items."""
+    items = re.split(r'(?:^|\s)\d+[.)]\s+', text.strip())
+    items = [item.strip() for item in items if item.strip()]
+    if len(items) <= 1: # Not numbered; fall back to one item per (optionally bulleted) line
+        items = [line.strip().lstrip('-*').strip() for line in text.split('\n') if line.strip()]
+    return items
+
+# --- Structured Output ---
+RELATIONSHIP_UPDATE_SCHEMA = {
+    'type': 'object',
+    'properties': {'friendship_delta': {'type': 'number'}, 'trust_delta': {'type': 'number'}},
+    'required': ['friendship_delta', 'trust_delta'],
+}
+MESSAGE_INTERPRETATION_SCHEMA = {
+    'type': 'object',
+    'properties': {'intent': {'type': 'string'}, 'tone': {'type': 'string'}},
+    'required': ['intent', 'tone'],
+}
+DIALOGUE_TURN_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'utterance': {'type': 'string'}, 'intent': {'type': 'string'}, 'tone': {'type': 'string'},
+        'listener_reacts': {'type': 'boolean'}, 'listener_reaction': {'type': 'string'},
+        'speaker_friendship_delta': {'type': 'number'}, 'speaker_trust_delta': {'type': 'number'},
+        'listener_friendship_delta': {'type': 'number'}, 'listener_trust_delta': {'type': 'number'},
+        'importance': {'type': 'number'},
+    },
+    'required': ['utterance', 'intent', 'tone', 'listener_reacts', 'speaker_friendship_delta', 'speaker_trust_delta',
+                 'listener_friendship_delta', 'listener_trust_delta'],
+}
+OBJECT_INTERACTION_SCHEMA = {
+    'type': 'object',
+    'properties': {'agent_outcome': {'type': 'string'}, 'object_new_state': {'type': 'string'}, 'object_property_changes': {'type': 'object'}},
+    'required': ['agent_outcome', 'object_new_state'],
+}
+
+_JSON_FENCE = re.compile(r'```(?:json)?\s*(.*?)(?:```|$)', re.S | re.I)
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+_LEADING_NUMBER = re.compile(r'\s*([-+]?\d+(?:\.\d+)?)')
+_BARE_KEY = re.compile(r'([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:')
+_PYTHON_DICT_START = re.compile(r"\{\s*'")
+
+def _balanced_json_object(text: str):
+    """The first {...} in text; braces and a string left open by a truncated answer are closed."""
+    start = text.find('{')
+    if start < 0:
+        return None
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped: escaped = False
+            elif ch == '\\': escaped = True
+            elif ch == '"': in_string = False
+        elif ch == '"': in_string = True
+        elif ch == '{': depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:].rstrip().rstrip(',') + ('"' if in_string else '') + '}' * depth
+
+def _loads_lenient(candidate: str):
+    """json.loads, retried once with trailing commas dropped and bare keys quoted; None unless a dict."""
+    for attempt in (candidate, _BARE_KEY.sub(r'\1"\2":', _TRAILING_COMMA.sub(r'\1', candidate))):
+        try:
+            value = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        return value if isinstance(value, dict) else None
+    return None
+
+def _key_value_fields(text: str, schema: dict) -> dict:
+    """Loose "key: value" pairs (e.g. 'friendship_delta: +5; trust_delta: -2') for the schema's scalar fields.
+
+    Numbers and booleans end at the first ; , newline or }; strings run on (commas and all) to the next known key.
+    """
+    keys = [key for key, spec in schema['properties'].items() if spec.get('type') != 'object']
+    next_key = rf'["\']?\b(?:{"|".join(re.escape(key) for key in keys)})\b["\']?\s*[:=]'
+    found = {}
+    for key in keys:
+        if schema['properties'][key].get('type') == 'string':
+            end = rf'[\s;,]*{next_key}|\s*}}|\s*$'
+        else:
+            end = rf'[;,\n}}]|{next_key}|$'
+        match = re.search(rf'["\']?\b{re.escape(key)}\b["\']?\s*[:=]\s*(.+?)\s*(?={end})', text, re.I | re.S)
+        if match:
+            found[key] = match.group(1).strip().strip('"\'').rstrip('.').strip()
+    return found
+
+def _coerce_to_schema(data: dict, schema: dict) -> tuple[dict, bool]:
+    """Keeps the fields whose values fit their schema type ('+5' is a number); (fields, all required present)."""
+    fields = {}
+    for key, spec in schema['properties'].items():
+        if key not in data:
+            continue
+        value, kind = data[key], spec.get('type')
+        if kind == 'number':
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields[key] = float(value)
+            elif (match := _LEADING_NUMBER.match(str(value))): # '+5', or '2. The interaction was positive'
+                fields[key] = float(match.group(1))
+        elif kind == 'object':
+            if isinstance(value, dict):
+                fields[key] = value
+        elif kind == 'boolean':
+            if isinstance(value, bool) or str(value).strip().lower() in ('true', 'false', 'yes', 'no'):
+                fields[key] = value if isinstance(value, bool) else str(value).strip().lower() in ('true', 'yes')
+        elif value is not None and str(value).strip():
+            fields[key] = str(value).strip()
+    return fields, all(key in fields for key in schema.get('required', []))
+
+def extract_structured(text: str, schema: dict) -> tuple[dict, bool, bool]:
+    """Best-effort fields from an answer that should be a JSON object matching schema.
+
+    Tries a strict parse first, then the first balanced object (code fences, trailing commas, bare or
+    single-quoted keys and truncation tolerated), topped up with loose "key: value" pairs.
+    Returns (fields, complete, clean) where clean means the whole answer was valid JSON.
+    """
+    text = text.strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if isinstance(data, dict):
+        fields, complete = _coerce_to_schema(data, schema)
+        if complete:
+            return fields, True, True
+    fenced = _JSON_FENCE.search(text)
+    body = fenced.group(1) if fenced else text
+    start = body.find('{')
+    if '"' not in body and start >= 0 and _PYTHON_DICT_START.match(body, start): # Python-style dict; prose keeps its apostrophes
+        body = body[:start] + body[start:].replace("'", '"')
+    candidate = _balanced_json_object(body)
+    data = {**_key_value_fields(body, schema), **((_loads_lenient(candidate) if candidate else None) or {})}
+    fields, complete = _coerce_to_schema(data, schema)
+    return fields, complete, False
+
+def call_ollama_structured(prompt: str, agent_name: str, call_site: str, schema: dict, defaults: dict) -> dict:
+    """Generates a JSON object for schema, salvaging what it can; missing fields come from defaults.
+
+    When required fields can't be recovered the model is re-asked (with its bad answer) up to
+    STRUCTURED_REPAIR_RETRIES times. Outcomes are counted per call site with PROFILER.record_parse.
+    """
+    fields, request = {}, prompt
+    for attempt in range(1 + STRUCTURED_REPAIR_RETRIES):
+        text = _call_ollama(request, agent_name, call_site, default="", format=schema if STRUCTURED_OUTPUT_ENABLED else None)
+        if last_call_degraded(): # Already counted as a fallback
+            return {**defaults, **fields}
+        if last_call_errored(): # The canned mock answer stands in for the model's (already counted as a fallback)
+            PROFILER.record_parse(call_site, "failed")
+            return {**defaults, **extract_structured(text, schema)[0], **fields}
+        found, complete, clean = extract_structured(text, schema)
+        fields.update(found)
+        if complete or all(key in fields for key in schema['required']):
+            PROFILER.record_parse(call_site, "repaired" if attempt else "clean" if clean else "salvaged")
+            return {**defaults, **fields}
+        request = (f"{prompt}\nYour previous answer could not be parsed: {text[:300]!r}\n"
+                   f"Respond with only a JSON object with the fields {', '.join(schema['required'])}.")
+    PROFILER.record_parse(call_site, "failed")
+    PROFILER.record_fallback(call_site)
+    return {**defaults, **fields}
+
+# --- Ollama Call Functions (Generative Agents memory, planning and dialogue prompts) ---
+def call_ollama_for_importance_score(memory_description: str, agent_name: str, fallback: int = 3) -> int:
+    prompt = (
+        f"On the scale of 1 to 10, where 1 is purely mundane (e.g., brushing teeth, making bed) and 10 is extremely poignant "
+        f"(e.g., a break up, college acceptance), rate the likely poignancy of the following piece of memory for {agent_name}.\n"
+        f"Memory: {memory_description}\nRespond with only the rating (a single integer)."
+    )
+    response = _call_ollama(prompt, agent_name, "importance", default=str(fallback))
+    match = re.search(r'\d+', response)
+    if not match:
+        PROFILER.record_fallback("importance")
+    return max(1, min(10, int(match.group()))) if match else 3
+
+def call_ollama_for_agent_summary_component(agent_name: str, query: str, memories_text: str) -> str:
+    prompt = (
+        f"Statements about {agent_name}:\n{memories_text}\n"
+        f"How would one describe {query} given the statements above? Respond in one or two sentences."
+    )
+    return _call_ollama(prompt, agent_name, "agent_summary")
+
+def call_ollama_for_planning(agent_name: str, role: str, agent_summary: str, previous_day_summary: str, day: int, hour: int) -> list[str]:
+    prompt = (
+        f"{agent_summary}\n{previous_day_summary}\n"
+        f"Today is day {day} and it is {hour:02d}:00. {agent_name} is the town's {role}.\n"
+        f"Sketch out a plan for the day for {agent_name} in broad strokes (5-8 steps). Respond as a numbered list."
+    )
+    return _parse_numbered_list(_call_ollama(prompt, agent_name, "daily_plan"))
+
+def call_ollama_for_decompose_plan_step(agent_name: str, high_level_step: str, agent_summary: str, current_location: str, dt_obj: datetime, call_site: str = "plan_decomposition") -> list[str]:
+    prompt = (
+        f"{agent_summary}\nCurrently at: {current_location}\nTime: {dt_obj.strftime('%A, %B %d, %Y, %I:%M %p')}\n"
+        f"Known locations: {', '.join(name for name in LOCATIONS if 'Town_' not in name and name != 'World')}\n"
+        f"Decompose this high-level plan step for {agent_name} into 3-5 concrete actions: '{high_level_step}'.\n"
+        f"Start each action with a verb (e.g., 'Walk to <location>', 'Use <object> for 10 minutes', 'Talk to <agent> about <topic>'). Respond as a numbered list."
+    )
+    return _parse_numbered_list(_call_ollama(prompt, agent_name, call_site, default=""))
+
+def call_ollama_for_reaction_context_summary(agent_name: str, observer_name: str, observed_entity_name: str, observed_action_status: str, relevant_memories: list[str]) -> str:
+    memories_text = "\n".join(f"- {m}" for m in relevant_memories) or "- (no relevant memories)"
+    prompt = (
+        f"Relevant memories of {observer_name}:\n{memories_text}\n"
+        f"Summarize in one or two sentences what {observer_name} knows about {observed_entity_name} "
+        f"and their relationship, given that {observed_entity_name} is currently {observed_action_status}."
+    )
+    return _call_ollama(prompt, agent_name, "reaction_context")
+
+def call_ollama_for_reaction(agent_name: str, agent_summary: str, current_action: str, observation: str, context_summary: str, dt_obj: datetime) -> tuple[bool, str]:
+    prompt = (
+        f"{agent_summary}\nIt is {dt_obj.strftime('%A, %B %d, %Y, %I:%M %p')}.\n"
+        f"{agent_name}'s current action: {current_action}\nObservation: {observation}\n"
+        f"Summary of relevant context from {agent_name}'s memory: {context_summary}\n"
+        f"Should they react? If yes, answer 'Yes, <reaction>' (start the reaction with 'New plan: ...' or 'Go to <location>' if it changes plans). "
+        f"If no, answer 'No, continue current plan.'"
+    )
+    response = _call_ollama(prompt, agent_name, "reaction")
+    should_react = response.lower().startswith("yes")
+    reaction = response.split(",", 1)[1].strip() if should_react and "," in response else response
+    return should_react, reaction
+
+def call_ollama_for_dialogue(agent_name: str, target_name: str, agent_summary: str, dialogue_history: list[str], context: str, relationship_summary: str, emotional_state: str) -> str:
+    history_text = "\n".join(dialogue_history[-10:]) or "(no conversation yet)"
+    prompt = (
+        f"{agent_summary}\n{agent_name} is feeling {emotional_state}. {relationship_summary}\n"
+        f"Context: {agent_name} is trying to '{context}' with {target_name}.\nConversation so far:\n{history_text}\n"
+        f"What would {agent_name} say next to {target_name}? Respond with only the utterance."
+    )
+    return _call_ollama(prompt, agent_name, "dialogue").strip().strip('"')
+
+def call_ollama_for_dialogue_turn(speaker_name: str, listener_name: str, speaker_summary: str, listener_summary: str, dialogue_history: list[str], context: str,
+                                  speaker_relationship: str, listener_relationship: str, speaker_emotion: str, listener_emotion: str, listener_action: str) -> dict:
+    """A whole dialogue turn in one generation: the utterance, how the listener reads it and whether they
+    react, both sides' relationship deltas and the exchange's importance (None = score it separately)."""
+    history_text = "\n".join(dialogue_history[-10:]) or "(no conversation yet)"
+    prompt = (
+        f"{speaker_summary}\n{speaker_name} is feeling {speaker_emotion}. {speaker_relationship}\n"
+        f"Context: {speaker_name} is trying to '{context}' with {listener_name}.\nConversation so far:\n{history_text}\n"
+        f"About {listener_name}: {listener_summary}\n{listener_name} is feeling {listener_emotion} and is currently doing: {listener_action}. {listener_relationship}\n"
+        f"Write what {speaker_name} says next to {listener_name} and how {listener_name} takes it, in one JSON object. "
+        f"listener_reacts is true if {listener_name} should change what they are doing; listener_reaction then starts with 'New plan: ...' or 'Go to <location>' if it changes plans. "
+        f"The deltas are how each side's friendship and trust scores (0-100) for the other change; importance is the exchange's poignancy from 1 to 10.\n"
+        f"Respond ONLY in JSON format: {{\"utterance\": \"text\", \"intent\": \"text\", \"tone\": \"one word\", \"listener_reacts\": false, \"listener_reaction\": \"text\", "
+        f"\"speaker_friendship_delta\": number, \"speaker_trust_delta\": number, \"listener_friendship_delta\": number, \"listener_trust_delta\": number, \"importance\": number}}"
+    )
+    turn = call_ollama_structured(prompt, speaker_name, "dialogue_turn", DIALOGUE_TURN_SCHEMA, {
+        'utterance': f"Hello, {listener_name}.", 'intent': "unclear", 'tone': "neutral", 'listener_reacts': False, 'listener_reaction': "",
+        'speaker_friendship_delta': 0, 'speaker_trust_delta': 0, 'listener_friendship_delta': 0, 'listener_trust_delta': 0, 'importance': None})
+    turn['utterance'] = turn['utterance'].strip().strip('"')
+    turn['tone'] = turn['tone'].lower().strip('.')
+    turn['listener_reacts'] = turn['listener_reacts'] and bool(turn['listener_reaction'].strip())
+    if turn['importance'] is not None:
+        turn['importance'] = max(1, min(10, int(round(turn['importance']))))
+    return turn
+
+def call_ollama_for_message_interpretation(sender_name: str, receiver_name: str, message: str) -> tuple[str, str]:
+    """(intent, tone) of a received message."""
+    prompt = (
+        f"{sender_name} said to {receiver_name}: '{message}'.\n"
+        f"You are {receiver_name}, interpreting the message. What is {sender_name}'s intent and tone? "
+        f"Respond ONLY in JSON format: {{\"intent\": \"text\", \"tone\": \"one word\"}}"
+    )
+    result = call_ollama_structured(prompt, receiver_name, "message_interpretation", MESSAGE_INTERPRETATION_SCHEMA,
+                                    {'intent': "unclear", 'tone': "neutral"})
+    return result['intent'], result['tone'].lower().strip('.')
+
+def call_ollama_for_reflection_questions(agent_name: str, memories_text: str) -> list[str]:
+    prompt = (
+        f"Statements about {agent_name}:\n{memories_text}\n"
+        f"Given only the information above, What are 3 most salient high-level questions we can answer about the subjects in the statements? "
+        f"Respond as a numbered list."
+    )
+    return _parse_numbered_list(_call_ollama(prompt, agent_name, "reflection_questions", default=""))[:3] # Degraded: no reflection this time
+
+def call_ollama_for_reflection_insights(agent_name: str, question: str, memories_text: str) -> str:
+    prompt = (
+        f"Statements about {agent_name} relevant to '{question}':\n{memories_text}\n"
+        f"What 5 high-level insights can you infer from the above statements? "
+        f"Respond with the single most important one as 'Insight: <insight>'."
+    )
+    return _call_ollama(prompt, agent_name, "reflection_insights", default="")
+
+# --- New Ollama Call Functions for Enhanced Sophistication ---
+EMOTIONS = ("neutral", "happy", "sad", "angry", "surprised", "anxious", "content")
+
+def call_ollama_for_emotional_update(agent_name: str, current_emotion: str, recent_events_summary: str) -> str:
+    prompt = (
+        f"Agent {agent_name}'s current emotional state is '{current_emotion}'.\n"
+        f"Recent significant events for {agent_name}:\n{recent_events_summary}\n"
+        f"Based on these events, what is {agent_name}'s new emotional state? (Choose from: {', '.join(EMOTIONS)}). Respond with only the emotional state."
+    )
+    return _call_ollama(prompt, agent_name, "emotional_update", default=current_emotion).lower()
+
+def call_ollama_for_relationship_update(agent_name_1: str, agent_name_2: str, interaction_summary: str, current_friendship: int, current_trust: int) -> dict:
+    prompt = (
+        f"Agent {agent_name_1} and Agent {agent_name_2} just had an interaction summarized as: '{interaction_summary}'.\n"
+        f"Their current friendship score (0-100) is {current_friendship}, and trust score (0-100) is {current_trust}.\n"
+        f"How should these scores change? Provide deltas (e.g., friendship_delta: 5, trust_delta: -2). "
+        f"Respond ONLY in JSON format: {{\"friendship_delta\": number, \"trust_delta\": number}}"
+    )
+    return call_ollama_structured(prompt, agent_name_1, "relationship_update", RELATIONSHIP_UPDATE_SCHEMA,
+                                  {'friendship_delta': 0, 'trust_delta': 0})
+
+def call_ollama_for_need_fulfillment_plan(agent_name: str, need_type: str, agent_summary:str, current_location: str, known_locations_info: str, dt_obj:datetime) -> list[str]:
+    prompt = (
+        f"Agent: {agent_name}\nSummary: {agent_summary}\nCurrently at: {current_location}\nTime: {dt_obj.strftime('%A, %B %d, %Y, %I:%M %p')}\n"
+        f"CRITICAL NEED: {need_type}.\n"
+        f"Known locations relevant to this need:\n{known_locations_info}\n"
+        f"Generate a short, high-priority 2-3 step plan for {agent_name} to fulfill this need for '{need_type}'. Specify locations and objects. Respond as a numbered list."
+    )
+    plan_text = _call_ollama(prompt, agent_name, "need_plan")
+    return [step.strip() for step in plan_text.split('\n') if step.strip() and (step[0].isdigit() or step[0] == '-')]
+
+def call_ollama_for_object_interaction_outcome(agent_name: str, action_description: str, obj: WorldObject, agent_summary: str) -> dict:
+    prompt = (
+        f"Agent: {agent_name}\nSummary: {agent_summary}\n"
+        f"Action: '{action_description}'\n"
+        f"Object: '{obj.name}' at '{obj.location_name}'\n"
+        f"Object's current state: '{obj.current_state}'\n"
+        f"Object's current properties: {json.dumps(obj.properties)}\n"
+        f"What is the outcome for the agent (e.g., 'Agent is now busy cooking', 'Agent obtained wood') AND "
+        f"what is the new state of '{obj.name}' (e.g., 'on', 'empty') AND "
+        f"how do its properties change (e.g., food_count: 9, is_on: true)?\n"
+        f"Respond ONLY in JSON format: {{\"agent_outcome\": \"text\", \"object_new_state\": \"text\", \"object_property_changes\": {{\"key\": \"value\", ...}}}}"
+    )
+    return call_ollama_structured(prompt, agent_name, "object_interaction", OBJECT_INTERACTION_SCHEMA,
+                                  {"agent_outcome": f"Agent used {obj.name}.", "object_new_state": obj.current_state, "object_property_changes": {}})
+
+# --- Plan Templates ---
+_PLAN_SLOT = re.compile(r'<slot(\d+)>')
+
+_PLAN_NAMES_CACHE = {'objects': None, 'size': -1, 'plan_names': None} # Rebuilt when WORLD_OBJECTS is replaced or grows
+
+def _plan_names() -> tuple[dict, dict, re.Pattern]:
+    """(lower-cased location and object names -> their spelling, object name -> the locations it is at, a
+    pattern matching any of the names); the names are a plan's substitutable parameters. Rebuilt only when
+    objects are loaded or registered."""
+    world_objects = WORLD_OBJECTS
+    cached = _PLAN_NAMES_CACHE['plan_names']
+    if cached is None or _PLAN_NAMES_CACHE['objects'] is not world_objects or _PLAN_NAMES_CACHE['size'] != len(world_objects):
+        names = {name.lower(): name for name in LOCATIONS if name != 'World'}
+        object_locations = {}
+        for obj in list(world_objects.values()):
+            names[obj.name.lower()] = obj.name
+            object_locations.setdefault(obj.name, set()).add(obj.location_name)
+        pattern = re.compile(r'(?<!\w)(' + '|'.join(map(re.escape, sorted(names, key=len, reverse=True))) + r')(?!\w)', re.I)
+        cached = (names, object_locations, pattern)
+        _PLAN_NAMES_CACHE.update(objects=world_objects, size=len(world_objects), plan_names=cached)
+    return cached
+
+def _parameterize(text: str, slots: list, plan_names: tuple, add: bool) -> str:
+    """Replaces known names in text with <slotN> placeholders (slots[N] is the name); unseen names are appended when add."""
+    names, _, pattern = plan_names
+    def substitute(match):
+        value = names[match.group(0).lower()]
+        if value not in slots:
+            if not add:
+                return match.group(0)
+            slots.append(value)
+        return f"<slot{slots.index(value)}>"
+    return pattern.sub(substitute, text)
+
+def _anchored_objects(steps: list[str], slots: list, plan_names: tuple) -> list[tuple[str, int]]:
+    """(object, slot) for each object the steps name verbatim that is at a slotted location: reusing the steps
+    for another location there only makes sense if the same object exists at it."""
+    names, object_locations, pattern = plan_names
+    anchored = set()
+    for step in steps:
+        for match in pattern.finditer(step):
+            value = names[match.group(0).lower()]
+            if value in slots: # Substituted itself
+                continue
+            for i, slot in enumerate(slots):
+                if slot in object_locations.get(value, ()):
+                    anchored.add((value, i))
+    return sorted(anchored)
+
+def _normalize_plan_text(text: str) -> str:
+    return ' '.join(re.sub(r'^\s*(?:\d+[.)]|[-*])\s*', '', text).lower().split()).rstrip('.!')
+
+class PlanTemplateCache:
+    """Generated plans reused across agents and days, with location and object names as parameters.
+
+    Templates live in buckets of (kind, role, need, location, context) and are keyed inside a bucket
+    by the normalized request text with names replaced by <slotN>. A verbatim match is reused directly;
+    otherwise the bucket's nearest template by embedding is, if within PLAN_TEMPLATE_MIN_SIMILARITY and
+    it takes as many names. The request's own names are substituted into the reused steps, unless a step
+    names an object (verbatim) that was at one of the template's locations and is missing at the request's.
+
+    Stores and use counts go through defer_world_mutation, so agents in a concurrent tick all see the
+    templates as of the tick start and expiry does not depend on which of them asked first.
+    """
+    def __init__(self, capacity=PLAN_TEMPLATE_CAPACITY):
+        self.capacity = capacity
+        self._templates = OrderedDict() # (bucket, normalized text) -> {'steps', 'slots', 'created', 'uses', 'vector', 'anchored_objects'}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refused = 0 # Matches whose steps name an object missing at the request's location
+
+    @staticmethod
+    def _is_expired(template: dict, dt_obj: datetime) -> bool:
+        return ((PLAN_TEMPLATE_TTL_HOURS is not None and dt_obj - template['created'] > timedelta(hours=PLAN_TEMPLATE_TTL_HOURS))
+                or (PLAN_TEMPLATE_MAX_USES is not None and template['uses'] >= PLAN_TEMPLATE_MAX_USES))
+
+    def _nearest(self, bucket: tuple, normalized: str, slot_count: int, dt_obj: datetime):
+        with self._lock:
+            candidates = [(key, template) for key, template in self._templates.items()
+                          if key[0] == bucket and len(template['slots']) == slot_count and not self._is_expired(template, dt_obj)]
+        if not candidates:
+            return None, None
+        query = np.asarray(_call_ollama_embedding(normalized), dtype=np.float32)
+        best_key, best_sim = None, PLAN_TEMPLATE_MIN_SIMILARITY
+        for key, template in candidates:
+            if template['vector'] is None: # Embedded on first comparison; most templates only ever match verbatim
+                template['vector'] = np.asarray(_call_ollama_embedding(key[1]), dtype=np.float32)
+            sim = cosine_similarity(query, template['vector'])
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+        return best_key, best_sim
+
+    def lookup(self, bucket: tuple, text: str, dt_obj: datetime):
+        """The reusable steps for text with its names filled in, else None."""
+        if not PLAN_TEMPLATES_ENABLED:
+            return None
+        plan_names, slots = _plan_names(), []
+        normalized = _normalize_plan_text(_parameterize(text, slots, plan_names, add=True))
+        key, similar = (bucket, normalized), False
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and self._is_expired(template, dt_obj):
+                del self._templates[key]
+                self.expired += 1
+                template = None
+        if template is None:
+            key, _ = self._nearest(bucket, normalized, len(slots), dt_obj)
+            similar = key is not None
+        with self._lock:
+            template = self._templates.get(key) if key is not None else None
+            if template is None:
+                self.misses += 1
+                return None
+            object_locations = plan_names[1]
+            if any(slots[i] not in object_locations.get(obj, ()) for obj, i in template.get('anchored_objects', ())):
+                self.refused += 1 # e.g. "Buy apple from produce_stand" reused for a shop without one
+                self.misses += 1
+                return None
+            if similar: self.similar_hits += 1
+            else: self.hits += 1
+            steps = template['steps']
+        defer_world_mutation(self._count_use, key, template)
+        return [_PLAN_SLOT.sub(lambda match: slots[int(match.group(1))], step) for step in steps]
+
+    def store(self, bucket: tuple, text: str, steps: list[str], dt_obj: datetime):
+        if not PLAN_TEMPLATES_ENABLED or not steps:
+            return
+        plan_names, slots = _plan_names(), []
+        normalized = _normalize_plan_text(_parameterize(text, slots, plan_names, add=True))
+        template = {'steps': [_parameterize(step, slots, plan_names, add=False) for step in steps], 'slots': slots, 'created': dt_obj, 'uses': 0,
+                    'vector': None, 'anchored_objects': _anchored_objects(steps, slots, plan_names)}
+        defer_world_mutation(self._insert, (bucket, normalized), template)
+
+    def _count_use(self, key: tuple, template: dict):
+        with self._lock:
+            template['uses'] += 1
+            if self._templates.get(key) is template:
+                self._templates.move_to_end(key)
+
+    def _insert(self, key: tuple, template: dict):
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.capacity:
+                self._templates.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def report(self) -> str:
+        with self._lock:
+            return (f"Plan templates: {self.hits} verbatim and {self.similar_hits} similar reuses, {self.misses} generated "
+                    f"({self.refused} refused for missing objects), {self.expired} expired ({len(self._templates)} kept)")
+
+PLAN_TEMPLATES = PlanTemplateCache()
+
+def decompose_plan_step(agent_name: str, role: str, high_level_step: str, agent_summary: str, current_location: str, dt_obj: datetime, call_site: str = "plan_decomposition") -> list[str]:
+    """A reused decomposition for this role, location and step when PLAN_TEMPLATES has one, else a fresh one."""
+    bucket = ("decomposition", role, "", current_location, "")
+    steps = PLAN_TEMPLATES.lookup(bucket, high_level_step, dt_obj)
+    if steps is None:
+        steps = call_ollama_for_decompose_plan_step(agent_name, high_level_step, agent_summary, current_location, dt_obj, call_site)
+        if not last_call_errored(): # Degraded calls return [] and are not stored either
+            PLAN_TEMPLATES.store(bucket, high_level_step, steps, dt_obj)
+    return steps
+
+def need_fulfillment_plan(agent_name: str, role: str, need_type: str, agent_summary: str, current_location: str, known_locations_info: str, dt_obj: datetime) -> list[str]:
+    """A reused urgent plan for this role, need, location and set of options, else a fresh one."""
+    bucket = ("need", role, need_type, current_location, known_locations_info)
+    steps = PLAN_TEMPLATES.lookup(bucket, need_type, dt_obj)
+    if steps is None:
+        steps = call_ollama_for_need_fulfillment_plan(agent_name, need_type, agent_summary, current_location, known_locations_info, dt_obj)
+        if not last_call_errored():
+            PLAN_TEMPLATES.store(bucket, need_type, steps, dt_obj)
+    return steps
+
+# --- Local Classifiers ---
+class PrototypeClassifier:
+    """Nearest-prototype classifier on normalized embeddings, calibrated online by the LLM's own answers.
+
+    Every LLM answer becomes a labelled example. A prediction is confident when the labelled examples
+    within CLASSIFIER_MIN_SIMILARITY agree (importance: small spread, emotion: a clear majority);
+    otherwise the caller escalates to the LLM and feeds the answer back with learn().
+    """
+    def __init__(self, name: str, numeric: bool, capacity=CLASSIFIER_CAPACITY):
+        self.name = name
+        self.numeric = numeric
+        self.capacity = capacity
+        self.vectors = None # (capacity, dim) once the first example arrives
+        self.labels = [None] * capacity
+        self.count = 0
+        self._next = 0 # Ring position of the next example
+        self._lock = threading.Lock()
+        self._rng = random.Random(0) # Audits never touch the simulation's random stream
+        self.local = 0
+        self.escalated = 0
+        self.audits = 0
+        self.audit_error = 0.0 # Sum of |error| (importance) or mismatches (emotion) over audits
+        self.learned = 0 # Examples added since the last load_examples
+
+    def predict(self, vec: np.ndarray):
+        """(label, confident); label is the best guess (None with no usable examples)."""
+        with self._lock:
+            if self.count == 0 or self.vectors.shape[1] != vec.shape[0]:
+                return None, False
+            sims = self.vectors[:self.count] @ vec
+            nearest = np.argpartition(-sims, CLASSIFIER_NEIGHBORS - 1)[:CLASSIFIER_NEIGHBORS] if self.count > CLASSIFIER_NEIGHBORS else np.arange(self.count)
+            voters = [i for i in nearest if sims[i] >= CLASSIFIER_MIN_SIMILARITY]
+            if not voters:
+                return self.labels[int(np.argmax(sims))], False
+            weights = sims[voters]
+            if self.numeric:
+                values = np.array([self.labels[i] for i in voters], dtype=np.float32)
+                mean = float(np.average(values, weights=weights))
+                spread = float(np.sqrt(np.average((values - mean) ** 2, weights=weights)))
+                return int(round(mean)), spread <= CLASSIFIER_MAX_IMPORTANCE_SPREAD
+            votes = {}
+            for i, weight in zip(voters, weights):
+                votes[self.labels[i]] = votes.get(self.labels[i], 0.0) + float(weight)
+            winner = max(votes, key=votes.get)
+            return winner, votes[winner] / sum(votes.values()) >= CLASSIFIER_MIN_VOTE_SHARE
+
+    def should_audit(self, rng: random.Random = None) -> bool:
+        """rng: the asking agent's stream, so audits do not depend on the order agents ask in."""
+        if rng is not None:
+            return rng.random() < CLASSIFIER_AUDIT_RATE
+        with self._lock:
+            return self._rng.random() < CLASSIFIER_AUDIT_RATE
+
+    def record(self, local: bool):
+        with self._lock:
+            if local:
+                self.local += 1
+            else:
+                self.escalated += 1
+
+    def learn(self, vec: np.ndarray, label, audited_prediction=None):
+        """Adds an LLM-labelled example; audited_prediction is what a confident prediction said instead."""
+        with self._lock:
+            if audited_prediction is not None:
+                self.audits += 1
+                self.audit_error += abs(label - audited_prediction) if self.numeric else float(label != audited_prediction)
+            if self.vectors is None or self.vectors.shape[1] != vec.shape[0]: # First example, or a new embedding model
+                self.vectors = np.zeros((self.capacity, vec.shape[0]), dtype=np.float32)
+                self.count = self._next = 0
+            self.vectors[self._next] = vec
+            self.labels[self._next] = label
+            self._next = (self._next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self.learned += 1
+
+    def examples(self):
+        with self._lock:
+            return (self.vectors[:self.count].copy() if self.count else np.zeros((0, 0), dtype=np.float32)), self.labels[:self.count]
+
+    def new_examples(self):
+        """The examples learned since the last load_examples (at most capacity), oldest first."""
+        with self._lock:
+            new = min(self.learned, self.count)
+            rows = [(self._next - new + i) % self.capacity for i in range(new)]
+            return (self.vectors[rows].copy() if new else np.zeros((0, 0), dtype=np.float32)), [self.labels[row] for row in rows]
+
+    def load_examples(self, vectors: np.ndarray, labels: list):
+        with self._lock:
+            self.vectors = None
+            self.labels = [None] * self.capacity
+            self.count = self._next = 0
+            self.local = self.escalated = self.audits = 0
+            self.audit_error = 0.0
+        for vec, label in zip(vectors[-self.capacity:], labels[-self.capacity:]):
+            self.learn(vec, label)
+        with self._lock:
+            self.learned = 0
+
+    def report(self) -> str:
+        with self._lock:
+            total = self.local + self.escalated
+            error = self.audit_error / self.audits if self.audits else 0.0
+            return (f"{self.name} classifier: {self.local} local, {self.escalated} LLM ({self.local / max(1, total):.0%} local), "
+                    f"{self.count} examples, audit {'mean |error|' if self.numeric else 'mismatch rate'} {error:.2f} over {self.audits}")
+
+IMPORTANCE_CLASSIFIER = PrototypeClassifier("Importance", numeric=True)
+EMOTION_CLASSIFIER = PrototypeClassifier("Emotion", numeric=False)
+
+def _classifier_file():
+    """CLASSIFIER_FILE, suffixed with the backend unless it is Ollama (mock labels must never reach real runs)."""
+    if not CLASSIFIER_FILE or LLM_BACKEND == "ollama":
+        return CLASSIFIER_FILE
+    root, ext = os.path.splitext(CLASSIFIER_FILE)
+    return f"{root}.{LLM_BACKEND}{ext}"
+
+def load_classifiers(path=None):
+    path = path or _classifier_file()
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            IMPORTANCE_CLASSIFIER.load_examples(data['importance_vectors'].astype(np.float32), [int(label) for label in data['importance_labels']])
+            EMOTION_CLASSIFIER.load_examples(data['emotion_vectors'].astype(np.float32), [str(label) for label in data['emotion_labels']])
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Ignoring classifier examples in {path}: {e}")
+
+def save_classifiers(path=None):
+    path = path or _classifier_file()
+    if not path:
+        return
+    importance_vectors, importance_labels = IMPORTANCE_CLASSIFIER.examples()
+    emotion_vectors, emotion_labels = EMOTION_CLASSIFIER.examples()
+    with open(path, 'wb') as f:
+        np.savez(f, importance_vectors=importance_vectors.astype(np.float16), importance_labels=np.array(importance_labels, dtype=np.int32),
+                 emotion_vectors=emotion_vectors.astype(np.float16), emotion_labels=np.array(emotion_labels, dtype=str)) # Half precision is plenty for voting
+
+def merge_classifier_examples(shard_examples):
+    """Reloads the shared examples, adds what each shard learned on top (in shard order) and saves them.
+
+    shard_examples: per shard, [(vectors, labels) for the importance, emotion classifier] from new_examples().
+    """
+    if not _classifier_file():
+        return
+    load_classifiers()
+    for examples in shard_examples:
+        for classifier, (vectors, labels) in zip((IMPORTANCE_CLASSIFIER, EMOTION_CLASSIFIER), examples):
+            for vec, label in zip(vectors, labels):
+                classifier.learn(np.asarray(vec, dtype=np.float32), label)
+    save_classifiers()
+
+def classify_importance(description: str, embedding, agent_name: str, rng: random.Random = None) -> int:
+    """Importance from the memory's embedding, escalating to the LLM when the classifier is unsure.
+
+    New labels are learned through defer_world_mutation: in a concurrent tick every agent predicts
+    from the examples as of the tick start, and they are added in agent order afterwards.
+    """
+    vec = MemoryStore._normalize(embedding)
+    predicted, confident = IMPORTANCE_CLASSIFIER.predict(vec)
+    if confident and not IMPORTANCE_CLASSIFIER.should_audit(rng):
+        IMPORTANCE_CLASSIFIER.record(local=True)
+        return predicted
+    IMPORTANCE_CLASSIFIER.record(local=False)
+    score = call_ollama_for_importance_score(description, agent_name, fallback=predicted if predicted is not None else 3)
+    if not last_call_degraded() and not last_call_errored(): # Defaults and error fallbacks are not labels
+        defer_world_mutation(IMPORTANCE_CLASSIFIER.learn, vec, score, predicted if confident else None)
+    return score
+
+def classify_emotion(agent_name: str, current_emotion: str, recent_events_summary: str, rng: random.Random = None) -> str:
+    """New emotional state from the current one and recent events; the LLM is asked only when the classifier is unsure."""
+    if not LOCAL_CLASSIFIERS_ENABLED:
+        return call_ollama_for_emotional_update(agent_name, current_emotion, recent_events_summary)
+    vec = MemoryStore._normalize(_call_ollama_embedding(f"Feeling {current_emotion}. Recent events: {recent_events_summary}", agent_name))
+    predicted, confident = EMOTION_CLASSIFIER.predict(vec)
+    if confident and not EMOTION_CLASSIFIER.should_audit(rng):
+        EMOTION_CLASSIFIER.record(local=True)
+        return predicted
+    EMOTION_CLASSIFIER.record(local=False)
+    emotion = call_ollama_for_emotional_update(agent_name, current_emotion, recent_events_summary)
+    if not last_call_degraded() and not last_call_errored() and emotion in EMOTIONS: # Free-form answers are used but not learned from
+        defer_world_mutation(EMOTION_CLASSIFIER.learn, vec, emotion, predicted if confident else None)
+    return emotion
+
+# --- Memory Store (columnar, vectorized retrieval) ---
+MEMORY_TIME_EPOCH = datetime(2000, 1, 1) # Reference point for float timestamps
+RECENCY_DECAY_PER_HOUR = 0.01
+
+def _dt_to_seconds(dt_obj: datetime) -> float:
+    return (dt_obj - MEMORY_TIME_EPOCH).total_seconds()
+
+def _select_top_k(combined: np.ndarray, count: int) -> np.ndarray:
+    """Row indices of the `count` best scores, best first; ties keep insertion order."""
+    n = combined.shape[0]
+    if count >= n:
+        return np.argsort(-combined, kind='stable')
+    candidates = np.argpartition(-combined, count - 1)[:count]
+    return candidates[np.lexsort((candidates, -combined[candidates]))]
+
+class StandingQuery:
+    """Candidate rows for one fixed query over one MemoryStore, kept current as memories arrive.
+
+    A full scan keeps the best `capacity` rows by combined score. Every row outside the set has
+    a score no higher than `outside_bound` from the moment it left onward, because recency only
+    decays until a row is touched, and touched, added or re-embedded rows re-enter the set. So
+    when the k-th best candidate still beats outside_bound, the candidates' top k is the store's
+    exact top k; otherwise the set is rebuilt by a full scan.
+    """
+    def __init__(self, query_vec: np.ndarray, count: int):
+        self.query_vec = query_vec
+        self.capacity = max(count * STANDING_QUERY_CANDIDATE_FACTOR, STANDING_QUERY_MIN_CANDIDATES)
+        self.rows = {} # row -> relevance to the query
+        self.outside_bound = -np.inf
+        self.horizon_s = -np.inf # Bounds hold for query times at or after this
+        self.valid = False
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self.valid = False
+        self.rows = {}
+
+    def _relevance(self, store, idx: int) -> float:
+        vec = store.embedding_row(idx)
+        return float(vec @ self.query_vec) if vec is not None and vec.shape[0] == self.query_vec.shape[0] else 0.0
+
+    def note(self, store, idx: int):
+        """Row idx was added, embedded or touched: it may now outrank the bound, so it becomes a candidate."""
+        if not self.valid:
+            return
+        self.rows[idx] = self._relevance(store, idx)
+        if len(self.rows) > 2 * self.capacity:
+            self._trim(store)
+
+    def _scores(self, store, rows: np.ndarray, relevance: np.ndarray, at_s: float) -> np.ndarray:
+        recency = np.exp(-RECENCY_DECAY_PER_HOUR * (at_s - store.last_accessed_s[rows]) / 3600.0)
+        return recency + store.importance[rows] / 10.0 + relevance
+
+    def _trim(self, store):
+        """Keeps the best `capacity` candidates as of the latest access among them; the rest only bound."""
+        rows = np.fromiter(self.rows.keys(), dtype=np.int64, count=len(self.rows))
+        relevance = np.fromiter(self.rows.values(), dtype=np.float64, count=len(self.rows))
+        at_s = max(self.horizon_s, float(store.last_accessed_s[rows].max()))
+        combined = self._scores(store, rows, relevance, at_s)
+        keep = np.argpartition(-combined, self.capacity - 1)[:self.capacity]
+        dropped = np.ones(rows.shape[0], dtype=bool)
+        dropped[keep] = False
+        self.outside_bound = max(self.outside_bound, float(combined[dropped].max()))
+        self.horizon_s = at_s
+        self.rows = {int(rows[i]): float(relevance[i]) for i in keep}
+
+    def rebuild(self, store, query_dt_s: float):
+        n = len(store)
+        recency = np.exp(-RECENCY_DECAY_PER_HOUR * (query_dt_s - store.last_accessed_s[:n]) / 3600.0)
+        relevance = store.relevance_scores(self.query_vec).astype(np.float64)
+        combined = recency + store.importance[:n] / 10.0 + relevance
+        if n > self.capacity:
+            keep = np.argpartition(-combined, self.capacity - 1)[:self.capacity]
+            outside = np.ones(n, dtype=bool)
+            outside[keep] = False
+            self.outside_bound = float(combined[outside].max())
+        else:
+            keep = np.arange(n)
+            self.outside_bound = -np.inf
+        self.rows = {int(i): float(relevance[i]) for i in keep}
+        self.horizon_s = query_dt_s
+        self.valid = True
+        self.rebuilds += 1
+
+    def top_k(self, store, query_dt: datetime, count: int) -> list[tuple[int, float, float, float]]:
+        """Same result as store.top_k for this query (exact scan semantics), from the candidates when the bound allows."""
+        query_dt_s = _dt_to_seconds(query_dt)
+        if count > self.capacity:
+            self.capacity = count * STANDING_QUERY_CANDIDATE_FACTOR
+            self.invalidate()
+        for attempt in range(2):
+            if not self.valid or query_dt_s < self.horizon_s:
+                self.rebuild(store, query_dt_s)
+            rows = np.fromiter(sorted(self.rows), dtype=np.int64, count=len(self.rows)) # Row order keeps scan tie-breaking
+            relevance = np.array([self.rows[row] for row in rows.tolist()], dtype=np.float64)
+            recency = np.exp(-RECENCY_DECAY_PER_HOUR * (query_dt_s - store.last_accessed_s[rows]) / 3600.0)
+            combined = recency + store.importance[rows] / 10.0 + relevance
+            order = _select_top_k(combined, count)
+            if (order.shape[0] >= count or self.outside_bound == -np.inf) and \
+                    (order.shape[0] == 0 or combined[order[-1]] > self.outside_bound):
+                return [(int(rows[i]), float(combined[i]), float(recency[i]), float(relevance[i])) for i in order]
+            self.invalidate() # An outside row might tie or win: rescan
+        return [(int(rows[i]), float(combined[i]), float(recency[i]), float(relevance[i])) for i in order]
+
+def _memory_merge_key(description: str) -> str:
+    return " ".join(description.lower().split())
+
+MEMORY_DATETIME_FIELDS = ('creation_timestamp_obj', 'last_accessed_timestamp_obj', 'last_observed_timestamp_obj')
+
+def _memory_to_record(memory: dict) -> dict:
+    """JSON-safe copy of a memory dict (the embedding is stored separately in binary form)."""
+    return {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in memory.items() if k != 'embedding'}
+
+def _memory_from_record(record: dict) -> dict:
+    memory = dict(record)
+    for key in MEMORY_DATETIME_FIELDS:
+        if memory.get(key):
+            memory[key] = datetime.fromisoformat(memory[key])
+    return memory
+
+class IVFIndex:
+    """Inverted-file index over normalized embeddings (spherical k-means in NumPy).
+
+    Only the centroids live here; each store row's cluster id is kept in the store's
+    `ann_list` column, so adds are O(nlist * dim) and compaction needs no extra work.
+    """
+    def __init__(self, nprobe=ANN_NPROBE):
+        self.nprobe = nprobe
+        self.centroids = None # (nlist, dim) float32
+        self.trained_size = 0
+        self.added_since_training = 0 # Rows assigned to the current centroids without having shaped them
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray, nlist: int):
+        rng = np.random.default_rng(ANN_SEED)
+        if vectors.shape[0] > ANN_TRAIN_SAMPLE:
+            vectors = vectors[rng.choice(vectors.shape[0], ANN_TRAIN_SAMPLE, replace=False)]
+        nlist = max(1, min(nlist, vectors.shape[0]))
+        centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+        for _ in range(ANN_KMEANS_ITERATIONS):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1)
+            empty = norms == 0
+            if empty.any(): # Re-seed empty clusters from random vectors
+                sums[empty] = vectors[rng.choice(vectors.shape[0], int(empty.sum()))]
+                norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = (sums / np.maximum(norms, 1e-12)[:, None]).astype(np.float32)
+        self.centroids = centroids
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Cluster id per vector; all-zero (unembedded) vectors get -1."""
+        lists = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        lists[~vectors.any(axis=1)] = -1
+        return lists
+
+    def probe(self, query_vec: np.ndarray) -> np.ndarray:
+        scores = self.centroids @ query_vec
+        nprobe = min(self.nprobe, scores.shape[0])
+        return np.argpartition(-scores, nprobe - 1)[:nprobe]
+
+    def candidates(self, ann_list: np.ndarray, query_vec: np.ndarray, prior: np.ndarray, count: int) -> np.ndarray:
+        """Rows worth exact scoring: members of the probed clusters plus the best rows by recency + importance
+        alone (relevance is bounded, so those can still win). Rows with a -inf prior are never candidates."""
+        mask = np.isin(ann_list, self.probe(query_vec)) & np.isfinite(prior)
+        prior_count = min(int(np.isfinite(prior).sum()), count * ANN_PRIOR_CANDIDATES)
+        if prior_count > 0:
+            mask[np.argpartition(-prior, prior_count - 1)[:prior_count]] = True
+        return np.flatnonzero(mask)
+
+class EmbeddingBuffer:
+    """Append-only (capacity, dim) matrix of embedding rows stored as MEMORY_EMBEDDING_DTYPE.
+
+    With a path the rows live in a memory-mapped file, so the OS pages cold rows in and out
+    on demand instead of them all staying resident; without one it is a plain array.
+    """
+    def __init__(self, dim: int, capacity: int, dtype=MEMORY_EMBEDDING_DTYPE, path: str = None):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.path = path
+        self.capacity = 0
+        self.array = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            open(path, 'wb').close() # Fresh buffer; contents are rebuilt from the store
+        self.resize(capacity)
+
+    def resize(self, new_capacity: int):
+        if self.path is None:
+            new_array = np.zeros((new_capacity, self.dim), dtype=self.dtype)
+            if self.array is not None:
+                new_array[:self.capacity] = self.array[:self.capacity]
+        else:
+            if self.array is not None:
+                self.array.flush()
+                self.array = None # Drop the old mapping before growing the file
+            with open(self.path, 'r+b') as f:
+                f.truncate(new_capacity * self.dim * self.dtype.itemsize) # New rows read as zeros
+            new_array = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=(new_capacity, self.dim))
+        self.array = new_array
+        self.capacity = new_capacity
+
+class MemoryStore:
+    """Per-agent memory stream backed by columnar NumPy arrays for batched scoring.
+
+    Memory dicts are kept in `memories`; a memory's position there is its row in every column,
+    including the embedding buffer, so the dicts themselves carry no vectors. Embedding rows are
+    L2-normalized (stored as MEMORY_EMBEDDING_DTYPE, scored in float32 chunks) so relevance is
+    a matrix-vector product.
+    """
+    def __init__(self, initial_capacity=256, embedding_path=None, embedding_dtype=MEMORY_EMBEDDING_DTYPE):
+        self.memories = []
+        self.dim = None
+        self._capacity = initial_capacity
+        self._embedding_path = embedding_path
+        self._embedding_dtype = embedding_dtype
+        self._embedding_buffer = None # Created once the embedding dimension is known
+        self.created_s = np.zeros(initial_capacity, dtype=np.float64)
+        self.last_accessed_s = np.zeros(initial_capacity, dtype=np.float64)
+        self.importance = np.zeros(initial_capacity, dtype=np.float32)
+        self.ann_list = np.full(initial_capacity, -1, dtype=np.int32) # IVF cluster per row (-1 = unassigned)
+        self.ann = IVFIndex() if ANN_ENABLED else None
+        self.merge_index = {} # Merge key -> row of the memory repeated observations fold into
+        self.standing = {} # Query text -> StandingQuery
+
+    def __len__(self):
+        return len(self.memories)
+
+    @property
+    def embeddings(self):
+        """(capacity, dim) embedding rows, or None before the first embedding arrives."""
+        return self._embedding_buffer.array if self._embedding_buffer is not None else None
+
+    def _grow(self, min_capacity):
+        new_capacity = max(min_capacity, self._capacity * 2)
+        for attr, fill in (('created_s', 0), ('last_accessed_s', 0), ('importance', 0), ('ann_list', -1)):
+            old = getattr(self, attr)
+            new = np.full(new_capacity, fill, dtype=old.dtype)
+            new[:len(self)] = old[:len(self)]
+            setattr(self, attr, new)
+        if self._embedding_buffer is not None:
+            self._embedding_buffer.resize(new_capacity)
+        self._capacity = new_capacity
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def add(self, memory: dict, embedding) -> int:
+        """Appends a memory dict and its embedding; returns the row index.
+
+        embedding may be None for a deferred embedding: the row scores zero relevance until
+        set_embedding() fills it in.
+        """
+        idx = len(self)
+        if idx >= self._capacity:
+            self._grow(idx + 1)
+        self.ann_list[idx] = -1
+        if embedding is not None:
+            self._write_embedding(idx, embedding)
+        elif self._embedding_buffer is not None:
+            self.embeddings[idx] = 0 # Rows can be reused after compaction
+        self.created_s[idx] = _dt_to_seconds(memory['creation_timestamp_obj'])
+        self.last_accessed_s[idx] = _dt_to_seconds(memory['last_accessed_timestamp_obj'])
+        self.importance[idx] = memory['importance_score']
+        self.memories.append(memory)
+        for standing in self.standing.values():
+            standing.note(self, idx)
+        self._maybe_train_ann()
+        return idx
+
+    def _write_embedding(self, idx: int, embedding):
+        vec = self._normalize(embedding)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+            self._embedding_buffer = EmbeddingBuffer(self.dim, self._capacity, self._embedding_dtype, self._embedding_path)
+        if vec.shape[0] == self.dim:
+            self.embeddings[idx] = vec
+        else: # Mismatched dimension (e.g. model swap) scores as zero relevance, like cosine_similarity did
+            self.embeddings[idx] = 0.0
+        if self.ann is not None and self.ann.trained:
+            self.ann_list[idx] = self.ann.assign(self.embedding_rows(idx, idx + 1))[0]
+            self.ann.added_since_training += 1
+
+    def embedding_rows(self, start: int, stop: int) -> np.ndarray:
+        """float32 copy of a contiguous block of rows."""
+        return np.asarray(self.embeddings[start:stop], dtype=np.float32)
+
+    def _maybe_train_ann(self):
+        """(Re)trains the IVF index once the store is large enough, and again after ANN_RETRAIN_FRACTION of
+        its size at the last training has been added (archival keeps the hot store from ever doubling).
+        Runs when rows are added, never from top_k."""
+        n = len(self)
+        if self.ann is None or self.embeddings is None or n < ANN_MIN_MEMORIES:
+            return
+        if self.ann.trained and self.ann.added_since_training < ANN_RETRAIN_FRACTION * self.ann.trained_size:
+            return
+        embedded_rows = np.flatnonzero(np.asarray(self.embeddings[:n]).any(axis=1))
+        if embedded_rows.shape[0] == 0:
+            return
+        if embedded_rows.shape[0] > ANN_TRAIN_SAMPLE:
+            embedded_rows = np.sort(np.random.default_rng(ANN_SEED).choice(embedded_rows, ANN_TRAIN_SAMPLE, replace=False))
+        self.ann.train(np.asarray(self.embeddings[embedded_rows], dtype=np.float32), ANN_NLIST or int(4 * math.sqrt(n)))
+        self.ann.trained_size = n
+        self.ann.added_since_training = 0
+        for start in range(0, n, MEMORY_SCAN_CHUNK_ROWS):
+            stop = min(n, start + MEMORY_SCAN_CHUNK_ROWS)
+            self.ann_list[start:stop] = self.ann.assign(self.embedding_rows(start, stop))
+
+    def set_importance(self, idx: int, importance_score):
+        self.memories[idx]['importance_score'] = importance_score
+        self.importance[idx] = importance_score
+
+    def set_embedding(self, idx: int, embedding):
+        """Fills in a deferred embedding."""
+        self._write_embedding(idx, embedding)
+        for standing in self.standing.values():
+            standing.note(self, idx)
+
+    def standing_top_k(self, query: str, query_embedding, query_dt: datetime, count: int) -> list[tuple[int, float, float, float]]:
+        """top_k for a fixed query string, served from its StandingQuery (registered on first use)."""
+        if len(self) == 0 or count <= 0:
+            return []
+        standing = self.standing.get(query)
+        if standing is None:
+            standing = self.standing[query] = StandingQuery(self._normalize(query_embedding), count)
+        return standing.top_k(self, query_dt, count)
+
+    def recency_scores(self, query_dt: datetime) -> np.ndarray:
+        hours_since_last_access = (_dt_to_seconds(query_dt) - self.last_accessed_s[:len(self)]) / 3600.0
+        return np.exp(-RECENCY_DECAY_PER_HOUR * hours_since_last_access)
+
+    def relevance_scores(self, query_embedding) -> np.ndarray:
+        n = len(self)
+        query_vec = self._normalize(query_embedding)
+        if n == 0 or self.dim is None or query_vec.shape[0] != self.dim:
+            return np.zeros(n, dtype=np.float32)
+        relevance = np.empty(n, dtype=np.float32)
+        for start in range(0, n, MEMORY_SCAN_CHUNK_ROWS):
+            stop = min(n, start + MEMORY_SCAN_CHUNK_ROWS)
+            relevance[start:stop] = self.embedding_rows(start, stop) @ query_vec
+        return relevance
+
+    def top_k(self, query_embedding, query_dt: datetime, count: int) -> list[tuple[int, float, float, float]]:
+        """Scores every memory in one pass (recency + importance/10 + relevance) and
+        returns [(row, combined, recency, relevance), ...] best first."""
+        n = len(self)
+        if n == 0 or count <= 0:
+            return []
+        recency = self.recency_scores(query_dt)
+        prior = recency + self.importance[:n] / 10.0
+        query_vec = self._normalize(query_embedding)
+        if self.ann is not None and self.ann.trained and n >= ANN_MIN_MEMORIES and query_vec.shape[0] == self.dim and count < n:
+            rows = self.ann.candidates(self.ann_list[:n], query_vec, prior, count) # Exact rescoring of ANN candidates only
+            relevance = (np.asarray(self.embeddings[rows], dtype=np.float32) @ query_vec).astype(np.float64)
+            combined = prior[rows] + relevance
+            order = _select_top_k(combined, count)
+            return [(int(rows[i]), float(combined[i]), float(recency[rows[i]]), float(relevance[i])) for i in order]
+
+        relevance = self.relevance_scores(query_embedding).astype(np.float64)
+        combined = prior + relevance
+        order = _select_top_k(combined, count)
+        return [(int(i), float(combined[i]), float(recency[i]), float(relevance[i])) for i in order]
+
+    def touch(self, idx: int, access_dt: datetime):
+        self.memories[idx]['last_accessed_timestamp_obj'] = access_dt
+        self.last_accessed_s[idx] = _dt_to_seconds(access_dt)
+        for standing in self.standing.values():
+            if idx not in standing.rows: # Candidates are rescored at query time anyway
+                standing.note(self, idx)
+
+    def embedding_row(self, idx: int) -> np.ndarray:
+        if self.embeddings is None:
+            return None
+        return self.embedding_rows(idx, idx + 1)[0]
+
+    def remove(self, rows) -> list[tuple[dict, np.ndarray]]:
+        """Drops rows (compacting the columns) and returns [(memory, normalized float32 embedding), ...] for them."""
+        n = len(self)
+        drop = np.zeros(n, dtype=bool)
+        drop[np.asarray(list(rows), dtype=np.int64)] = True
+        keep = np.flatnonzero(~drop)
+        removed = [(self.memories[i], self.embedding_row(i)) for i in np.flatnonzero(drop)]
+
+        new_row = np.full(n, -1, dtype=np.int64)
+        new_row[keep] = np.arange(keep.shape[0])
+        for attr in ('created_s', 'last_accessed_s', 'importance', 'ann_list'):
+            column = getattr(self, attr)
+            column[:keep.shape[0]] = column[keep]
+        if self.embeddings is not None:
+            # keep is increasing and keep[i] >= i, so chunked forward copies never overwrite unread rows
+            for start in range(0, keep.shape[0], MEMORY_SCAN_CHUNK_ROWS):
+                chunk = keep[start:start + MEMORY_SCAN_CHUNK_ROWS]
+                self.embeddings[start:start + chunk.shape[0]] = self.embeddings[chunk]
+        self.memories = [self.memories[i] for i in keep]
+        self.merge_index = {key: int(new_row[row]) for key, row in self.merge_index.items() if new_row[row] >= 0}
+        for standing in self.standing.values(): # Rows moved; rebuilt on next use
+            standing.invalidate()
+        return removed
+
+class ColdMemoryTier:
+    """Append-only on-disk tier for archived memories, memory-mapped and scanned only on demand.
+
+    Layout (one directory per agent): embeddings.bin (normalized rows, dtype in meta.json), columns.bin (timestamps,
+    importance, alive flag), memories.jsonl (memory metadata) and offsets.u64 (line offsets). Promoted rows are
+    only flagged dead; compact() rewrites the files without them. With ANN_ENABLED, an in-memory IVF index over
+    the alive rows is (re)trained on open and append, never from top_k, which then rescores only its candidates.
+    """
+    COLUMNS_DTYPE = np.dtype([('created', '<f8'), ('last_accessed', '<f8'), ('importance', '<f4'), ('alive', 'u1')])
+
+    def __init__(self, directory: str, reset: bool = False):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._paths = {name: os.path.join(directory, name) for name in ('embeddings.bin', 'columns.bin', 'memories.jsonl', 'offsets.u64', 'meta.json')}
+        if reset:
+            for path in self._paths.values():
+                if os.path.exists(path): os.remove(path)
+        self.dim = None
+        self.dtype = np.dtype(MEMORY_EMBEDDING_DTYPE)
+        if os.path.exists(self._paths['meta.json']):
+            with open(self._paths['meta.json']) as f:
+                meta = json.load(f)
+            self.dim = meta['dim']
+            self.dtype = np.dtype(meta.get('dtype', 'float32'))
+        self.count = os.path.getsize(self._paths['columns.bin']) // self.COLUMNS_DTYPE.itemsize if os.path.exists(self._paths['columns.bin']) else 0
+        self._lock = threading.Lock()
+        self.ann = IVFIndex() if ANN_ENABLED else None
+        self.ann_list = np.full(self.count, -1, dtype=np.int32) # IVF cluster per row (-1: untrained)
+        self._maybe_train_ann()
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _serialize(memory: dict) -> str:
+        return json.dumps(_memory_to_record(memory), default=str)
+
+    @staticmethod
+    def _deserialize(line: str) -> dict:
+        return _memory_from_record(json.loads(line))
+
+    def append(self, memories: list[dict], embeddings: np.ndarray):
+        if not memories:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+                with open(self._paths['meta.json'], 'w') as f:
+                    json.dump({'dim': self.dim, 'dtype': self.dtype.name}, f)
+            columns = np.zeros(len(memories), dtype=self.COLUMNS_DTYPE)
+            columns['created'] = [_dt_to_seconds(m['creation_timestamp_obj']) for m in memories]
+            columns['last_accessed'] = [_dt_to_seconds(m['last_accessed_timestamp_obj']) for m in memories]
+            columns['importance'] = [m['importance_score'] for m in memories]
+            columns['alive'] = 1
+            with open(self._paths['memories.jsonl'], 'ab') as f:
+                offset = f.tell()
+                offsets = []
+                for memory in memories:
+                    line = (self._serialize(memory) + "\n").encode('utf-8')
+                    offsets.append(offset)
+                    f.write(line)
+                    offset += len(line)
+            with open(self._paths['offsets.u64'], 'ab') as f:
+                f.write(np.asarray(offsets, dtype='<u8').tobytes())
+            with open(self._paths['embeddings.bin'], 'ab') as f:
+                f.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+            with open(self._paths['columns.bin'], 'ab') as f:
+                f.write(columns.tobytes())
+            self.count += len(memories)
+            if self.ann is not None and self.ann.trained:
+                self.ann_list = np.concatenate([self.ann_list, self.ann.assign(np.asarray(embeddings, dtype=np.float32))])
+                self.ann.added_since_training += len(memories)
+            else:
+                self.ann_list = np.concatenate([self.ann_list, np.full(len(memories), -1, dtype=np.int32)])
+            self._maybe_train_ann()
+
+    def _map(self, name, dtype, shape, mode='r'):
+        return np.memmap(self._paths[name], dtype=dtype, mode=mode, shape=shape)
+
+    def _maybe_train_ann(self):
+        """Same policy as MemoryStore._maybe_train_ann, over the alive rows; callers hold the lock (or own the tier)."""
+        if self.ann is None or self.dim is None or self.count == 0:
+            return
+        alive = np.flatnonzero(self._map('columns.bin', self.COLUMNS_DTYPE, (self.count,))['alive'])
+        if alive.shape[0] < ANN_MIN_MEMORIES:
+            return
+        if self.ann.trained and self.ann.added_since_training < ANN_RETRAIN_FRACTION * self.ann.trained_size:
+            return
+        sample = alive
+        if sample.shape[0] > ANN_TRAIN_SAMPLE:
+            sample = np.sort(np.random.default_rng(ANN_SEED).choice(alive, ANN_TRAIN_SAMPLE, replace=False))
+        embeddings = self._map('embeddings.bin', self.dtype, (self.count, self.dim))
+        self.ann.train(np.asarray(embeddings[sample], dtype=np.float32), ANN_NLIST or int(4 * math.sqrt(alive.shape[0])))
+        self.ann.trained_size = alive.shape[0]
+        self.ann.added_since_training = 0
+        for start in range(0, self.count, MEMORY_SCAN_CHUNK_ROWS):
+            self.ann_list[start:start + MEMORY_SCAN_CHUNK_ROWS] = self.ann.assign(np.asarray(embeddings[start:start + MEMORY_SCAN_CHUNK_ROWS], dtype=np.float32))
+
+    def top_k(self, query_vec: np.ndarray, query_dt: datetime, count: int) -> list[tuple[int, float, float, float]]:
+        """Same scoring as MemoryStore.top_k, over the archived rows that are still alive."""
+        with self._lock:
+            n = self.count
+            if n == 0 or count <= 0 or query_vec is None or query_vec.shape[0] != self.dim:
+                return []
+            columns = self._map('columns.bin', self.COLUMNS_DTYPE, (n,))
+            embeddings = self._map('embeddings.bin', self.dtype, (n, self.dim))
+            recency = np.exp(-RECENCY_DECAY_PER_HOUR * (_dt_to_seconds(query_dt) - columns['last_accessed']) / 3600.0)
+            prior = recency + columns['importance'] / 10.0
+            prior[columns['alive'] == 0] = -np.inf
+            alive_count = int(np.count_nonzero(columns['alive']))
+            if self.ann is not None and self.ann.trained and alive_count >= ANN_MIN_MEMORIES and count < alive_count:
+                rows = self.ann.candidates(self.ann_list[:n], query_vec, prior, count) # Reads only the candidates' embeddings
+                relevance = np.asarray(embeddings[rows], dtype=np.float32) @ query_vec
+                combined = prior[rows] + relevance
+                order = _select_top_k(combined, count)
+                return [(int(rows[i]), float(combined[i]), float(recency[rows[i]]), float(relevance[i])) for i in order]
+            relevance = np.empty(n, dtype=np.float64)
+            for start in range(0, n, MEMORY_SCAN_CHUNK_ROWS):
+                relevance[start:start + MEMORY_SCAN_CHUNK_ROWS] = np.asarray(embeddings[start:start + MEMORY_SCAN_CHUNK_ROWS], dtype=np.float32) @ query_vec
+            combined = prior + relevance
+            order = _select_top_k(combined, min(count, alive_count))
+            return [(int(i), float(combined[i]), float(recency[i]), float(relevance[i])) for i in order]
+
+    def load(self, row: int) -> tuple[dict, np.ndarray]:
+        with self._lock:
+            offset = int(self._map('offsets.u64', '<u8', (self.count,))[row])
+            with open(self._paths['memories.jsonl'], 'rb') as f:
+                f.seek(offset)
+                memory = self._deserialize(f.readline().decode('utf-8'))
+            embedding = np.asarray(self._map('embeddings.bin', self.dtype, (self.count, self.dim))[row], dtype=np.float32)
+            return memory, embedding
+
+    def mark_promoted(self, rows):
+        """Tombstones rows that were moved back into the hot store."""
+        with self._lock:
+            columns = self._map('columns.bin', self.COLUMNS_DTYPE, (self.count,), mode='r+')
+            columns['alive'][list(rows)] = 0
+            columns.flush()
+
+    def alive_count(self) -> int:
+        with self._lock:
+            if self.count == 0:
+                return 0
+            return int(np.count_nonzero(self._map('columns.bin', self.COLUMNS_DTYPE, (self.count,))['alive']))
+
+    def compact(self, min_dead_fraction=MEMORY_COLD_COMPACT_FRACTION) -> bool:
+        """Rewrites the files without promoted rows once they make up min_dead_fraction of them; rows are renumbered."""
+        with self._lock:
+            if self.count == 0:
+                return False
+            columns = np.array(self._map('columns.bin', self.COLUMNS_DTYPE, (self.count,)))
+            keep = np.flatnonzero(columns['alive'])
+            if self.count - keep.shape[0] < max(1, min_dead_fraction * self.count):
+                return False
+            offsets = np.array(self._map('offsets.u64', '<u8', (self.count,)))
+            tmp = {name: path + ".tmp" for name, path in self._paths.items() if name != 'meta.json'}
+            new_offsets = np.zeros(keep.shape[0], dtype='<u8')
+            with open(self._paths['memories.jsonl'], 'rb') as src, open(tmp['memories.jsonl'], 'wb') as dst:
+                for i, row in enumerate(keep):
+                    src.seek(int(offsets[row]))
+                    new_offsets[i] = dst.tell()
+                    dst.write(src.readline())
+            with open(tmp['offsets.u64'], 'wb') as f:
+                f.write(new_offsets.tobytes())
+            with open(tmp['columns.bin'], 'wb') as f:
+                f.write(columns[keep].tobytes())
+            with open(tmp['embeddings.bin'], 'wb') as f:
+                if self.dim is not None:
+                    embeddings = self._map('embeddings.bin', self.dtype, (self.count, self.dim))
+                    for start in range(0, keep.shape[0], MEMORY_SCAN_CHUNK_ROWS):
+                        f.write(np.ascontiguousarray(embeddings[keep[start:start + MEMORY_SCAN_CHUNK_ROWS]]).tobytes())
+                    del embeddings # Unmap before the file is replaced
+            for name, path in tmp.items():
+                os.replace(path, self._paths[name])
+            self.count = keep.shape[0]
+            self.ann_list = self.ann_list[keep]
+            return True
+
+# --- Concurrent Tick Execution ---
+_TICK_CONTEXT = threading.local() # Per-thread list of deferred world mutations during a concurrent tick
+
+def in_concurrent_tick() -> bool:
+    return getattr(_TICK_CONTEXT, 'deferred', None) is not None
+
+def defer_world_mutation(fn, *args, **kwargs):
+    """Runs fn now, or queues it until the end of the tick if called from a concurrent agent update.
+
+    Anything that mutates shared world state (objects, other agents, the classifiers' examples and plan
+    templates) goes through here so that concurrent ticks apply those changes in agent order,
+    independent of LLM latency.
+    """
+    deferred = getattr(_TICK_CONTEXT, 'deferred', None)
+    if deferred is None:
+        return fn(*args, **kwargs)
+    deferred.append((fn, args, kwargs))
+
+class TickExecutor:
+    """Runs per-agent cognition on a bounded thread pool so blocking LLM calls overlap.
+
+    Each tick has two phases: every agent's work runs concurrently against a snapshot of the
+    other agents' observable state, then the world mutations each agent deferred are applied
+    serially in the order the agents were passed in. A seeded mock-backend run therefore repeats
+    exactly for a given worker count (agents draw from their own agent_rng); against Ollama,
+    latency still decides which background calls LLM_SCHEDULER degrades.
+    """
+    def __init__(self, max_workers=TICK_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="agent-tick") if self.max_workers > 1 else None
+
+    @staticmethod
+    def _run_deferred(fn, agent):
+        _TICK_CONTEXT.deferred = []
+        try:
+            fn(agent)
+            return _TICK_CONTEXT.deferred
+        finally:
+            _TICK_CONTEXT.deferred = None
+
+    def run_for_each(self, agents, fn, observed=None):
+        """Calls fn(agent) for every agent, concurrently when a pool is configured.
+
+        `observed` (default: agents) are the agents whose state is snapshotted for the tick.
+        """
+        if self._pool is None or len(agents) <= 1:
+            for agent in agents:
+                fn(agent)
+            return
+
+        for agent in (agents if observed is None else observed):
+            agent.publish_observable_state()
+        futures = [self._pool.submit(self._run_deferred, fn, agent) for agent in agents]
+        deferred_per_agent = [future.result() for future in futures] # Re-raises worker exceptions
+
+        for deferred in deferred_per_agent: # Apply in agent order, not completion order
+            for mutation_fn, args, kwargs in deferred:
+                mutation_fn(*args, **kwargs)
+
+    def run_tick(self, agents, all_agents=None):
+        """Updates `agents` (the ones due this minute) against the whole town, `all_agents`."""
+        all_agents = agents if all_agents is None else all_agents
+        self.run_for_each(agents, lambda agent: agent.update(all_agents), observed=all_agents)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+# --- Speculative Plan Decomposition ---
+def _speculative_decomposition(agent_name: str, role: str, high_level_step: str, agent_summary: str, current_location: str, dt_obj: datetime) -> list[str]:
+    """Runs on a PlanSpeculator thread; touches no agent state. [] when the request was degraded."""
+    return decompose_plan_step(agent_name, role, high_level_step, agent_summary, current_location, dt_obj, call_site="plan_speculation")
+
+class PlanSpeculator:
+    """Decomposes upcoming high-level plan steps on background threads while the current one executes.
+
+    Agents keep the futures keyed by plan version and step text (see Agent._speculate_upcoming_steps);
+    a rewritten plan bumps the version, so look-aheads made for the old plan are discarded unused.
+    """
+    def __init__(self, max_workers=SPECULATIVE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="plan-speculation")
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'used': 0, 'missed': 0, 'discarded': 0}
+
+    def submit(self, agent_name: str, role: str, high_level_step: str, agent_summary: str, current_location: str, dt_obj: datetime):
+        self.count('submitted')
+        return self._pool.submit(_speculative_decomposition, agent_name, role, high_level_step, agent_summary, current_location, dt_obj)
+
+    def count(self, outcome: str, n: int = 1):
+        with self._lock:
+            self.stats[outcome] += n
+
+    def report(self) -> str:
+        with self._lock:
+            stats = dict(self.stats)
+        return (f"Plan speculation: {stats['used']} step transitions served ahead of time, {stats['missed']} decomposed on demand, "
+                f"{stats['discarded']} discarded after plan changes ({stats['submitted']} submitted)")
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+PLAN_SPECULATOR = PlanSpeculator()
 
-def call_ollama_for_relationship_update(agent_name_1: str, agent_name_2: str, interaction_summary: str, current_friendship: int, current_trust: int) -> dict:
-    prompt = (
-        f"Agent {agent_name_1} and Agent {agent_name_2} just had an interaction summarized as: '{interaction_summary}'.\n"
-        f"Their current friendship score (0-100) is {current_friendship}, and trust score (0-100) is {current_trust}.\n"
-        f"How should these scores change? Provide deltas (e.g., friendship_delta: +5, trust_delta: -2). Respond with only 'friendship_delta: [value]; trust_delta: [value]'."
-    )
-    response = _call_ollama(prompt, agent_name_1)
-    deltas = {'friendship_delta': 0, 'trust_delta': 0}
-    try:
-        parts = response.split(';')
-        for part in parts:
-            key_value = part.split(':')
-            if len(key_value) == 2:
-                key = key_value[0].strip()
-                value = float(key_value[1].strip().replace('+', '')) # Handle + sign
-                if key == 'friendship_delta': deltas['friendship_delta'] = value
-                elif key == 'trust_delta': deltas['trust_delta'] = value
-    except Exception as e:
-        print(f"Error parsing relationship update: {e} from response: {response}")
-    return deltas
+# --- Event Scheduler ---
+def _game_minute(dt_obj: datetime) -> int:
+    return int(_dt_to_seconds(dt_obj) // 60)
 
-def call_ollama_for_need_fulfillment_plan(agent_name: str, need_type: str, agent_summary:str, current_location: str, known_locations_info: str, dt_obj:datetime) -> list[str]:
-    prompt = (
-        f"Agent: {agent_name}\nSummary: {agent_summary}\nCurrently at: {current_location}\nTime: {dt_obj.strftime('%A, %B %d, %Y, %I:%M %p')}\n"
-        f"CRITICAL NEED: {need_type}.\n"
-        f"Known locations relevant to this need:\n{known_locations_info}\n"
-        f"Generate a short, high-priority 2-3 step plan for {agent_name} to fulfill this need for '{need_type}'. Specify locations and objects. Respond as a numbered list."
-    )
-    plan_text = _call_ollama(prompt, agent_name)
-    return [step.strip() for step in plan_text.split('\n') if step.strip() and (step[0].isdigit() or step[0] == '-')]
+class EventScheduler:
+    """Min-heap of (game minute, agent name): when each agent next has something to do.
 
-def call_ollama_for_object_interaction_outcome(agent_name: str, action_description: str, obj: WorldObject, agent_summary: str) -> dict:
-    prompt = (
-        f"Agent: {agent_name}\nSummary: {agent_summary}\n"
-        f"Action: '{action_description}'\n"
-        f"Object: '{obj.name}' at '{obj.location_name}'\n"
-        f"Object's current state: '{obj.current_state}'\n"
-        f"Object's current properties: {json.dumps(obj.properties)}\n"
-        f"What is the outcome for the agent (e.g., 'Agent is now busy cooking', 'Agent obtained wood') AND "
-        f"what is the new state of '{obj.name}' (e.g., 'on', 'empty') AND "
-        f"how do its properties change (e.g., food_count: 9, is_on: true)?\n"
-        f"Respond ONLY in JSON format: {{\"agent_outcome\": \"text\", \"object_new_state\": \"text\", \"object_property_changes\": {{\"key\": \"value\", ...}}}}"
-    )
-    response_str = _call_ollama(prompt, agent_name)
-    try:
-        outcome = json.loads(response_str)
-        return {
-            "agent_outcome": outcome.get("agent_outcome", f"Agent used {obj.name}."),
-            "object_new_state": outcome.get("object_new_state", obj.current_state),
-            "object_property_changes": outcome.get("object_property_changes", {})
-        }
-    except json.JSONDecodeError:
-        print(f"Error decoding JSON from LLM for object interaction: {response_str}")
-        return {"agent_outcome": f"Agent used {obj.name}.", "object_new_state": obj.current_state, "object_property_changes": {}}
+    Re-scheduling only ever moves an agent earlier; superseded heap entries are skipped when popped.
+    """
+    def __init__(self):
+        self._heap = []
+        self._next = {} # agent name -> the minute it is due
+        self._lock = threading.Lock()
+
+    def schedule(self, name: str, minute: int):
+        with self._lock:
+            if minute < self._next.get(name, float('inf')):
+                self._next[name] = minute
+                heapq.heappush(self._heap, (minute, name))
+
+    def pop_due(self, minute: int) -> set:
+        """Names of agents due at or before `minute` (they must be re-scheduled after running)."""
+        due = set()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= minute:
+                due_minute, name = heapq.heappop(self._heap)
+                if self._next.get(name) == due_minute:
+                    del self._next[name]
+                    due.add(name)
+        return due
+
+    def next_minute(self):
+        with self._lock:
+            while self._heap and self._next.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def forget(self, name: str):
+        with self._lock:
+            self._next.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._next.clear()
+
+EVENT_SCHEDULER = EventScheduler()
+
+def minutes_to_next_event(next_event_minute, days_to_run=GAME_DAYS_TO_RUN) -> int:
+    """How far the clock may jump: to the next agent event, but never past midnight, a checkpoint boundary
+    or the last minute of the day budget."""
+    now = _game_minute(current_datetime)
+    if next_event_minute is None or next_event_minute <= now + 1:
+        return 1
+    to_midnight = GAME_HOURS_PER_DAY * GAME_MINUTES_PER_HOUR - (current_datetime.hour * GAME_MINUTES_PER_HOUR + current_datetime.minute)
+    if game_day_of(current_datetime + timedelta(minutes=to_midnight)) > days_to_run:
+        to_midnight -= 1 # Stop on the budget's last minute
+    limit = now + to_midnight
+    if CHECKPOINT_INTERVAL_MINUTES > 0:
+        limit = min(limit, (now // CHECKPOINT_INTERVAL_MINUTES + 1) * CHECKPOINT_INTERVAL_MINUTES)
+    return max(1, min(next_event_minute, limit) - now)
+
+def catch_up_agents(agents):
+    """Brings every sleeping agent's passive state up to the current minute (before saving or drawing)."""
+    if EVENT_SCHEDULING:
+        minute = _game_minute(current_datetime)
+        for agent in agents:
+            agent.catch_up(minute)
 
 # --- Agent Class (Modified for Sophistication) ---
+_ACTION_DURATION = re.compile(r'\bfor (\d+) (minute|min|hour)', re.I) # "Review the ledger for 30 minutes"
+
 class Agent:
     def __init__(self, name, role, description, start_location_name, color, all_agent_names):
         self.name = name
@@ -328,7 +2417,12 @@ class Agent:
         self.current_location_name = start_location_name
         self.x, self.y = LOCATIONS[start_location_name]['rect'].center
         self.size = 20
-        self.memory_stream = []
+        self.rng = agent_rng(name) # All of this agent's random draws (seed memory times, busy timers, sickness, ...)
+        self.sickness_minute = self._draw_sickness_minute(_game_minute(current_datetime)) # When the agent next falls ill
+        WORLD_INDEX.place_agent(self, start_location_name)
+        self.memory_store = MemoryStore(embedding_path=self._embedding_buffer_path(name))
+        self.pending_embeddings = [] # (memory row, text, unscored) awaiting the next batched embed flush
+        self.cold_memory = ColdMemoryTier(os.path.join(MEMORY_COLD_DIR, name), reset=True) # Fresh agent, fresh archive
         self.high_level_plan = []
         self.detailed_plan = []
         self.current_high_level_action_index = 0
@@ -346,6 +2440,15 @@ class Agent:
         self.previous_day_activity_summary = "No activities recorded yet for the previous day."
         self.busy_with_object_id = None
         self.busy_timer = 0
+        self._observable_state = None # Snapshot other agents see during a concurrent tick
+        self.cognition_level = "full" # "full" (LLM) or "reduced" (rule-based), see update_cognition_level
+        self.low_salience_minutes = 0
+        self.last_update_minute = None # Game minute the passive state is current to (event scheduling)
+        self.importance_since_reflection = 0 # Running sum that triggers reflect()
+        self.plan_version = 0 # Bumped whenever high_level_plan is rewritten
+        self.speculative_decompositions = {} # high-level step index -> (plan_version, step, Future of its detailed plan)
+        self.urgent_need = None # Need the urgent steps at the head of high_level_plan are for
+        self.urgent_plan_end = 0 # high_level_plan index just past those steps
 
         # Enhanced Sophistication Attributes
         self.emotional_state = "neutral"
@@ -356,7 +2459,7 @@ class Agent:
             if mem_text.strip():
                 self.add_memory(f"{self.name} {mem_text.strip()}", "Seed", importance_score=9,
                                 location_context=self.current_location_name,
-                                dt_obj=get_current_game_time_as_datetime() - timedelta(days=1, minutes=random.randint(1,1440)))
+                                dt_obj=get_current_game_time_as_datetime() - timedelta(days=1, minutes=self.rng.randint(1,1440)))
         self.update_cached_summary()
 
     def _get_initial_goals(self):
@@ -369,15 +2472,112 @@ class Agent:
         else: base_goals = ["Survive", "Interact with environment"]
         return base_goals + ["Seek personal fulfillment", "Maintain good relationships"]
 
-    def add_memory(self, description, memory_type, importance_score=None, related_agents=None, location_context=None, objects_involved=None, dt_obj=None):
+    @property
+    def memory_stream(self) -> list[dict]:
+        return self.memory_store.memories
+
+    @staticmethod
+    def _embedding_buffer_path(name: str):
+        return os.path.join(MEMORY_BUFFER_DIR, f"{name}.emb") if MEMORY_BUFFER_DIR else None
+
+    def publish_observable_state(self):
+        """Freezes what other agents can observe about this agent for the coming concurrent tick."""
+        relationships = {other: {'friendship_score': rel['friendship_score'], 'trust_score': rel['trust_score']} for other, rel in self.relationships.items()}
+        self._observable_state = (self.current_location_name, self.current_message, self.message_timer,
+                                  self.cached_summary, self.emotional_state, self._current_detailed_step(), relationships)
+
+    # Plain attributes saved verbatim in checkpoints (memories, relationships and cold tier are handled separately)
+    CHECKPOINT_FIELDS = (
+        'name', 'role', 'initial_description', 'color', 'current_location_name', 'x', 'y', 'size',
+        'high_level_plan', 'detailed_plan', 'current_high_level_action_index', 'current_detailed_action_index',
+        'needs', 'status', 'target_location_name', 'target_x', 'target_y', 'current_message', 'message_timer',
+        'goals', 'dialogue_history', 'cached_summary', 'last_summary_update_day', 'previous_day_activity_summary',
+        'busy_with_object_id', 'busy_timer', 'emotional_state', 'cognition_level', 'low_salience_minutes',
+        'importance_since_reflection', 'urgent_need', 'urgent_plan_end', 'sickness_minute',
+    )
+    cognition_level = "full" # Class defaults cover checkpoints written before level of detail existed
+    low_salience_minutes = 0
+    importance_since_reflection = 0
+    last_update_minute = None # Not checkpointed: restored agents are simply due on the next minute
+    plan_version = 0 # Not checkpointed either: look-aheads are re-issued after a restore
+    urgent_need = None
+    urgent_plan_end = 0
+    sickness_minute = None
+    _alone_while_asleep = False
+
+    def to_checkpoint(self) -> tuple[dict, np.ndarray]:
+        """Returns (JSON-safe state, hot-store embedding matrix) for a checkpoint."""
+        flush_pending_embeddings([self])
+        state = {field: getattr(self, field) for field in self.CHECKPOINT_FIELDS}
+        state['color'] = list(self.color)
+        state['rng_state'] = self.rng.getstate()
+        state['relationships'] = {other: {**rel, 'last_interaction_time': rel['last_interaction_time'].isoformat() if rel['last_interaction_time'] else None}
+                                  for other, rel in self.relationships.items()}
+        state['memories'] = [_memory_to_record(memory) for memory in self.memory_stream]
+        n = len(self.memory_store)
+        dim = self.memory_store.dim or ZERO_EMBEDDING.shape[0]
+        embeddings = np.array(self.memory_store.embeddings[:n]) if self.memory_store.embeddings is not None else np.zeros((n, dim), dtype=MEMORY_EMBEDDING_DTYPE)
+        return state, embeddings
+
+    @classmethod
+    def from_checkpoint(cls, state: dict, embeddings: np.ndarray, cold_dir: str):
+        """Rebuilds an agent without any LLM or embedding calls."""
+        agent = cls.__new__(cls)
+        for field in cls.CHECKPOINT_FIELDS:
+            if field in state:
+                setattr(agent, field, state[field])
+        agent.color = tuple(state['color'])
+        agent.rng = agent_rng(agent.name)
+        if 'rng_state' in state: # JSON turned the state's tuples into lists
+            version, internal, gauss_next = state['rng_state']
+            agent.rng.setstate((version, tuple(internal), gauss_next))
+        if agent.sickness_minute is None:
+            agent.sickness_minute = agent._draw_sickness_minute(_game_minute(current_datetime))
+        agent.relationships = {other: {**rel, 'last_interaction_time': datetime.fromisoformat(rel['last_interaction_time']) if rel['last_interaction_time'] else None}
+                               for other, rel in state['relationships'].items()}
+        agent.memory_store = MemoryStore(embedding_path=cls._embedding_buffer_path(agent.name))
+        agent.pending_embeddings = []
+        agent.speculative_decompositions = {}
+        agent._observable_state = None
+        for row, record in enumerate(state['memories']):
+            memory = _memory_from_record(record)
+            idx = agent.memory_store.add(memory, embeddings[row])
+            if 'occurrence_count' in memory: # Only mergeable observations carry a count
+                agent.memory_store.merge_index[_memory_merge_key(memory['description'])] = idx
+        agent.cold_memory = ColdMemoryTier(cold_dir)
+        WORLD_INDEX.place_agent(agent, agent.current_location_name)
+        return agent
+
+    def observable_state(self) -> tuple:
+        """(location, message, message_timer, summary, emotion, detailed step, relationships) as seen by others:
+        the tick-start snapshot inside a concurrent tick."""
+        if in_concurrent_tick() and self._observable_state is not None:
+            return self._observable_state
+        return (self.current_location_name, self.current_message, self.message_timer,
+                self.cached_summary, self.emotional_state, self._current_detailed_step(), self.relationships)
+
+    def add_memory(self, description, memory_type, importance_score=None, related_agents=None, location_context=None, objects_involved=None, dt_obj=None, defer_embedding=False):
+        """Stores a new memory. With defer_embedding the vector is filled in by the next batched flush."""
         dt_obj = dt_obj or get_current_game_time_as_datetime()
-        if importance_score is None:
-            importance_score = call_ollama_for_importance_score(description, self.name)
+        mergeable = memory_type == "Observation" and importance_score is not None and importance_score <= MEMORY_MERGE_MAX_IMPORTANCE
+        if mergeable and self._merge_repeated_observation(description, dt_obj):
+            return
+        embedding = None
+        unscored = importance_score is None and LOCAL_CLASSIFIERS_ENABLED and defer_embedding
+        if unscored:
+            importance_score = 0 # Scored from the memory's own embedding when the batch is flushed
+        elif importance_score is None:
+            if LOCAL_CLASSIFIERS_ENABLED:
+                embedding = _call_ollama_embedding(description, self.name)
+                importance_score = classify_importance(description, embedding, self.name, self.rng)
+            else:
+                importance_score = call_ollama_for_importance_score(description, self.name)
         
-        embedding = _call_ollama_embedding(description, self.name)
+        if embedding is None and not defer_embedding:
+            embedding = _call_ollama_embedding(description, self.name)
 
         memory = {
-            'description': description, 'embedding': embedding,
+            'description': description,
             'creation_timestamp_obj': dt_obj, 'last_accessed_timestamp_obj': dt_obj,
             'type': memory_type, 'importance_score': importance_score,
             'recency_score': 1.0, 'relevance_score': 0.0,
@@ -385,44 +2585,120 @@ class Agent:
             'location_context': location_context if location_context else self.current_location_name,
             'objects_involved': objects_involved if objects_involved else []
         }
-        self.memory_stream.append(memory)
+        idx = self.memory_store.add(memory, embedding)
+        self.importance_since_reflection += importance_score
+        if defer_embedding:
+            self.pending_embeddings.append((idx, description, unscored))
+        if mergeable:
+            memory['occurrence_count'] = 1
+            memory['last_observed_timestamp_obj'] = dt_obj
+            self.memory_store.merge_index[_memory_merge_key(description)] = idx
         SIMULATION_LOG.append({
             'timestamp': datetime.now().isoformat(),
             'game_time': dt_obj.strftime("%Y-%m-%d %H:%M:%S"),
             'agent': self.name,
             'type': f"Memory_Added_{memory_type}",
-            'details': {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in memory.items() if k != 'embedding'}
+            'details': _memory_to_record(memory)
+        })
+
+        if len(self.memory_store) > MEMORY_HOT_CAPACITY:
+            self.consolidate_memories()
+
+    def score_deferred_memory(self, idx: int, description: str, embedding):
+        """Importance for a memory added unscored with defer_embedding, once the batch has its vector."""
+        importance_score = classify_importance(description, embedding, self.name, self.rng)
+        self.memory_store.set_importance(idx, importance_score)
+        self.importance_since_reflection += importance_score
+
+    def _merge_repeated_observation(self, description: str, dt_obj: datetime) -> bool:
+        """Folds a repeat of a low-importance observation into the existing memory (count + time span)."""
+        idx = self.memory_store.merge_index.get(_memory_merge_key(description))
+        if idx is None:
+            return False
+        memory = self.memory_store.memories[idx]
+        memory['occurrence_count'] = memory.get('occurrence_count', 1) + 1
+        memory['last_observed_timestamp_obj'] = dt_obj
+        if dt_obj > memory['last_accessed_timestamp_obj']:
+            self.memory_store.touch(idx, dt_obj) # Recency follows the latest occurrence
+        return True
+
+    def consolidate_memories(self):
+        """Archives old, low-importance memories to the cold tier so the hot set stays bounded."""
+        target = int(MEMORY_HOT_CAPACITY * MEMORY_HOT_TARGET_FRACTION)
+        store = self.memory_store
+        excess = len(store) - target
+        if excess <= 0:
+            return
+        flush_pending_embeddings([self]) # Rows are about to move; resolve deferred vectors first
+        n = len(store)
+        # Low-importance first, then oldest last access first
+        order = np.lexsort((store.last_accessed_s[:n], store.importance[:n] > MEMORY_ARCHIVE_MAX_IMPORTANCE))
+        removed = store.remove(order[:excess])
+        dim = store.dim or ZERO_EMBEDDING.shape[0]
+        embeddings = np.stack([vec if vec is not None else np.zeros(dim, dtype=np.float32) for _, vec in removed])
+        self.cold_memory.append([memory for memory, _ in removed], embeddings)
+        self.cold_memory.compact() # Drops rows promoted since (only when enough of them piled up)
+        SIMULATION_LOG.append({
+            'timestamp': datetime.now().isoformat(),
+            'game_time': get_current_game_time_as_datetime().strftime("%Y-%m-%d %H:%M:%S"),
+            'agent': self.name,
+            'type': "Memory_Archived",
+            'details': {'archived': len(removed), 'hot': len(store), 'cold': len(self.cold_memory)}
         })
 
-    def update_recency_scores(self, query_dt: datetime):
+    def _promote_cold_memories(self, cold_rows) -> list[int]:
+        """Moves archived memories back into the hot store (they were just retrieved); returns their hot rows."""
+        hot_rows = []
+        for row in cold_rows:
+            memory, embedding = self.cold_memory.load(row)
+            hot_rows.append(self.memory_store.add(memory, embedding))
+            if 'occurrence_count' in memory: # Repeats fold into it again (unless a newer copy already took the key)
+                self.memory_store.merge_index.setdefault(_memory_merge_key(memory['description']), hot_rows[-1])
+        self.cold_memory.mark_promoted(cold_rows)
+        return hot_rows
+
+    def update_recency_scores(self, query_dt: datetime) -> np.ndarray:
         """Decays recency scores for all memories based on time since last access."""
-        for memory in self.memory_stream:
-            hours_since_last_access = (query_dt - memory['last_accessed_timestamp_obj']).total_seconds() / 3600.0
-            memory['recency_score'] = math.exp(-0.01 * hours_since_last_access) # Decay factor 0.01 per hour
+        return self.memory_store.recency_scores(query_dt) # Decay factor 0.01 per hour
 
-    def retrieve_memories(self, query: str, count: int = 10, query_dt: datetime = None) -> list[dict]:
-        query_dt = query_dt or get_current_game_time_as_datetime()
-        self.update_recency_scores(query_dt) # Decay recency before retrieval
+    def retrieve_memories(self, query: str, count: int = 10, query_dt: datetime = None, include_cold: bool = False, standing: bool = False) -> list[dict]:
+        """Top memories by recency + importance + relevance. The cold tier is scanned only when
+        include_cold is set or the hot store alone cannot fill `count`; archival leaves thousands of
+        hot memories, so in practice only reflection's per-question retrievals reach it. Summary,
+        emotion, reaction and the other standing queries see the hot store only; archived memories
+        they would have ranked come back once a reflection promotes them.
 
-        query_embedding = _call_ollama_embedding(query, self.name) # Generate embedding for the query
+        standing marks a fixed query string that recurs: its embedding and candidate set are kept
+        (see StandingQuery) instead of rescanning the stream each time.
+        """
+        query_dt = query_dt or get_current_game_time_as_datetime()
+        flush_pending_embeddings([self]) # Deferred memories must have vectors before they are ranked
+        standing = standing and STANDING_QUERIES_ENABLED
+        standing_query = self.memory_store.standing.get(query) if standing else None
+        query_embedding = standing_query.query_vec if standing_query is not None else _call_ollama_embedding(query, self.name)
 
-        scored_memories = []
-        for memory in self.memory_stream:
-            relevance = cosine_similarity(query_embedding, memory['embedding'])
-            memory['relevance_score'] = relevance # Update for sorting
+        top = (self.memory_store.standing_top_k(query, query_embedding, query_dt, count) if standing
+               else self.memory_store.top_k(query_embedding, query_dt, count))
+        scored = [(combined, 'hot', idx, recency, relevance) for idx, combined, recency, relevance in top]
+        if (include_cold or len(scored) < count) and len(self.cold_memory):
+            query_vec = MemoryStore._normalize(query_embedding)
+            scored += [(combined, 'cold', row, recency, relevance) for row, combined, recency, relevance in self.cold_memory.top_k(query_vec, query_dt, count)]
+            scored.sort(key=lambda x: x[0], reverse=True)
+            scored = scored[:count]
+            cold_hits = [entry for entry in scored if entry[1] == 'cold']
+            if cold_hits:
+                hot_rows = self._promote_cold_memories([row for _, _, row, _, _ in cold_hits])
+                promoted = {entry[2]: hot_row for entry, hot_row in zip(cold_hits, hot_rows)}
+                scored = [(c, 'hot', promoted[idx] if tier == 'cold' else idx, r, rel) for c, tier, idx, r, rel in scored]
 
-            combined_score = memory['recency_score'] + \
-                             (memory['importance_score'] / 10.0) + \
-                             memory['relevance_score']
-            scored_memories.append((combined_score, memory))
-        
-        scored_memories.sort(key=lambda x: x[0], reverse=True)
-        
         retrieved_mem_list = []
-        for score, mem in scored_memories[:count]:
-            mem['last_accessed_timestamp_obj'] = query_dt # Update last access time for THIS retrieval
+        for _, _, idx, recency, relevance in scored:
+            mem = self.memory_store.memories[idx]
+            mem['recency_score'] = recency
+            mem['relevance_score'] = relevance
+            self.memory_store.touch(idx, query_dt) # Update last access time for THIS retrieval
             retrieved_mem_list.append(mem)
-            
+
         return retrieved_mem_list
 
     def update_cached_summary(self):
@@ -431,11 +2707,11 @@ class Agent:
         if current_dt.day == self.last_summary_update_day and self.cached_summary: 
             return
 
-        core_char_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s core characteristics", count=5, query_dt=current_dt)])
+        core_char_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s core characteristics", count=5, query_dt=current_dt, standing=True)])
         core_chars = call_ollama_for_agent_summary_component(self.name, f"{self.name}'s core characteristics", core_char_mem_text)
-        occupation_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s current daily occupation", count=5, query_dt=current_dt)])
+        occupation_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s current daily occupation", count=5, query_dt=current_dt, standing=True)])
         occupation = call_ollama_for_agent_summary_component(self.name, f"{self.name}'s current daily occupation", occupation_mem_text)
-        progress_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s feeling about their recent progress in life", count=5, query_dt=current_dt)])
+        progress_mem_text = "\n".join([m['description'] for m in self.retrieve_memories(f"{self.name}'s feeling about their recent progress in life", count=5, query_dt=current_dt, standing=True)])
         progress_feeling = call_ollama_for_agent_summary_component(self.name, f"{self.name}'s feeling about their recent progress in life", progress_mem_text)
 
         self.cached_summary = (f"{self.name}, the {self.role}. {self.initial_description.split(';')[0]}. "
@@ -446,11 +2722,11 @@ class Agent:
 
     def update_emotional_state(self):
         current_dt = get_current_game_time_as_datetime()
-        recent_events = self.retrieve_memories("recent impactful events for emotional update", count=5, query_dt=current_dt)
+        recent_events = self.retrieve_memories("recent impactful events for emotional update", count=5, query_dt=current_dt, standing=True)
         recent_events_summary = "; ".join([mem['description'] for mem in recent_events if mem['importance_score'] > 5])
         
         if recent_events_summary:
-            new_emotion = call_ollama_for_emotional_update(self.name, self.emotional_state, recent_events_summary)
+            new_emotion = classify_emotion(self.name, self.emotional_state, recent_events_summary, self.rng)
             if new_emotion != self.emotional_state:
                 self.emotional_state = new_emotion
                 self.add_memory(f"Emotional state changed to {self.emotional_state} due to recent events.", "EmotionalChange", importance_score=6, dt_obj=current_dt)
@@ -463,7 +2739,10 @@ class Agent:
         
         rel = self.relationships[other_agent_name]
         deltas = call_ollama_for_relationship_update(self.name, other_agent_name, interaction_summary, rel['friendship_score'], rel['trust_score'])
-        
+        self._apply_relationship_deltas(other_agent_name, deltas, interaction_summary, current_dt)
+
+    def _apply_relationship_deltas(self, other_agent_name, deltas: dict, interaction_summary: str, current_dt: datetime):
+        rel = self.relationships.setdefault(other_agent_name, {'friendship_score': 20, 'trust_score': 20, 'last_interaction_time': current_dt})
         rel['friendship_score'] = max(0, min(100, int(rel['friendship_score'] + deltas.get('friendship_delta',0))))
         rel['trust_score'] = max(0, min(100, int(rel['trust_score'] + deltas.get('trust_delta',0))))
         rel['last_interaction_time'] = current_dt
@@ -473,22 +2752,22 @@ class Agent:
 
     def reflect(self):
         """Agent reflects based on GA Paper Section 4.2."""
-        current_dt = get_current_game_time_as_datetime()
-        recent_memories = self.retrieve_memories("recent experiences for reflection", count=100, query_dt=current_dt) 
-        
-        if sum(m['importance_score'] for m in recent_memories[:20]) < REFLECTION_IMPORTANCE_THRESHOLD: 
+        if self.importance_since_reflection < REFLECTION_IMPORTANCE_THRESHOLD: # O(1) trigger; retrieval only once crossed
             return
+        current_dt = get_current_game_time_as_datetime()
+        recent_memories = self.retrieve_memories("recent experiences for reflection", count=100, query_dt=current_dt, standing=True) 
 
         recent_mem_descriptions_text = "\n".join([f"{idx+1}. {m['description']}" for idx, m in enumerate(recent_memories)])
         
         questions_to_reflect_on = call_ollama_for_reflection_questions(self.name, recent_mem_descriptions_text)
         if not questions_to_reflect_on:
-            return
+            return # Keep the sum: try again at the next opportunity
+        self.importance_since_reflection = 0 # Before the insights, which count towards the next reflection
 
         show_message_box(f"{self.name} is reflecting deeply...", PURPLE)
 
         for question in questions_to_reflect_on:
-            memories_for_question = self.retrieve_memories(question, count=15, query_dt=current_dt)
+            memories_for_question = self.retrieve_memories(question, count=15, query_dt=current_dt, include_cold=True)
             memories_for_question_text = "\n".join([f"{idx+1}. {m['description']}" for idx, m in enumerate(memories_for_question)])
             
             insight = call_ollama_for_reflection_insights(self.name, question, memories_for_question_text)
@@ -504,10 +2783,10 @@ class Agent:
         
         yesterday_dt = current_dt - timedelta(days=1)
         yesterday_memories = [m['description'] for m in self.memory_stream 
-                              if m['creation_timestamp_obj'].day == yesterday_dt.day and m['type'] == 'Observation']
+                              if m.get('last_observed_timestamp_obj', m['creation_timestamp_obj']).day == yesterday_dt.day and m['type'] == 'Observation']
         self.previous_day_activity_summary = "Yesterday was uneventful."
         if yesterday_memories:
-            self.previous_day_activity_summary = "Key activities yesterday: " + "; ".join(random.sample(yesterday_memories, min(len(yesterday_memories), 5)))
+            self.previous_day_activity_summary = "Key activities yesterday: " + "; ".join(self.rng.sample(yesterday_memories, min(len(yesterday_memories), 5)))
 
 
         self.high_level_plan = call_ollama_for_planning(self.name, self.role, self.cached_summary, 
@@ -516,6 +2795,7 @@ class Agent:
         self.current_high_level_action_index = 0
         self.detailed_plan = [] 
         self.current_detailed_action_index = 0
+        self._plan_changed()
         self.add_memory(f"Planned daily activities: {'; '.join(self.high_level_plan)}", "Plan", importance_score=8, dt_obj=current_dt)
         self.status = "idle"
         if self.high_level_plan:
@@ -529,16 +2809,100 @@ class Agent:
             return
 
         high_level_step = self.high_level_plan[self.current_high_level_action_index]
-        self.detailed_plan = call_ollama_for_decompose_plan_step(self.name, high_level_step, self.cached_summary, self.current_location_name, current_dt)
+        self.detailed_plan = (self._take_speculative_decomposition(self.current_high_level_action_index, high_level_step)
+                              or decompose_plan_step(self.name, self.role, high_level_step, self.cached_summary, self.current_location_name, current_dt))
         self.current_detailed_action_index = 0
         self.add_memory(f"Decomposed '{high_level_step}' into: {'; '.join(self.detailed_plan)}", "PlanDetail", importance_score=6, dt_obj=current_dt)
+        self._speculate_upcoming_steps(current_dt)
+
+    def _plan_changed(self):
+        """Call after rewriting high_level_plan: look-aheads made for the old plan become stale.
+
+        Those for a step the new plan also has coming up (urgent plans keep the rest of the old one)
+        are carried over under the new version instead of being re-issued.
+        """
+        self.plan_version += 1
+        self.urgent_need = None # address_critical_need sets it again for its own plans
+        if not self.speculative_decompositions:
+            return
+        old = {} # step -> its futures (a plan may repeat a step)
+        for _, step, future in self.speculative_decompositions.values():
+            old.setdefault(step, []).append(future)
+        self.speculative_decompositions = {}
+        start = self.current_high_level_action_index
+        for index, step in enumerate(self.high_level_plan[start:start + 1 + SPECULATIVE_LOOKAHEAD_STEPS], start):
+            if old.get(step):
+                self.speculative_decompositions[index] = (self.plan_version, step, old[step].pop())
+        stale = [future for futures in old.values() for future in futures]
+        for future in stale:
+            future.cancel()
+        if stale:
+            PLAN_SPECULATOR.count('discarded', len(stale))
+
+    def _speculate_upcoming_steps(self, current_dt: datetime):
+        """Starts background decompositions of the next SPECULATIVE_LOOKAHEAD_STEPS high-level steps.
+
+        They are made with the current summary, location and time; the step they are used for usually
+        starts where the current one ends, and a rewritten plan discards them.
+        """
+        if not SPECULATIVE_DECOMPOSITION:
+            return
+        passed = [index for index in self.speculative_decompositions if index <= self.current_high_level_action_index]
+        for index in passed: # Steps skipped without being decomposed
+            self.speculative_decompositions.pop(index)[2].cancel()
+        if passed:
+            PLAN_SPECULATOR.count('discarded', len(passed))
+        last = min(len(self.high_level_plan), self.current_high_level_action_index + 1 + SPECULATIVE_LOOKAHEAD_STEPS)
+        for index in range(self.current_high_level_action_index + 1, last):
+            step = self.high_level_plan[index]
+            if self.speculative_decompositions.get(index, (None, None))[:2] != (self.plan_version, step):
+                self.speculative_decompositions[index] = (self.plan_version, step, PLAN_SPECULATOR.submit(
+                    self.name, self.role, step, self.cached_summary, self.current_location_name, current_dt))
+
+    def _take_speculative_decomposition(self, index: int, high_level_step: str):
+        """The look-ahead detailed plan for this step if it has already finished, else None (decompose on demand)."""
+        if not SPECULATIVE_DECOMPOSITION:
+            return None
+        entry = self.speculative_decompositions.pop(index, None)
+        if entry is None or entry[:2] != (self.plan_version, high_level_step):
+            PLAN_SPECULATOR.count('missed')
+            if entry is not None:
+                entry[2].cancel()
+                PLAN_SPECULATOR.count('discarded')
+            return None
+        future = entry[2]
+        if not future.done():
+            # Never wait: a running look-ahead may sit behind every other class in LLM_SCHEDULER. It still
+            # finishes into PLAN_TEMPLATES; a queued one would only duplicate the on-demand call.
+            future.cancel()
+            PLAN_SPECULATOR.count('missed')
+            return None
+        try:
+            steps = future.result()
+        except Exception as e:
+            print(f"Speculative decomposition failed for {self.name}: {e}")
+            steps = []
+        PLAN_SPECULATOR.count('used' if steps else 'missed')
+        return steps or None
+
+    def _current_detailed_step(self) -> str:
+        return self.detailed_plan[self.current_detailed_action_index] if self.detailed_plan and self.current_detailed_action_index < len(self.detailed_plan) else "No specific detailed action."
+
+    def _relationship_summary(self, other_agent_name) -> str:
+        return self._format_relationship(other_agent_name, self.relationships.get(other_agent_name))
+
+    @staticmethod
+    def _format_relationship(other_agent_name, rel) -> str:
+        if rel is None:
+            return "an acquaintance"
+        return f"Relationship with {other_agent_name}: Friendship {rel['friendship_score']:.0f}, Trust {rel['trust_score']:.0f}."
 
     def react_to_observation(self, observation_text, observed_entity_name=None, observed_action_status=None):
         """Reacts to observation based on GA Paper Section 4.3.1."""
         current_dt = get_current_game_time_as_datetime()
         self.update_cached_summary()
         
-        current_detailed_step = self.detailed_plan[self.current_detailed_action_index] if self.detailed_plan and self.current_detailed_action_index < len(self.detailed_plan) else "No specific detailed action."
+        current_detailed_step = self._current_detailed_step()
         
         context_summary = ""
         if observed_entity_name: 
@@ -557,7 +2921,9 @@ class Agent:
         full_agent_summary_for_reaction = self.cached_summary + f" Currently feeling: {self.emotional_state}."
 
         should_react, reaction_description = call_ollama_for_reaction(self.name, full_agent_summary_for_reaction, current_detailed_step, observation_text, context_summary, current_dt)
-        
+        self._act_on_reaction(observation_text, observed_entity_name, should_react, reaction_description, current_dt)
+
+    def _act_on_reaction(self, observation_text, observed_entity_name, should_react: bool, reaction_description: str, current_dt: datetime):
         if should_react:
             self.add_memory(f"Reacted to '{observation_text}'. Reaction: {reaction_description}. Emotion: {self.emotional_state}", "Reaction", 
                             importance_score=9, related_agents=[observed_entity_name] if observed_entity_name else [], dt_obj=current_dt)
@@ -568,6 +2934,7 @@ class Agent:
                 self.current_high_level_action_index = 0
                 self.detailed_plan = []
                 self.current_detailed_action_index = 0
+                self._plan_changed()
                 if self.high_level_plan: self.decompose_current_plan_step()
                 show_message_box(f"{self.name}: Plan changed: {self.high_level_plan[0] if self.high_level_plan else 'Cleared'}", ORANGE)
             elif "Go to" in reaction_description and any(loc in reaction_description for loc in LOCATIONS): 
@@ -585,6 +2952,7 @@ class Agent:
                         self.current_high_level_action_index = 0
                         self.detailed_plan = []
                         self.current_detailed_action_index = 0
+                        self._plan_changed()
                         if self.high_level_plan: self.decompose_current_plan_step()
                         show_message_box(f"{self.name}: Reacting by going to {found_loc}", ORANGE)
                     else: 
@@ -601,53 +2969,69 @@ class Agent:
                             importance_score=2, related_agents=[observed_entity_name] if observed_entity_name else [], dt_obj=current_dt)
 
     def communicate(self, target_agent, message_context_from_plan: str):
-        """Agent sends a natural language message."""
+        """Agent sends a natural language message.
+
+        With FUSED_DIALOGUE_TURNS one generation also decides the listener's reading, reaction and both
+        relationship deltas; the listener's part travels with the message (see receive_communication).
+        """
         current_dt = get_current_game_time_as_datetime()
         self.update_cached_summary() 
 
-        relationship_summary = "an acquaintance"
-        if target_agent.name in self.relationships:
-            rel = self.relationships[target_agent.name]
-            relationship_summary = f"Relationship with {target_agent.name}: Friendship {rel['friendship_score']:.0f}, Trust {rel['trust_score']:.0f}."
-        
-        message_to_send = call_ollama_for_dialogue(self.name, target_agent.name, self.cached_summary, 
-                                                  self.dialogue_history, message_context_from_plan,
-                                                  relationship_summary, self.emotional_state)
+        relationship_summary = self._relationship_summary(target_agent.name)
+        turn = None
+        if FUSED_DIALOGUE_TURNS: # The listener's side comes from its published snapshot, not its live (concurrently updating) state
+            _, _, _, target_summary, target_emotion, target_step, target_relationships = target_agent.observable_state()
+            turn = call_ollama_for_dialogue_turn(self.name, target_agent.name, self.cached_summary, target_summary,
+                                                 self.dialogue_history, message_context_from_plan, relationship_summary,
+                                                 self._format_relationship(self.name, target_relationships.get(self.name)), self.emotional_state,
+                                                 target_emotion, target_step)
+            message_to_send = turn['utterance']
+        else:
+            message_to_send = call_ollama_for_dialogue(self.name, target_agent.name, self.cached_summary, 
+                                                      self.dialogue_history, message_context_from_plan,
+                                                      relationship_summary, self.emotional_state)
 
         self.current_message = message_to_send
         self.message_timer = 3 * FPS 
         self.add_memory(f"Said to {target_agent.name}: '{message_to_send}' Emotion: {self.emotional_state}", "CommunicationSent", 
+                        importance_score=turn['importance'] if turn else None,
                         related_agents=[target_agent.name], location_context=self.current_location_name, dt_obj=current_dt)
         
         self.dialogue_history.append(f"{self.name} ({current_dt.strftime('%H:%M')}): {message_to_send}")
-        target_agent.receive_communication(self, message_to_send, current_dt)
+        defer_world_mutation(deliver_communication, target_agent, self, message_to_send, current_dt, turn)
         
-        self.update_relationship(target_agent.name, f"initiated conversation: '{message_to_send}'")
+        if turn:
+            self._apply_relationship_deltas(target_agent.name, {'friendship_delta': turn['speaker_friendship_delta'], 'trust_delta': turn['speaker_trust_delta']},
+                                            f"initiated conversation: '{message_to_send}'", current_dt)
+        else:
+            self.update_relationship(target_agent.name, f"initiated conversation: '{message_to_send}'")
 
 
-    def receive_communication(self, sender_agent, message: str, comm_dt: datetime):
-        """Agent receives and interprets communication."""
-        llm_interpretation_response = call_ollama_for_message_interpretation(sender_agent.name, self.name, message)
-        
-        interpretation = llm_interpretation_response
-        tone = "neutral" 
-        if "Intent:" in llm_interpretation_response and "Tone:" in llm_interpretation_response:
-            parts = llm_interpretation_response.split("Tone:")
-            interpretation = parts[0].replace("Intent:", "").strip()
-            if len(parts) > 1:
-                tone = parts[1].strip().lower()
+    def receive_communication(self, sender_agent, message: str, comm_dt: datetime, turn: dict = None):
+        """Agent receives and interprets communication (from the sender's fused turn when given, without LLM calls)."""
+        self.wake()
+        if turn:
+            interpretation, tone = turn['intent'], turn['tone']
+        else:
+            interpretation, tone = call_ollama_for_message_interpretation(sender_agent.name, self.name, message)
 
         received_description = f"Received from {sender_agent.name}: '{message}'. Interpretation: {interpretation}. Tone: {tone}"
-        self.add_memory(received_description, "CommunicationReceived", 
+        self.add_memory(received_description, "CommunicationReceived", importance_score=turn['importance'] if turn else None,
                         related_agents=[sender_agent.name], location_context=self.current_location_name, dt_obj=comm_dt)
         
         self.dialogue_history.append(f"{sender_agent.name} ({comm_dt.strftime('%H:%M')}): {message}")
         if len(self.dialogue_history) > 10: self.dialogue_history.pop(0) 
 
-        self.react_to_observation(f"{sender_agent.name} said: '{message}' (meaning: {interpretation}, tone: {tone})", 
-                                  observed_entity_name=sender_agent.name, observed_action_status=f"saying '{message}'")
-        
-        self.update_relationship(sender_agent.name, f"received message: '{message}' (Interpreted as: {interpretation}, Tone: {tone})")
+        observation_text = f"{sender_agent.name} said: '{message}' (meaning: {interpretation}, tone: {tone})"
+        interaction_summary = f"received message: '{message}' (Interpreted as: {interpretation}, Tone: {tone})"
+        if turn:
+            current_dt = get_current_game_time_as_datetime()
+            self._act_on_reaction(observation_text, sender_agent.name, turn['listener_reacts'], turn['listener_reaction'], current_dt)
+            self._apply_relationship_deltas(sender_agent.name, {'friendship_delta': turn['listener_friendship_delta'], 'trust_delta': turn['listener_trust_delta']},
+                                            interaction_summary, current_dt)
+        else:
+            self.react_to_observation(observation_text, observed_entity_name=sender_agent.name, observed_action_status=f"saying '{message}'")
+            self.update_relationship(sender_agent.name, interaction_summary)
         
         if tone in ["angry", "sad"] and self.emotional_state not in ["angry", "sad", "anxious"]: # Negative tone might affect emotion
             self.update_emotional_state()
@@ -657,23 +3041,31 @@ class Agent:
             self.target_location_name = location_name
             self.target_x, self.target_y = LOCATIONS[location_name]['rect'].center
             self.status = "moving"
-            self.add_memory(f"Started moving towards {location_name}.", "Observation", importance_score=3, location_context=self.current_location_name)
+            self.add_memory(f"Started moving towards {location_name}.", "Observation", importance_score=3, location_context=self.current_location_name,
+                            defer_embedding=self.cognition_level == "reduced")
         else:
             show_message_box(f"Warning: {self.name} cannot find {location_name}!", RED)
 
+    def _step_towards_target(self) -> bool:
+        """One minute of walking; False (and no move) once within arrival distance."""
+        dx = self.target_x - self.x
+        dy = self.target_y - self.y
+        distance = math.sqrt(dx**2 + dy**2)
+        if distance <= 5:
+            return False
+        move_speed = 5 
+        self.x += dx / distance * move_speed
+        self.y += dy / distance * move_speed
+        return True
+
     def update_position(self):
         if self.status == "moving":
-            dx = self.target_x - self.x
-            dy = self.target_y - self.y
-            distance = math.sqrt(dx**2 + dy**2)
-            if distance > 5:
-                move_speed = 5 
-                self.x += dx / distance * move_speed
-                self.y += dy / distance * move_speed
-            else:
+            if not self._step_towards_target():
                 self.x, self.y = self.target_x, self.target_y
                 self.current_location_name = self.target_location_name
-                self.add_memory(f"Arrived at {self.current_location_name}.", "Observation", importance_score=3, location_context=self.current_location_name)
+                defer_world_mutation(WORLD_INDEX.place_agent, self, self.current_location_name)
+                self.add_memory(f"Arrived at {self.current_location_name}.", "Observation", importance_score=3, location_context=self.current_location_name,
+                                defer_embedding=self.cognition_level == "reduced")
                 self.status = "idle" 
                 if self.detailed_plan and self.current_detailed_action_index < len(self.detailed_plan):
                     action_text = self.detailed_plan[self.current_detailed_action_index].lower()
@@ -681,30 +3073,38 @@ class Agent:
                         self.current_detailed_action_index += 1
 
 
-    def update_needs(self):
-        self.needs['hunger'] += 0.01 
-        self.needs['rest'] += 0.01
-        self.needs['social'] += 0.005
-        self.needs['fulfillment'] += 0.002 # Passive gain/loss
+    def _accumulate_needs(self, minutes=1):
+        for _ in range(minutes): # Minute by minute, so caught-up sums are bit-for-bit those of the per-minute loop
+            for need, growth in NEED_GROWTH_PER_MINUTE.items(): # Passive gain/loss
+                self.needs[need] += growth
+
+    def _draw_sickness_minute(self, minute: int) -> int:
+        """The minute after `minute` at which the agent falls ill: one geometric draw, the same odds as rolling
+        SICKNESS_CHANCE_PER_MINUTE every minute. Sleeping agents are woken for it (see next_event_minute)."""
+        return minute + max(1, math.ceil(math.log(1.0 - self.rng.random()) / math.log1p(-SICKNESS_CHANCE_PER_MINUTE)))
 
-        if random.random() < 0.0001 and self.needs['sickness'] == 0:
-            self.needs['sickness'] = random.randint(1, 10)
+    def _roll_sickness(self):
+        minute = _game_minute(current_datetime)
+        if minute < self.sickness_minute:
+            return
+        self.sickness_minute = self._draw_sickness_minute(minute)
+        if self.needs['sickness'] == 0: # Already ill: this roll is spent, as a per-minute roll would be
+            self.needs['sickness'] = self.rng.randint(1, 10)
             self.add_memory(f"Started feeling sick (sickness level: {self.needs['sickness']}).", "Observation", importance_score=7)
             self.react_to_observation("I am feeling sick.")
             show_message_box(f"{self.name} is feeling sick!", RED)
 
+    def update_needs(self):
+        self._accumulate_needs()
+        self._roll_sickness()
+
         # Critical needs trigger address_critical_need
-        if self.needs['hunger'] > 7 and self.status not in ["moving", "eating", "addressing_need"]:
-            self.address_critical_need('hunger', agents)
-        if self.needs['rest'] > 7 and self.status not in ["moving", "resting", "addressing_need"]:
-            self.address_critical_need('rest', agents)
-        if self.needs['social'] > 7 and self.status not in ["moving", "communicating", "addressing_need"]:
-            self.address_critical_need('social', agents)
-        if self.needs['fulfillment'] < 3 and self.status not in ["moving", "addressing_need"]: # Low fulfillment
-            self.address_critical_need('fulfillment', agents)
+        for rule in CRITICAL_NEED_RULES:
+            if self._need_fires(*rule): # Not again while an urgent plan for it is still running
+                self.address_critical_need(rule[0], agents)
         
         if self.needs['sickness'] > 0 and self.role != "Doctor":
-            if self.current_location_name != "Doctor_Clinic" and self.status not in ["moving", "addressing_need"]:
+            if self.current_location_name != "Doctor_Clinic" and self.status not in ["moving", "addressing_need"] and not self._addressing_need('sickness'):
                 self.address_critical_need('sickness', agents) # Force going to doctor
             elif self.current_location_name == "Doctor_Clinic" and self.status == "idle":
                 self.needs['sickness'] = max(0, self.needs['sickness'] - 0.5) 
@@ -722,23 +3122,22 @@ class Agent:
 
     def perceive_environment(self, all_agents):
         current_dt = get_current_game_time_as_datetime()
-        for other_agent in all_agents:
-            if other_agent.name != self.name and other_agent.current_location_name == self.current_location_name:
+        for other_agent in WORLD_INDEX.agents_at(self.current_location_name):
+            if other_agent.name == self.name: continue
+            other_location, other_message, other_message_timer = other_agent.observable_state()[:3]
+            if other_location == self.current_location_name:
                 obs_text = f"Saw {other_agent.name} (the {other_agent.role}) at {self.current_location_name}."
-                self.add_memory(obs_text, "Observation", importance_score=1, related_agents=[other_agent.name], dt_obj=current_dt)
-                if other_agent.current_message and other_agent.message_timer > 0: 
-                    self.add_memory(f"Heard {other_agent.name} say: '{other_agent.current_message}'", "Observation", importance_score=3, related_agents=[other_agent.name], dt_obj=current_dt)
+                self.add_memory(obs_text, "Observation", importance_score=1, related_agents=[other_agent.name], dt_obj=current_dt, defer_embedding=True)
+                if other_message and other_message_timer > 0: 
+                    self.add_memory(f"Heard {other_agent.name} say: '{other_message}'", "Observation", importance_score=3, related_agents=[other_agent.name], dt_obj=current_dt, defer_embedding=True)
         
-        location_data = LOCATIONS.get(self.current_location_name)
-        if location_data and location_data.get('objects'):
-            for obj_name in location_data['objects']: # Iterate through object names defined in LOCATIONS
-                obj_id = f"{self.current_location_name}_{obj_name}"
-                if obj_id in WORLD_OBJECTS:
-                    world_obj = WORLD_OBJECTS[obj_id]
-                    self.add_memory(world_obj.get_description(), "Observation", 
-                                    importance_score=1, objects_involved=[world_obj.name], dt_obj=current_dt)
+        objects_here = WORLD_INDEX.objects_at(self.current_location_name)
+        if objects_here:
+            for world_obj in objects_here:
+                self.add_memory(world_obj.get_description(), "Observation", 
+                                importance_score=1, objects_involved=[world_obj.name], dt_obj=current_dt, defer_embedding=True)
         else:
-             self.add_memory(f"Observing the surroundings at {self.current_location_name}.", "Observation", importance_score=1, dt_obj=current_dt)
+             self.add_memory(f"Observing the surroundings at {self.current_location_name}.", "Observation", importance_score=1, dt_obj=current_dt, defer_embedding=True)
 
 
     def interact_with_object(self, obj_id: str, action_description: str):
@@ -757,6 +3156,24 @@ class Agent:
         self.update_cached_summary() # Ensure summary is fresh for LLM call
         interaction_result = call_ollama_for_object_interaction_outcome(self.name, action_description, obj, self.cached_summary)
 
+        if not obj.can_be_used_by_multiple_agents:
+            self.busy_with_object_id = obj_id
+            self.busy_timer = self.rng.randint(5, 15) # Busy for 5-15 minutes
+            self.status = f"using_{obj.name.replace(' ','_')}"
+
+        defer_world_mutation(self._apply_object_interaction, obj, action_description, interaction_result, current_dt)
+
+    def _apply_object_interaction(self, obj, action_description: str, interaction_result: dict, current_dt: datetime):
+        """Commits an interaction outcome to the shared object (deferred to end of tick when concurrent)."""
+        if obj.current_user and obj.current_user != self and not obj.can_be_used_by_multiple_agents:
+            # Another agent claimed the object earlier in this tick's commit order
+            self.add_memory(f"Tried to use '{obj.name}' but it's in use by {obj.current_user.name}.", "Observation", dt_obj=current_dt)
+            if self.busy_with_object_id == obj.id:
+                self.busy_with_object_id = None
+                self.busy_timer = 0
+                self.status = "idle"
+            return
+
         obj.current_state = interaction_result["object_new_state"]
         for prop_key, prop_value in interaction_result["object_property_changes"].items():
             # Basic type conversion for common cases (e.g., bool from string)
@@ -770,9 +3187,6 @@ class Agent:
 
         if not obj.can_be_used_by_multiple_agents:
             obj.current_user = self
-            self.busy_with_object_id = obj_id
-            self.busy_timer = random.randint(5, 15) # Busy for 5-15 minutes
-            self.status = f"using_{obj.name.replace(' ','_')}"
         
         self.add_memory(f"Interacted with '{obj.name}' ({action_description}). Agent outcome: {interaction_result['agent_outcome']}. Object now '{obj.current_state}', props {obj.properties}",
                         "ObjectInteraction", importance_score=5, objects_involved=[obj.name], dt_obj=current_dt)
@@ -781,13 +3195,26 @@ class Agent:
         # Check if interaction fulfilled a need (e.g., eating, resting)
         if "food_count" in obj.properties and obj.properties["food_count"] < obj.properties.get("max_food", 10):
             self.needs['hunger'] = max(0, self.needs['hunger'] - 5)
-            self.add_memory(f"Ate from {obj.name}, hunger reduced.", "NeedFulfilled", dt_obj=current_dt)
+            self.add_memory(f"Ate from {obj.name}, hunger reduced.", "NeedFulfilled", dt_obj=current_dt, defer_embedding=True)
             self.needs['fulfillment'] += 1
         if "is_occupied" in obj.properties and obj.properties["is_occupied"] == True and "bed" in obj.name:
             self.needs['rest'] = max(0, self.needs['rest'] - 5)
-            self.add_memory(f"Rested on {obj.name}, rest need reduced.", "NeedFulfilled", dt_obj=current_dt)
+            self.add_memory(f"Rested on {obj.name}, rest need reduced.", "NeedFulfilled", dt_obj=current_dt, defer_embedding=True)
             self.needs['fulfillment'] += 1
 
+    def _finish_object_use(self, dt_obj=None):
+        """Ends a busy period; releasing the shared object is deferred like any other world mutation."""
+        defer_world_mutation(self._release_object, self.busy_with_object_id)
+        reduced = self.cognition_level == "reduced" # Rule-based importance, no classifier or LLM
+        self.add_memory(f"Finished using object {self.busy_with_object_id}.", "ObjectInteraction", importance_score=3 if reduced else None,
+                        dt_obj=dt_obj, defer_embedding=True)
+        self.busy_with_object_id = None
+        self.status = "idle"
+
+    def _release_object(self, obj_id):
+        if obj_id in WORLD_OBJECTS and WORLD_OBJECTS[obj_id].current_user is self:
+            WORLD_OBJECTS[obj_id].current_user = None
+
 
     def perform_action(self, all_agents):
         current_dt = get_current_game_time_as_datetime()
@@ -795,11 +3222,7 @@ class Agent:
         if self.busy_timer > 0:
             self.busy_timer -=1
             if self.busy_timer == 0 and self.busy_with_object_id:
-                if self.busy_with_object_id in WORLD_OBJECTS:
-                     WORLD_OBJECTS[self.busy_with_object_id].current_user = None
-                self.add_memory(f"Finished using object {self.busy_with_object_id}.", "ObjectInteraction", dt_obj=current_dt)
-                self.busy_with_object_id = None
-                self.status = "idle"
+                self._finish_object_use(dt_obj=current_dt)
             return # Agent is busy
 
         # Check critical needs first (already handled by address_critical_need in update_needs)
@@ -819,6 +3242,7 @@ class Agent:
 
         current_action_text = self.detailed_plan[self.current_detailed_action_index]
         action_completed_this_tick = True 
+        timed = False # Work, rest and generic actions last as long as the action says
         action_verb = current_action_text.split(" ")[0].lower()
         
         # --- Action Execution Logic ---
@@ -848,9 +3272,9 @@ class Agent:
             elif "buy " in current_action_text.lower(): obj_name_in_action = current_action_text.lower().split("buy ", 1)[1].split(" from ",1)[0].strip()
             
             found_obj_id = None
-            for obj_id, world_obj_instance in WORLD_OBJECTS.items():
-                if world_obj_instance.location_name == self.current_location_name and obj_name_in_action.replace(" ","_") in world_obj_instance.name.replace(" ","_"):
-                    found_obj_id = obj_id
+            for world_obj_instance in WORLD_INDEX.objects_at(self.current_location_name):
+                if obj_name_in_action.replace(" ","_") in world_obj_instance.name.replace(" ","_"):
+                    found_obj_id = world_obj_instance.id
                     break
             
             if found_obj_id:
@@ -862,15 +3286,16 @@ class Agent:
         elif "discuss" in action_verb or "collaborate" in action_verb or "greet" in action_verb or \
              "ask" in action_verb or "talk" in action_verb or "explain" in action_verb or "inquire" in action_verb:
             self.status = "communicating"
-            potential_targets = [a for a in all_agents if a.name != self.name and a.current_location_name == self.current_location_name]
+            potential_targets = [a for a in WORLD_INDEX.agents_at(self.current_location_name) if a.name != self.name and a.observable_state()[0] == self.current_location_name]
             if potential_targets:
-                target_agent = random.choice(potential_targets)
+                target_agent = self.rng.choice(potential_targets)
                 self.communicate(target_agent, current_action_text) 
             else:
                 self.add_memory(f"Wanted to '{current_action_text}', but no one is here at {self.current_location_name}.", "Observation", dt_obj=current_dt)
         
         elif any(verb in action_verb for verb in ["inspect", "check", "review", "prepare", "assess", "tend", "craft", "forge", "sharpen", "open", "arrange", "wait", "handle", "sell", "announce"]):
             self.status = "working"
+            timed = True
             self.add_memory(f"Working: '{current_action_text}' at {self.current_location_name}.", "Work", importance_score=5, dt_obj=current_dt)
             self.needs['hunger'] = max(0, self.needs['hunger'] - 0.01)
             self.needs['rest'] = max(0, self.needs['rest'] - 0.01)
@@ -878,6 +3303,7 @@ class Agent:
         elif "rest" in action_verb or "relax" in action_verb:
             if self.current_location_name == self.get_home_location():
                 self.status = "resting"
+                timed = True
                 self.needs['rest'] = max(0, self.needs['rest'] - 0.5) 
                 self.add_memory(f"Resting: '{current_action_text}' at home.", "Rest", importance_score=5, dt_obj=current_dt)
             else: 
@@ -889,11 +3315,15 @@ class Agent:
 
         elif any(verb in action_verb for verb in ["collect", "acquire", "gather", "purchase", "load", "fill", "transport", "unload", "process", "plan", "draft", "post"]):
             self.status = "task_oriented" 
+            timed = True
             self.add_memory(f"Performing task: '{current_action_text}' at {self.current_location_name}.", "Task", importance_score=4, dt_obj=current_dt)
         else:
             self.status = "doing_something"
+            timed = True
             self.add_memory(f"Performing unknown/generic action: '{current_action_text}'", "Observation", importance_score=3, dt_obj=current_dt)
 
+        if timed: # Busy for the rest of the stated duration ("for 30 minutes"); otherwise the next action comes next minute
+            self.busy_timer = self._action_minutes(current_action_text) - 1
         if action_completed_this_tick:
             self.current_detailed_action_index += 1
 
@@ -908,6 +3338,13 @@ class Agent:
                  if game_hour < 6 or game_hour > 22: 
                     self.plan_daily_activities()
 
+    @staticmethod
+    def _action_minutes(action_text: str) -> int:
+        match = _ACTION_DURATION.search(action_text)
+        if match is None:
+            return 1
+        return max(1, int(match.group(1)) * (60 if match.group(2).lower() == "hour" else 1))
+
     def address_critical_need(self, need_type, all_agents):
         current_dt = get_current_game_time_as_datetime()
         self.update_cached_summary()
@@ -937,7 +3374,7 @@ class Agent:
         if relevant_locations:
             known_locations_info += "\nKnown relevant locations: " + "; ".join(relevant_locations)
 
-        fulfillment_plan_steps = call_ollama_for_need_fulfillment_plan(self.name, need_type, self.cached_summary, self.current_location_name, known_locations_info, current_dt)
+        fulfillment_plan_steps = need_fulfillment_plan(self.name, self.role, need_type, self.cached_summary, self.current_location_name, known_locations_info, current_dt)
 
         if fulfillment_plan_steps:
             self.add_memory(f"Generated urgent plan for {need_type}: {'; '.join(fulfillment_plan_steps)}", "UrgentPlan", dt_obj=current_dt)
@@ -945,18 +3382,73 @@ class Agent:
             self.current_high_level_action_index = 0
             self.detailed_plan = []
             self.current_detailed_action_index = 0
+            self._plan_changed()
+            self.urgent_need, self.urgent_plan_end = need_type, len(fulfillment_plan_steps)
             self.status = "addressing_need"
             if self.high_level_plan: self.decompose_current_plan_step()
         else:
             self.add_memory(f"Could not generate fulfillment plan for {need_type}.", "Error", dt_obj=current_dt)
             self.status = "idle"
 
-    def update(self, all_agents):
-        self.update_needs()
-        self.update_position() 
+    # --- Cognitive Level of Detail ---
+    def get_home_location(self):
+        """The role's own restable building (e.g. Farmer -> Farmer_Building), else the nearest place to rest."""
+        for name, data in LOCATIONS.items():
+            if name.startswith(f"{self.role}_") and data.get('provides_rest'):
+                return name
+        return self._nearest_location('provides_rest')
+
+    def _workplace_location(self):
+        for name in LOCATIONS:
+            if name.startswith(f"{self.role}_"):
+                return name
+        return self.get_home_location()
+
+    def _nearest_location(self, flag):
+        candidates = [name for name, data in LOCATIONS.items() if data.get(flag)]
+        if not candidates:
+            return self.current_location_name
+        return min(candidates, key=lambda name: math.hypot(LOCATIONS[name]['rect'].centerx - self.x, LOCATIONS[name]['rect'].centery - self.y))
+
+    def _critical_need(self):
+        """Name of a need that warrants full LLM cognition, or None."""
+        for need in ('hunger', 'rest', 'social'):
+            if self.needs[need] > LOD_CRITICAL_NEED:
+                return need
+        if self.needs['sickness'] > 0 and self.role != "Doctor":
+            return 'sickness'
+        return None
+
+    def update_cognition_level(self):
+        """Promotes on company or a critical need; demotes after LOD_DEMOTE_AFTER_MINUTES alone and settled."""
+        others_here = any(other is not self for other in WORLD_INDEX.agents_at(self.current_location_name))
+        critical = self._critical_need() or ('sickness' if _game_minute(current_datetime) >= self.sickness_minute else None)
+        if others_here or critical: # Falling ill promotes too: the sickness roll and the reaction to it are full cognition's
+            self.low_salience_minutes = 0
+            if self.cognition_level != "full":
+                self._set_cognition_level("full", "met another agent" if others_here else f"critical {critical}")
+                if self.busy_with_object_id is None and self.status in ("eating", "resting"):
+                    self.status, self.busy_timer = "idle", 0 # A rule-based meal or rest would keep suppressing the hunger/rest triggers
+            return self.cognition_level
+        self.low_salience_minutes += 1
+        if (self.cognition_level == "full" and self.low_salience_minutes >= LOD_DEMOTE_AFTER_MINUTES
+                and self.status not in ("addressing_need", "communicating")):
+            self._set_cognition_level("reduced", "alone with no pressing needs")
+        return self.cognition_level
+
+    def _set_cognition_level(self, level, reason):
+        self.cognition_level = level
+        SIMULATION_LOG.append({
+            'timestamp': datetime.now().isoformat(),
+            'game_time': get_current_game_time_as_datetime().strftime("%Y-%m-%d %H:%M:%S"),
+            'agent': self.name,
+            'type': "Cognition_Level",
+            'details': {'level': level, 'reason': reason}
+        })
 
+    def _tick_message_timer(self, minutes=1):
         if self.message_timer > 0:
-            self.message_timer -= 1
+            self.message_timer = max(0, self.message_timer - minutes)
             if self.message_timer == 0:
                 self.current_message = "" 
                 if self.dialogue_history and len(self.dialogue_history) > 0: 
@@ -964,186 +3456,872 @@ class Agent:
                         if len(self.dialogue_history) > 2 : 
                              self.dialogue_history = []
 
+    def _update_reduced(self):
+        """Rule-based tick: needs, movement and role work without LLM calls or synchronous embeddings
+        (perception, emotion, reflection, planning and falling ill wait for full cognition)."""
+        self._accumulate_needs()
+        self.update_position()
+        self._tick_message_timer()
+        if self.status == "moving":
+            return
+        if self.busy_timer > 0:
+            self.busy_timer -= 1
+            if self.busy_timer == 0:
+                if self.busy_with_object_id:
+                    self._finish_object_use()
+                else:
+                    self.status = "idle"
+            return
+        self._rule_based_action()
+
+    def _rule_based_action(self):
+        current_dt = get_current_game_time_as_datetime()
+        if self.needs['hunger'] > LOD_NEED_ACTION_THRESHOLD:
+            target = self._nearest_location('provides_food')
+            if self.current_location_name != target:
+                self.move_to(target)
+                return
+            self.status = "eating"
+            self.busy_timer = LOD_MEAL_MINUTES
+            self.needs['hunger'] = max(0, self.needs['hunger'] - 5)
+            self.add_memory(f"Had a meal at {target}.", "NeedFulfilled", importance_score=3, dt_obj=current_dt, defer_embedding=True)
+        elif self.needs['rest'] > LOD_NEED_ACTION_THRESHOLD:
+            home = self.get_home_location()
+            if self.current_location_name != home:
+                self.move_to(home)
+                return
+            self.status = "resting"
+            self.busy_timer = LOD_REST_MINUTES
+            self.needs['rest'] = max(0, self.needs['rest'] - 5)
+            self.add_memory(f"Rested at {home}.", "NeedFulfilled", importance_score=3, dt_obj=current_dt, defer_embedding=True)
+        else:
+            workplace = self._workplace_location()
+            if self.current_location_name != workplace:
+                self.move_to(workplace)
+                return
+            goal = self.goals[current_dt.hour % len(self.goals)] # Rotate through role goals hour by hour
+            self.status = "working"
+            self.needs['fulfillment'] += 0.01
+            self.add_memory(f"Working on '{goal}' at {workplace}.", "Observation", importance_score=2, dt_obj=current_dt, defer_embedding=True)
+
+    # --- Event Scheduling ---
+    def _need_crossed(self, need, level, above) -> bool:
+        return self.needs[need] > level if above else self.needs[need] < level
+
+    def _addressing_need(self, need) -> bool:
+        """True while the urgent steps planned for this need are still ahead of the agent."""
+        return self.urgent_need == need and self.current_high_level_action_index < self.urgent_plan_end
+
+    def _need_fires(self, need, level, above, suppressed_by) -> bool:
+        """Whether update_needs would plan for this need now."""
+        return self._need_crossed(need, level, above) and self.status not in suppressed_by and not self._addressing_need(need)
+
+    def _decomposition_due(self) -> bool:
+        """update() decomposes the next high-level step (also while a timed last action still runs)."""
+        return self.status == "idle" and not self.detailed_plan and self.current_high_level_action_index < len(self.high_level_plan)
 
-        if get_current_game_time_as_datetime().minute % 30 == 0: 
-            self.update_cached_summary()
+    def _idle_until_evening(self) -> bool:
+        """The day's plan is done and perform_action only re-plans from 23:00 (or before 02:00)."""
+        return (self.cognition_level == "full" and self.status == "idle" and 2 <= game_hour <= 22
+                and not (self.detailed_plan and self.current_detailed_action_index < len(self.detailed_plan))
+                and self.current_high_level_action_index >= len(self.high_level_plan))
+
+    def _can_sleep(self) -> bool:
+        """True while update() would only do passive bookkeeping: walking, busy or done for the day, healthy,
+        no critical need firing."""
+        if self.needs['sickness'] > 0 or (self.cognition_level == "full" and self._decomposition_due()):
+            return False
+        if self.status != "moving" and self.busy_timer <= 0 and not self._idle_until_evening():
+            return False # Would act this minute
+        if self.cognition_level == "full":
+            return not any(self._need_fires(*rule) for rule in CRITICAL_NEED_RULES)
+        return self._critical_need() is None
+
+    def _minutes_to_arrival(self) -> int:
+        distance = math.hypot(self.target_x - self.x, self.target_y - self.y)
+        return max(0, math.ceil((distance - 5) / 5 - 1e-9)) + 1 # Steps of 5px, then the arrival minute
+
+    def next_event_minute(self, minute: int) -> int:
+        """The next game minute this agent has to run update() (minute + 1 unless it can sleep)."""
+        if not self._can_sleep():
+            return minute + 1
+        if LOD_ENABLED: # Company only changes on an arrival, and arrivals wake everyone involved
+            self._alone_while_asleep = not any(other is not self for other in WORLD_INDEX.agents_at(self.current_location_name))
+        events = []
+        if self.cognition_level == "full":
+            minute_of_hour = minute % 60
+            events.append(minute - minute_of_hour + next((m for m in COGNITION_MINUTES if m > minute_of_hour), 60 + COGNITION_MINUTES[0]))
+            if LOD_ENABLED:
+                events.append(minute + max(1, LOD_DEMOTE_AFTER_MINUTES - self.low_salience_minutes))
+        if self.status == "moving":
+            events.append(minute + self._minutes_to_arrival())
+        if self.busy_timer > 0:
+            events.append(minute + self.busy_timer) # The update that counts it down to zero
+        if self.message_timer > 0:
+            events.append(minute + self.message_timer)
+        if self._idle_until_evening():
+            events.append(minute + (23 - current_datetime.hour) * 60 - current_datetime.minute)
+        events.append(self.sickness_minute)
+        for need, level, above, _ in CRITICAL_NEED_RULES:
+            level = LOD_CRITICAL_NEED if self.cognition_level == "reduced" else level
+            growth = NEED_GROWTH_PER_MINUTE.get(need, 0)
+            if above and growth > 0 and self.needs[need] <= level: # Needs already past it fire on the status change
+                # A minute early: the summed growth may cross the level a rounding error before the estimate
+                events.append(minute + max(1, math.ceil((level - self.needs[need]) / growth) - 1))
+        return max(minute + 1, min(events))
+
+    def catch_up(self, minute: int):
+        """Applies the passive per-minute bookkeeping (needs, walking, timers) for minutes this agent slept through.
+
+        Arrival, the last busy minute and falling ill are left to update(), which is scheduled for exactly
+        those minutes; nothing here calls the LLM or touches the plan.
+        """
+        if self.last_update_minute is None or minute <= self.last_update_minute:
+            if self.last_update_minute is None:
+                self.last_update_minute = minute
+            return
+        skipped = minute - self.last_update_minute
+        self.last_update_minute = minute
+        self._accumulate_needs(skipped)
+        if self.status == "moving":
+            for _ in range(skipped):
+                if not self._step_towards_target(): break
+        self._tick_message_timer(skipped)
+        if self.busy_timer > 1 and (self.status != "moving" or self.cognition_level == "full"):
+            self.busy_timer -= min(skipped, self.busy_timer - 1)
+        if LOD_ENABLED:
+            alone = self._alone_while_asleep and self._critical_need() is None
+            self.low_salience_minutes = self.low_salience_minutes + skipped if alone else 0
+
+    def wake(self):
+        """Something happened to this agent: bring it up to date and run it on the next minute."""
+        if EVENT_SCHEDULING:
+            minute = _game_minute(current_datetime)
+            self.catch_up(minute)
+            EVENT_SCHEDULER.schedule(self.name, minute + 1)
+
+    def update(self, all_agents):
+        if LOD_ENABLED and self.update_cognition_level() == "reduced":
+            with PROFILER.phase("agent.reduced_policy"):
+                self._update_reduced()
+            return
+
+        with PROFILER.phase("agent.needs"):
+            self.update_needs()
+        with PROFILER.phase("agent.movement"):
+            self.update_position() 
+            self._tick_message_timer()
+
+        if get_current_game_time_as_datetime().minute % SUMMARY_EVERY_MINUTES == 0: 
+            with PROFILER.phase("agent.summary"):
+                self.update_cached_summary()
         
-        if get_current_game_time_as_datetime().minute % 10 == 0: 
-            self.perceive_environment(all_agents)
+        if get_current_game_time_as_datetime().minute % PERCEPTION_EVERY_MINUTES == 0: 
+            with PROFILER.phase("agent.perception"):
+                self.perceive_environment(all_agents)
 
-        if get_current_game_time_as_datetime().minute % 15 == 0: 
-            self.update_emotional_state()
+        if get_current_game_time_as_datetime().minute % EMOTION_EVERY_MINUTES == 0: 
+            with PROFILER.phase("agent.emotion"):
+                self.update_emotional_state()
 
-        if get_current_game_time_as_datetime().minute == 5: 
-            self.reflect()
+        if get_current_game_time_as_datetime().minute == REFLECTION_MINUTE: 
+            with PROFILER.phase("agent.reflection"):
+                self.reflect()
         
-        if self.status == "idle" and not self.detailed_plan and self.high_level_plan and self.current_high_level_action_index < len(self.high_level_plan):
-            self.decompose_current_plan_step()
+        if self._decomposition_due():
+            with PROFILER.phase("agent.plan_decomposition"):
+                self.decompose_current_plan_step()
 
-        if self.status != "moving" and self.busy_timer <= 0 : 
-            self.perform_action(all_agents)
-        elif self.busy_timer > 0: 
-            self.busy_timer -= 1
-            if self.busy_timer == 0 and self.busy_with_object_id:
-                if self.busy_with_object_id in WORLD_OBJECTS:
-                    WORLD_OBJECTS[self.busy_with_object_id].current_user = None
-                self.add_memory(f"Finished using object {self.busy_with_object_id}.", "ObjectInteraction")
-                self.busy_with_object_id = None
-                self.status = "idle"
+        with PROFILER.phase("agent.action"):
+            if self.status != "moving" and self.busy_timer <= 0 : 
+                self.perform_action(all_agents)
+            elif self.busy_timer > 0: 
+                self.busy_timer -= 1
+                if self.busy_timer == 0 and self.busy_with_object_id:
+                    self._finish_object_use()
 
-    def draw(self, screen):
-        pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.size)
-        name_text = FONT.render(f"{self.name} ({self.emotional_state[0].upper()})", True, BLACK) 
-        screen.blit(name_text, (self.x - name_text.get_width() / 2, self.y - self.size - 20))
+    def draw(self, screen) -> list:
+        """Draws the agent and its speech bubble; returns the screen rects touched."""
+        rects = [pygame.draw.circle(screen, self.color, (int(self.x), int(self.y)), self.size)]
+        name_text = render_text(FONT, f"{self.name} ({self.emotional_state[0].upper()})", BLACK)
+        rects.append(screen.blit(name_text, (self.x - name_text.get_width() / 2, self.y - self.size - 20)))
         
         if self.current_message:
-            words = self.current_message.split(' ')
-            lines = []
-            current_line = ""
-            for word in words:
-                if SMALL_FONT.size(current_line + " " + word)[0] < 150:
-                    current_line += " " + word
-                else:
-                    lines.append(current_line.strip())
-                    current_line = word
-            lines.append(current_line.strip()) 
-
-            max_line_width = 0
-            total_height = 0
-            for line in lines:
-                line_surface = SMALL_FONT.render(line, True, BLACK)
-                max_line_width = max(max_line_width, line_surface.get_width())
-                total_height += line_surface.get_height()
-            
-            padding = 10
-            bubble_width = max_line_width + 2 * padding
-            bubble_height = total_height + 2 * padding
-            bubble_rect = pygame.Rect(self.x - bubble_width / 2, self.y - self.size - bubble_height - 25 - (name_text.get_height() if name_text else 0), bubble_width, bubble_height) 
-            
-            pygame.draw.rect(screen, WHITE, bubble_rect, border_radius=5)
-            pygame.draw.rect(screen, BLACK, bubble_rect, 2, border_radius=5) 
-
-            text_y = bubble_rect.top + padding
-            for line in lines:
-                line_surface = SMALL_FONT.render(line, True, BLACK)
-                screen.blit(line_surface, (bubble_rect.centerx - line_surface.get_width() / 2, text_y))
-                text_y += line_surface.get_height()
+            bubble = render_speech_bubble(self.current_message)
+            rects.append(screen.blit(bubble, (self.x - bubble.get_width() / 2, self.y - self.size - bubble.get_height() - 25 - name_text.get_height())))
+        return rects
 
 
 # --- Simulation Setup ---
-# Initialize agents first to get their names for object loading
-agent_names_list = ["Handy", "Tooly", "Doc", "May", "Farmy"]
-agents = [
-    Agent("Handy", "Handyman", "Diligent worker; focused on town maintenance; repairs broken things; values practicality.", "Handyman_Workshop", RED, agent_names_list),
-    Agent("Tooly", "Toolsmith", "Master craftsman; invents tools; helps community; detail-oriented.", "Toolsmith_Workshop", BLUE, agent_names_list),
-    Agent("Doc", "Doctor", "Compassionate healer; dedicated to well-being; knowledgeable in herbs; promotes health.", "Doctor_Clinic", GREEN, agent_names_list),
-    Agent("May", "Mayor", "Town leader; responsible for governance; organizes events; diplomatic.", "Mayor_Building", PURPLE, agent_names_list),
-    Agent("Farmy", "Farmer", "Backbone of food supply; nurtures crops; manages resources; hardworking.", "Farmer_Building", YELLOW, agent_names_list),
-]
-agents_by_name = {agent.name: agent for agent in agents} # Create dict for quick lookup
+agents = [] # Populated by setup_simulation(); needs handling looks agents up here
+agents_by_name = {}
 
-initialize_world_objects(agents_by_name) # Now pass agents_by_name for resolving current_user
+# --- Checkpointing ---
+def save_checkpoint(agents, checkpoint_dir=CHECKPOINT_DIR):
+    """Writes the full simulation state; the previous checkpoint is replaced only once the new one is complete."""
+    write_checkpoint([agent.to_checkpoint() for agent in agents],
+                     {obj_id: obj.to_dict() for obj_id, obj in WORLD_OBJECTS.items()}, checkpoint_dir)
 
-# Initial daily plan for all agents
-for agent in agents:
-    agent.plan_daily_activities()
+def write_checkpoint(agent_snapshots, world_objects: dict, checkpoint_dir=CHECKPOINT_DIR):
+    """agent_snapshots are Agent.to_checkpoint() results; cold tiers are copied from MEMORY_COLD_DIR."""
+    tmp_dir = checkpoint_dir + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(os.path.join(tmp_dir, "cold"))
+    agent_states = []
+    for state, embeddings in agent_snapshots:
+        np.save(os.path.join(tmp_dir, f"{state['name']}_embeddings.npy"), embeddings)
+        shutil.copytree(os.path.join(MEMORY_COLD_DIR, state['name']), os.path.join(tmp_dir, "cold", state['name']))
+        agent_states.append(state)
+    with open(os.path.join(tmp_dir, "state.json"), 'w') as f:
+        json.dump({
+            'version': CHECKPOINT_VERSION,
+            'current_datetime': current_datetime.isoformat(),
+            'agents': agent_states,
+            'world_objects': world_objects,
+        }, f, default=str)
 
-# --- Game Loop ---
-running = True
-clock = pygame.time.Clock()
+    old_dir = checkpoint_dir + ".old"
+    if os.path.exists(checkpoint_dir):
+        if os.path.exists(old_dir): shutil.rmtree(old_dir)
+        os.rename(checkpoint_dir, old_dir)
+    os.rename(tmp_dir, checkpoint_dir)
+    if os.path.exists(old_dir): shutil.rmtree(old_dir)
+
+def load_checkpoint(checkpoint_dir=CHECKPOINT_DIR, agent_names=None) -> list:
+    """Restores the clock, agents (all, or only agent_names) and world objects from a checkpoint with zero LLM calls."""
+    global agents, agents_by_name, WORLD_OBJECTS
+    with open(os.path.join(checkpoint_dir, "state.json")) as f:
+        data = json.load(f)
+    if data.get('version') != CHECKPOINT_VERSION:
+        raise ValueError(f"Unsupported checkpoint version {data.get('version')} in {checkpoint_dir}")
+    set_game_time(datetime.fromisoformat(data['current_datetime']))
+
+    agents = []
+    WORLD_INDEX.clear_agents()
+    EVENT_SCHEDULER.clear() # Restored agents are all due on their first minute
+    PLAN_TEMPLATES.clear() # Their ages are in game time, which may have moved backwards
+    load_classifiers()
+    for state in data['agents']:
+        if agent_names is not None and state['name'] not in agent_names:
+            continue
+        cold_dir = os.path.join(MEMORY_COLD_DIR, state['name'])
+        if os.path.exists(cold_dir): shutil.rmtree(cold_dir)
+        shutil.copytree(os.path.join(checkpoint_dir, "cold", state['name']), cold_dir)
+        embeddings = np.load(os.path.join(checkpoint_dir, f"{state['name']}_embeddings.npy"))
+        agents.append(Agent.from_checkpoint(state, embeddings, cold_dir))
+    agents_by_name = {agent.name: agent for agent in agents}
+    WORLD_OBJECTS = {obj_id: WorldObject.from_dict(obj_data, agents_by_name) for obj_id, obj_data in data['world_objects'].items()}
+    WORLD_INDEX.rebuild_objects(WORLD_OBJECTS)
+    print(f"Resumed {len(agents)} agents and {len(WORLD_OBJECTS)} objects at {current_datetime} from {checkpoint_dir}")
+    return agents
+
+def _checkpoint_due(interval_minutes=CHECKPOINT_INTERVAL_MINUTES) -> bool:
+    return interval_minutes > 0 and int(_dt_to_seconds(current_datetime) // 60) % interval_minutes == 0
+
+# (name, role, description, start location, color)
+TOWN_AGENTS = [
+    ("Handy", "Handyman", "Diligent worker; focused on town maintenance; repairs broken things; values practicality.", "Handyman_Workshop", RED),
+    ("Tooly", "Toolsmith", "Master craftsman; invents tools; helps community; detail-oriented.", "Toolsmith_Workshop", BLUE),
+    ("Doc", "Doctor", "Compassionate healer; dedicated to well-being; knowledgeable in herbs; promotes health.", "Doctor_Clinic", GREEN),
+    ("May", "Mayor", "Town leader; responsible for governance; organizes events; diplomatic.", "Mayor_Building", PURPLE),
+    ("Farmy", "Farmer", "Backbone of food supply; nurtures crops; manages resources; hardworking.", "Farmer_Building", YELLOW),
+]
+
+def setup_simulation(agent_names=None) -> list:
+    """Creates the agents (all, or only agent_names) and world objects and returns the agent list."""
+    global agents, agents_by_name
+    WORLD_INDEX.clear_agents()
+    EVENT_SCHEDULER.clear()
+    PLAN_TEMPLATES.clear()
+    load_classifiers()
+    # Initialize agents first to get their names for object loading
+    agent_names_list = [spec[0] for spec in TOWN_AGENTS]
+    agents = [Agent(name, role, description, location, color, agent_names_list)
+              for name, role, description, location, color in TOWN_AGENTS
+              if agent_names is None or name in agent_names]
+    agents_by_name = {agent.name: agent for agent in agents} # Create dict for quick lookup
 
-while running:
-    current_dt_loop = get_current_game_time_as_datetime()
-    game_day_sim_loop = current_dt_loop.day - 12
-    game_hour_sim_loop = current_dt_loop.hour
-    game_minute_sim_loop = current_dt_loop.minute
+    initialize_world_objects(agents_by_name) # Now pass agents_by_name for resolving current_user
+    return agents
 
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-            save_world_objects() # Save on quit
+def step_simulation(agents, tick_executor, days_to_run=GAME_DAYS_TO_RUN, jump=EVENT_SCHEDULING) -> int:
+    """Advances the clock and runs the agents due at the new minute. Returns the game minutes advanced, 0 once the day budget is used up.
 
-    advance_game_time(minutes=1)
+    With jump, the clock skips the minutes in which no agent has anything due (everyone busy, walking
+    or between scheduled cognition). The clock never moves into a minute that is not simulated, so a
+    checkpoint taken at the end resumes exactly where the run stopped.
+    """
+    if game_day_of(current_datetime + timedelta(minutes=1)) > days_to_run:
+        print(f"Simulation finished after {days_to_run} days.")
+        show_message_box(f"Simulation Finished after {days_to_run} days!", BLACK)
+        return 0
+    minutes = minutes_to_next_event(EVENT_SCHEDULER.next_minute(), days_to_run) if jump and EVENT_SCHEDULING else 1
+    advance_game_time(minutes=minutes)
+    run_minute(agents, tick_executor)
+    return minutes
 
+def run_minute(agents, tick_executor):
+    """One game minute for the given agents at the current clock: new-day routines, the tick, the embed flush.
+
+    With EVENT_SCHEDULING only the agents due now (see EventScheduler) are updated; the rest are
+    caught up in bulk when they next run.
+    """
+    minute = _game_minute(current_datetime)
+    LLM_SCHEDULER.begin_tick()
     # Check for new day
-    if game_hour == 0 and game_minute == 0 and current_dt_loop.day != (current_dt_loop - timedelta(minutes=1)).day :
+    if game_hour == 0 and game_minute == 0:
         print(f"\n--- Starting Day {game_day} ---")
         show_message_box(f"--- Starting Day {game_day} ---", BLACK)
-        for agent in agents:
+        def start_new_day(agent):
+            if EVENT_SCHEDULING:
+                agent.catch_up(minute - 1)
+                EVENT_SCHEDULER.schedule(agent.name, minute)
             agent.reflect()
             agent.plan_daily_activities()
             agent.update_cached_summary() 
+        with PROFILER.phase("tick.new_day"):
+            tick_executor.run_for_each(agents, start_new_day)
 
-    if game_day > GAME_DAYS_TO_RUN:
-        print(f"Simulation finished after {GAME_DAYS_TO_RUN} days.")
-        show_message_box(f"Simulation Finished after {GAME_DAYS_TO_RUN} days!", BLACK)
-        running = False
-        save_world_objects() # Save at end
-        break
+    active = agents
+    if EVENT_SCHEDULING:
+        due = EVENT_SCHEDULER.pop_due(minute)
+        active = [agent for agent in agents if agent.name in due or agent.last_update_minute is None]
+        for agent in active:
+            agent.catch_up(minute - 1)
+            agent.last_update_minute = minute # update() below is this minute's bookkeeping
+        locations = {agent.name: agent.current_location_name for agent in active}
 
-    for agent in agents:
-        agent.update(agents)
-
-    # --- Drawing ---
-    SCREEN.fill(WHITE)
-    for name, data in LOCATIONS.items():
-        if 'Town_' in name or name == 'World': pygame.draw.rect(SCREEN, data['color'], data['rect'])
-    for name, data in LOCATIONS.items():
-        if 'Town_' not in name and name != 'World':
-            pygame.draw.rect(SCREEN, data['color'], data['rect'], border_radius=10)
-            pygame.draw.rect(SCREEN, BLACK, data['rect'], 2, border_radius=10) 
-            text_surface = FONT.render(name.replace('_', ' '), True, BLACK)
-            SCREEN.blit(text_surface, (data['rect'].centerx - text_surface.get_width() / 2, data['rect'].centery - text_surface.get_height() / 2))
-            
-            # Draw object names and states within their locations
-            obj_y_offset = data['rect'].top + 5
-            for obj_id, world_obj in WORLD_OBJECTS.items():
-                if world_obj.location_name == name:
-                    obj_text = f"{world_obj.name}: {world_obj.current_state}"
-                    if world_obj.current_user: obj_text += f" (by {world_obj.current_user.name})"
-                    obj_surface = SMALL_FONT.render(obj_text, True, DARK_GREY)
-                    SCREEN.blit(obj_surface, (data['rect'].left + 5, obj_y_offset))
-                    obj_y_offset += 15
-                    if obj_y_offset > data['rect'].bottom - 15: break 
+    with PROFILER.phase("tick.agents"):
+        tick_executor.run_tick(active, agents)
+    with PROFILER.phase("tick.embedding_flush"):
+        flush_pending_embeddings(agents) # One batched embed request for this tick's perception bursts
+
+    if EVENT_SCHEDULING:
+        for agent in active:
+            EVENT_SCHEDULER.schedule(agent.name, agent.next_event_minute(minute))
+            if LOD_ENABLED and agent.current_location_name != locations[agent.name]:
+                # Company changed at both ends: level of detail is re-evaluated there (and for the arrival) on the next minute
+                for location_name in (locations[agent.name], agent.current_location_name):
+                    for other in WORLD_INDEX.agents_at(location_name):
+                        if other.name in agents_by_name:
+                            other.wake()
+
+# --- Render Cache ---
+TEXT_CACHE_SIZE = 512 # Rendered text/bubble surfaces kept across frames
+_TEXT_CACHE = OrderedDict()
+
+def render_text(font, text, color):
+    """font.render with an LRU of finished surfaces; a new text (object state, message) is a new key."""
+    key = (font, text, tuple(color))
+    surface = _TEXT_CACHE.get(key)
+    if surface is None:
+        surface = font.render(text, True, color)
+        _TEXT_CACHE[key] = surface
+        if len(_TEXT_CACHE) > TEXT_CACHE_SIZE:
+            _TEXT_CACHE.popitem(last=False)
+    else:
+        _TEXT_CACHE.move_to_end(key)
+    return surface
+
+def render_speech_bubble(message):
+    """Word-wrapped speech bubble for a message, measured and rendered once per distinct message."""
+    key = ('bubble', message)
+    bubble = _TEXT_CACHE.get(key)
+    if bubble is not None:
+        _TEXT_CACHE.move_to_end(key)
+        return bubble
+    lines = []
+    current_line = ""
+    for word in message.split(' '):
+        if SMALL_FONT.size(current_line + " " + word)[0] < 150:
+            current_line += " " + word
+        else:
+            lines.append(current_line.strip())
+            current_line = word
+    lines.append(current_line.strip())
+    line_surfaces = [render_text(SMALL_FONT, line, BLACK) for line in lines]
+
+    padding = 10
+    bubble_width = max(surface.get_width() for surface in line_surfaces) + 2 * padding
+    bubble_height = sum(surface.get_height() for surface in line_surfaces) + 2 * padding
+    bubble = pygame.Surface((bubble_width, bubble_height), pygame.SRCALPHA)
+    bubble_rect = bubble.get_rect()
+    pygame.draw.rect(bubble, WHITE, bubble_rect, border_radius=5)
+    pygame.draw.rect(bubble, BLACK, bubble_rect, 2, border_radius=5)
+    text_y = padding
+    for surface in line_surfaces:
+        bubble.blit(surface, (bubble_rect.centerx - surface.get_width() / 2, text_y))
+        text_y += surface.get_height()
+
+    _TEXT_CACHE[key] = bubble
+    if len(_TEXT_CACHE) > TEXT_CACHE_SIZE:
+        _TEXT_CACHE.popitem(last=False)
+    return bubble
+
+class MapLayer:
+    """Pre-rendered map: static buildings and names, with object labels redrawn only when they change."""
+    def __init__(self):
+        self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+        self.background.fill(WHITE)
+        for name, data in LOCATIONS.items():
+            if 'Town_' in name or name == 'World': pygame.draw.rect(self.background, data['color'], data['rect'])
+        for name, data in LOCATIONS.items():
+            if 'Town_' not in name and name != 'World':
+                pygame.draw.rect(self.background, data['color'], data['rect'], border_radius=10)
+                pygame.draw.rect(self.background, BLACK, data['rect'], 2, border_radius=10)
+                text_surface = render_text(FONT, name.replace('_', ' '), BLACK)
+                self.background.blit(text_surface, (data['rect'].centerx - text_surface.get_width() / 2, data['rect'].centery - text_surface.get_height() / 2))
+        self.surface = self.background.copy()
+        self._object_labels = {} # location -> label texts currently drawn on self.surface
+
+    def refresh_object_labels(self) -> list:
+        """Redraws the object labels of locations whose objects changed state; returns the touched rects."""
+        dirty = []
+        for name, data in LOCATIONS.items():
+            if 'Town_' in name or name == 'World': continue
+            labels = []
+            for world_obj in WORLD_INDEX.objects_at(name):
+                obj_text = f"{world_obj.name}: {world_obj.current_state}"
+                if world_obj.current_user: obj_text += f" (by {world_obj.current_user.name})"
+                labels.append(obj_text)
+            labels = tuple(labels)
+            if self._object_labels.get(name) == labels: continue
+            self._object_labels[name] = labels
+            rect = data['rect']
+            self.surface.blit(self.background, rect, rect)
+            obj_y_offset = rect.top + 5
+            for obj_text in labels:
+                self.surface.blit(render_text(SMALL_FONT, obj_text, DARK_GREY), (rect.left + 5, obj_y_offset))
+                obj_y_offset += 15
+                if obj_y_offset > rect.bottom - 15: break
+            dirty.append(rect.copy())
+        return dirty
+
+_MAP_LAYER = None
+_LAST_FRAME_RECTS = [] # Screen areas covered by agents/HUD last frame, restored from the map before redrawing
 
+def invalidate_frame():
+    """Forces the next draw_frame to repaint and flip the whole window (e.g. after an expose event)."""
+    global _MAP_LAYER
+    _MAP_LAYER = None
+
+def draw_frame(agents):
+    global MESSAGE_BOX_TIMER, _MAP_LAYER, _LAST_FRAME_RECTS
+    full_redraw = _MAP_LAYER is None
+    if full_redraw:
+        _MAP_LAYER = MapLayer()
+    relabelled = _MAP_LAYER.refresh_object_labels()
+    if full_redraw:
+        SCREEN.blit(_MAP_LAYER.surface, (0, 0))
+    else:
+        for rect in _LAST_FRAME_RECTS + relabelled:
+            SCREEN.blit(_MAP_LAYER.surface, rect, rect)
+
+    frame_rects = []
     for agent in agents:
-        agent.draw(SCREEN)
-    time_text = BIG_FONT.render(f"Day: {game_day} Time: {game_hour:02d}:{game_minute:02d}", True, BLACK) 
-    SCREEN.blit(time_text, (SCREEN_WIDTH - time_text.get_width() - 20, 20))
+        frame_rects.extend(agent.draw(SCREEN))
+    time_text = render_text(BIG_FONT, f"Day: {game_day} Time: {game_hour:02d}:{game_minute:02d}", BLACK)
+    frame_rects.append(SCREEN.blit(time_text, (SCREEN_WIDTH - time_text.get_width() - 20, 20)))
 
     if MESSAGE_BOX_TIMER > 0 and MESSAGE_BOX_MESSAGES:
         MESSAGE_BOX_TIMER -= 1
         y_offset = 0
         for msg, color in reversed(MESSAGE_BOX_MESSAGES):
-            msg_surface = FONT.render(msg, True, color)
+            msg_surface = render_text(FONT, msg, color)
             msg_rect = msg_surface.get_rect(center=(SCREEN_WIDTH // 2, 50 + y_offset))
             bg_rect = msg_rect.inflate(20, 10) 
             pygame.draw.rect(SCREEN, WHITE, bg_rect, border_radius=5)
             pygame.draw.rect(SCREEN, BLACK, bg_rect, 2, border_radius=5) 
             SCREEN.blit(msg_surface, msg_rect)
+            frame_rects.append(bg_rect)
             y_offset += msg_surface.get_height() + 15 
         if MESSAGE_BOX_TIMER == 0: MESSAGE_BOX_MESSAGES.clear()
 
-    pygame.display.flip()
-    clock.tick(FPS)
-    if GAME_SPEED_MULTIPLIER > 0:
-        time.sleep( (1.0 / GAME_SPEED_MULTIPLIER) / FPS)
-    else: pass
+    if full_redraw:
+        pygame.display.flip()
+    else:
+        pygame.display.update(_LAST_FRAME_RECTS + relabelled + frame_rects)
+    _LAST_FRAME_RECTS = frame_rects
+
+# --- Game Loop ---
+def start_or_resume(tick_executor, resume=False, checkpoint_dir=CHECKPOINT_DIR) -> list:
+    if resume and os.path.exists(os.path.join(checkpoint_dir, "state.json")):
+        return load_checkpoint(checkpoint_dir)
+    if resume:
+        print(f"No checkpoint found in {checkpoint_dir}; starting a fresh simulation.")
+    agents = setup_simulation()
+    # Initial daily plan for all agents
+    tick_executor.run_for_each(agents, lambda agent: agent.plan_daily_activities())
+    return agents
+
+def run_gui(days_to_run=GAME_DAYS_TO_RUN, workers=TICK_WORKERS, resume=False, checkpoint_dir=CHECKPOINT_DIR):
+    """Runs the simulation in a pygame window, paced by FPS and GAME_SPEED_MULTIPLIER."""
+    init_display()
+    tick_executor = TickExecutor(workers)
+    agents = start_or_resume(tick_executor, resume, checkpoint_dir)
+
+    running = True
+    clock = pygame.time.Clock()
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                invalidate_frame()
+        if not running or not step_simulation(agents, tick_executor, days_to_run, jump=False):
+            break
+        catch_up_agents(agents) # Sleeping agents still walk on screen
+        if _checkpoint_due():
+            save_checkpoint(agents, checkpoint_dir)
+
+        with PROFILER.phase("frame.draw"):
+            draw_frame(agents)
+        clock.tick(FPS)
+        if GAME_SPEED_MULTIPLIER > 0:
+            time.sleep( (1.0 / GAME_SPEED_MULTIPLIER) / FPS)
+        else: pass
+
+    tick_executor.shutdown()
+    catch_up_agents(agents)
+    save_world_objects() # Save on quit / at end
+    save_checkpoint(agents, checkpoint_dir)
+    pygame.quit()
+    finish_simulation(agents)
+    return agents
+
+def run_headless(days_to_run=GAME_DAYS_TO_RUN, workers=TICK_WORKERS, resume=False, checkpoint_dir=CHECKPOINT_DIR):
+    """Fast-forwards the simulation without pygame display/SDL: the clock advances as fast as cognition allows."""
+    tick_executor = TickExecutor(workers)
+    agents = start_or_resume(tick_executor, resume, checkpoint_dir)
+
+    start_time = time.perf_counter()
+    minutes_simulated = 0
+    steps = 0
+    try:
+        while True:
+            minutes = step_simulation(agents, tick_executor, days_to_run)
+            if not minutes:
+                break
+            minutes_simulated += minutes
+            steps += 1
+            if _checkpoint_due():
+                catch_up_agents(agents)
+                save_checkpoint(agents, checkpoint_dir)
+    finally:
+        tick_executor.shutdown()
+        catch_up_agents(agents)
+        save_world_objects()
+        save_checkpoint(agents, checkpoint_dir)
+    elapsed = time.perf_counter() - start_time
+    print(f"Headless run: {minutes_simulated} game minutes in {steps} steps, {elapsed:.1f}s ({minutes_simulated / max(elapsed, 1e-9):.1f} min/s)")
+    finish_simulation(agents)
+    return agents
+
+# --- Region Sharding (headless, one process per group of Town_* regions) ---
+SHARD_REGIONS = None # Regions owned by this process; None when not sharded (this process owns everything)
+SHARD_OUTBOX = [] # Messages for agents owned by other shards, collected after each minute
+
+def region_of(location_name: str) -> str:
+    """The Town_* area (direct child of World) containing a location."""
+    name = location_name
+    while LOCATIONS.get(name, {}).get('parent') not in (None, 'World'):
+        name = LOCATIONS[name]['parent']
+    return name
+
+def assign_regions(num_shards: int) -> list:
+    """Round-robin split of the Town_* regions over at most num_shards shards."""
+    regions = [name for name, data in LOCATIONS.items() if data.get('parent') == 'World']
+    num_shards = max(1, min(num_shards, len(regions)))
+    return [regions[i::num_shards] for i in range(num_shards)]
+
+class RemoteAgentRef:
+    """Stands in for a sender owned by another shard; receive_communication only reads name and role."""
+    def __init__(self, name, role):
+        self.name = name
+        self.role = role
+
+def deliver_communication(target_agent, sender_agent, message: str, comm_dt: datetime, turn: dict = None):
+    """Hands a message to the receiver, or queues it for the shard that owns the receiver now."""
+    if SHARD_REGIONS is None or target_agent.name in agents_by_name:
+        target_agent.receive_communication(sender_agent, message, comm_dt, turn)
+    else:
+        SHARD_OUTBOX.append({'target': target_agent.name, 'sender': sender_agent.name, 'sender_role': sender_agent.role,
+                             'message': message, 'time': comm_dt.isoformat(), 'turn': turn})
+
+def _owned_world_objects() -> dict:
+    return {obj_id: obj.to_dict() for obj_id, obj in WORLD_OBJECTS.items() if region_of(obj.location_name) in SHARD_REGIONS}
+
+def _adopt_agent(state: dict, embeddings: np.ndarray):
+    agent = Agent.from_checkpoint(state, embeddings, os.path.join(MEMORY_COLD_DIR, state['name']))
+    agents.append(agent)
+    agents_by_name[agent.name] = agent
+
+def _emigrate_agent(agent) -> tuple:
+    """Serializes an agent that walked into another shard's region and forgets it locally."""
+    agent.catch_up(_game_minute(current_datetime))
+    EVENT_SCHEDULER.forget(agent.name)
+    snapshot = agent.to_checkpoint()
+    for obj in WORLD_OBJECTS.values(): # Objects here can no longer be released by their user
+        if obj.current_user is agent:
+            obj.current_user = None
+    WORLD_INDEX.remove_agent(agent)
+    agents.remove(agent)
+    del agents_by_name[agent.name]
+    return snapshot
+
+def _shard_main(shard_id: int, regions: list, conn, options: dict):
+    """Worker process: owns the agents inside `regions` and runs one game minute per 'step' request."""
+    global SHARD_REGIONS, SIMULATION_LOG, EMBEDDING_CACHE, PROFILE_FILE, LOD_ENABLED, EVENT_SCHEDULING
+    SHARD_REGIONS = set(regions)
+    LOD_ENABLED = options['lod']
+    EVENT_SCHEDULING = options['event_scheduling']
+    set_llm_backend(options['backend'], options['seed']) # Agents carry their own streams between shards
+    SIMULATION_LOG = SimulationLogWriter(log_dir=os.path.join(SIMULATION_LOG_DIR, f"shard_{shard_id}"))
+    root, ext = os.path.splitext(EMBEDDING_CACHE_FILE)
+    EMBEDDING_CACHE = EmbeddingCache(db_path=f"{root}.shard{shard_id}{ext}") # SQLite holds a write lock between batched commits
+    if PROFILE_FILE:
+        root, ext = os.path.splitext(PROFILE_FILE)
+        PROFILE_FILE = f"{root}.shard{shard_id}{ext}"
+    tick_executor = TickExecutor(options['workers'])
+
+    def setup(payload):
+        setup_simulation(payload['names'])
+        tick_executor.run_for_each(agents, lambda agent: agent.plan_daily_activities())
+
+    def load(payload):
+        load_checkpoint(payload['checkpoint_dir'], payload['names'])
+
+    def adopt(payload):
+        for state, embeddings in payload:
+            _adopt_agent(state, embeddings)
+
+    def step(payload):
+        for message in payload['messages']: # Delivered at the minute they were sent, as in a single process
+            agents_by_name[message['target']].receive_communication(
+                RemoteAgentRef(message['sender'], message['sender_role']), message['message'], datetime.fromisoformat(message['time']), message.get('turn'))
+        set_game_time(payload['time'])
+        run_minute(agents, tick_executor)
+        leaving = [agent for agent in agents if region_of(agent.current_location_name) not in SHARD_REGIONS]
+        outbox = SHARD_OUTBOX[:]
+        SHARD_OUTBOX.clear()
+        return {'emigrants': [_emigrate_agent(agent) for agent in leaving], 'messages': outbox,
+                'next_event': EVENT_SCHEDULER.next_minute() if EVENT_SCHEDULING else None}
+
+    def snapshot(payload):
+        catch_up_agents(agents)
+        return {'agents': [agent.to_checkpoint() for agent in agents], 'world_objects': _owned_world_objects()}
+
+    def finish(payload):
+        catch_up_agents(agents)
+        SIMULATION_LOG.close()
+        cache_stats = EMBEDDING_CACHE.stats()
+        EMBEDDING_CACHE.close()
+        if PROFILER.enabled and PROFILE_FILE:
+            PROFILER.save(PROFILE_FILE)
+        return {'agent_reports': [_agent_report(agent) for agent in agents], 'log_records': SIMULATION_LOG.records_written,
+                'log_paths': SIMULATION_LOG.paths, 'cache': cache_stats, 'llm_requests': LLM_SCHEDULER.report(),
+                'plan_speculation': PLAN_SPECULATOR.report(), 'plan_templates': PLAN_TEMPLATES.report(),
+                'classifiers': [IMPORTANCE_CLASSIFIER.report(), EMOTION_CLASSIFIER.report()], 'profile': PROFILER.report() if PROFILER.enabled else None,
+                'classifier_examples': [IMPORTANCE_CLASSIFIER.new_examples(), EMOTION_CLASSIFIER.new_examples()]} # Merged into the shared file by the coordinator
+
+    handlers = {'setup': setup, 'load': load, 'adopt': adopt, 'step': step, 'snapshot': snapshot, 'finish': finish}
+    try:
+        while True:
+            command, payload = conn.recv()
+            if command == 'stop':
+                break
+            try:
+                conn.send(('ok', handlers[command](payload)))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+    finally:
+        tick_executor.shutdown()
+
+def _shard_request(shards, requests):
+    """Sends one (command, payload) per shard (None = skip), then waits for all replies: the minute barrier."""
+    for (_, conn), request in zip(shards, requests):
+        if request is not None:
+            conn.send(request)
+    replies = []
+    for (process, conn), request in zip(shards, requests):
+        if request is None:
+            replies.append(None)
+            continue
+        status, result = conn.recv()
+        if status == 'error':
+            raise RuntimeError(f"{process.name} failed:\n{result}")
+        replies.append(result)
+    return replies
+
+def _save_sharded_checkpoint(shards, checkpoint_dir):
+    replies = _shard_request(shards, [('snapshot', None)] * len(shards))
+    write_checkpoint([snap for reply in replies for snap in reply['agents']],
+                     {obj_id: obj for reply in replies for obj_id, obj in reply['world_objects'].items()}, checkpoint_dir)
+    return replies
+
+def run_sharded(days_to_run=GAME_DAYS_TO_RUN, num_shards=2, workers=TICK_WORKERS, resume=False, checkpoint_dir=CHECKPOINT_DIR, seed=None):
+    """Headless run with agents partitioned by region over worker processes, stepped in lockstep per game minute.
+
+    Agents at the same location always live in the same shard, so perception, conversations and object use
+    stay local; an agent arriving in another shard's region is handed over (checkpoint format) before the next minute.
+    """
+    shard_regions = assign_regions(num_shards)
+    owner_of_region = {region: i for i, regions in enumerate(shard_regions) for region in regions}
+    shard_of = lambda location_name: owner_of_region.get(region_of(location_name), 0)
+
+    if resume and os.path.exists(os.path.join(checkpoint_dir, "state.json")):
+        with open(os.path.join(checkpoint_dir, "state.json")) as f:
+            data = json.load(f)
+        set_game_time(datetime.fromisoformat(data['current_datetime']))
+        placement = {state['name']: shard_of(state['current_location_name']) for state in data['agents']}
+        command = 'load'
+    else:
+        if resume:
+            print(f"No checkpoint found in {checkpoint_dir}; starting a fresh simulation.")
+        placement = {name: shard_of(location) for name, _, _, location, _ in TOWN_AGENTS}
+        command = 'setup'
+
+    context = multiprocessing.get_context("spawn") # Fresh interpreters: no inherited threads, locks or SQLite handles
+    options = {'lod': LOD_ENABLED, 'event_scheduling': EVENT_SCHEDULING, 'backend': LLM_BACKEND, 'seed': seed, 'workers': workers}
+    shards = []
+    for shard_id, regions in enumerate(shard_regions):
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_shard_main, args=(shard_id, regions, child_conn, options), name=f"shard-{shard_id}", daemon=True)
+        process.start()
+        shards.append((process, parent_conn))
+    print(f"Sharded run: {len(shards)} processes, regions {shard_regions}")
+
+    start_time = time.perf_counter()
+    minutes_simulated = 0
+    steps = 0
+    handovers = 0
+    inboxes = [[] for _ in shards]
+    next_events = []
+    finished = None
+    try:
+        _shard_request(shards, [(command, {'names': [name for name, owner in placement.items() if owner == shard_id], 'checkpoint_dir': checkpoint_dir})
+                                for shard_id in range(len(shards))])
+        while game_day_of(current_datetime + timedelta(minutes=1)) <= days_to_run:
+            # Jump to the earliest event over all shards; pending messages are delivered on the very next minute
+            minutes = 1
+            if EVENT_SCHEDULING and next_events and not any(inboxes):
+                minutes = minutes_to_next_event(min(next_events), days_to_run)
+            advance_game_time(minutes=minutes)
+            replies = _shard_request(shards, [('step', {'time': current_datetime, 'messages': inbox}) for inbox in inboxes])
+            next_events = [reply['next_event'] for reply in replies if reply['next_event'] is not None]
+            immigrants = [[] for _ in shards]
+            for reply in replies:
+                for state, embeddings in reply['emigrants']:
+                    placement[state['name']] = shard_of(state['current_location_name'])
+                    immigrants[placement[state['name']]].append((state, embeddings))
+                    handovers += 1
+            if any(immigrants): # Hand agents over before the next minute so no one is ever in transit
+                _shard_request(shards, [('adopt', batch) if batch else None for batch in immigrants])
+                next_events = [] # Adopted agents run on the next minute
+            inboxes = [[] for _ in shards]
+            for reply in replies:
+                for message in reply['messages']:
+                    inboxes[placement[message['target']]].append(message)
+            minutes_simulated += minutes
+            steps += 1
+            if _checkpoint_due():
+                _save_sharded_checkpoint(shards, checkpoint_dir)
+        print(f"Simulation finished after {days_to_run} days.")
+        replies = _save_sharded_checkpoint(shards, checkpoint_dir)
+        save_world_objects({obj_id: obj for reply in replies for obj_id, obj in reply['world_objects'].items()})
+        finished = _shard_request(shards, [('finish', None)] * len(shards))
+        merge_classifier_examples([reply['classifier_examples'] for reply in finished])
+    finally:
+        for process, conn in shards:
+            if process.is_alive():
+                try:
+                    conn.send(('stop', None))
+                except OSError:
+                    pass
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Sharded run: {minutes_simulated} game minutes in {steps} steps, {elapsed:.1f}s ({minutes_simulated / max(elapsed, 1e-9):.1f} min/s), {handovers} agent handovers")
+    print("\n--- Final Agent States (Sample) ---")
+    for reply in finished:
+        for report in reply['agent_reports']:
+            print(report)
+    for shard_id, reply in enumerate(finished):
+        cache_stats = reply['cache']
+        print(f"\nShard {shard_id} ({', '.join(shard_regions[shard_id])}): {reply['log_records']} log records in {', '.join(reply['log_paths']) or '(nothing logged)'}; "
+              f"embedding cache {cache_stats['hits']} hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses")
+        print(reply['llm_requests'])
+        print(reply['plan_speculation'])
+        print(reply['plan_templates'])
+        print("\n".join(reply['classifiers']))
+        if reply['profile']:
+            print(reply['profile'])
 
 # --- Simulation End ---
-pygame.quit()
-
-log_filename = f"simulation_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-with open(log_filename, 'w') as f:
-    json.dump(SIMULATION_LOG, f, indent=2, default=str)
-print(f"\nSimulation log saved to {log_filename}")
-
-print("\n--- Final Agent States (Sample) ---")
-for agent in agents:
-    print(f"\nAgent: {agent.name} ({agent.role}) - Emotion: {agent.emotional_state}")
-    print(f"  Needs: {agent.needs}")
-    print(f"  Relationships (Top 2 by friendship):")
+def _agent_report(agent) -> str:
+    lines = [f"\nAgent: {agent.name} ({agent.role}) - Emotion: {agent.emotional_state}",
+             f"  Needs: {agent.needs}",
+             f"  Relationships (Top 2 by friendship):"]
     sorted_rels = sorted(agent.relationships.items(), key=lambda item: item[1]['friendship_score'], reverse=True)
     for other_name, rel_data in sorted_rels[:2]:
-        print(f"    - {other_name}: Friend {rel_data['friendship_score']:.0f}, Trust {rel_data['trust_score']:.0f}")
-    print(f"  Memory Count: {len(agent.memory_stream)}")
+        lines.append(f"    - {other_name}: Friend {rel_data['friendship_score']:.0f}, Trust {rel_data['trust_score']:.0f}")
+    lines.append(f"  Memory Count: {len(agent.memory_stream)} hot, {agent.cold_memory.alive_count()} archived")
+    return "\n".join(lines)
+
+def finish_simulation(agents):
+    SIMULATION_LOG.close()
+    print(f"\nSimulation log: {SIMULATION_LOG.records_written} records saved to {', '.join(SIMULATION_LOG.paths) or '(nothing logged)'}"
+          + (f" ({SIMULATION_LOG.records_dropped} dropped after a write error)" if SIMULATION_LOG.failed else ""))
+
+    print("\n--- Final Agent States (Sample) ---")
+    for agent in agents:
+        print(_agent_report(agent))
+
+    cache_stats = EMBEDDING_CACHE.stats()
+    print(f"\nEmbedding cache: {cache_stats['hits']} hits, {cache_stats['disk_hits']} disk hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+    EMBEDDING_CACHE.close()
+    print(LLM_SCHEDULER.report())
+    PLAN_SPECULATOR.shutdown()
+    print(PLAN_SPECULATOR.report())
+    print(PLAN_TEMPLATES.report())
+    print(IMPORTANCE_CLASSIFIER.report())
+    print(EMOTION_CLASSIFIER.report())
+    save_classifiers()
+
+    if PROFILER.enabled:
+        print("\n" + PROFILER.report())
+        if PROFILE_FILE:
+            PROFILER.save(PROFILE_FILE)
+            print(f"Profile saved to {PROFILE_FILE}")
+
+def main(argv=None):
+    global LOD_ENABLED, EVENT_SCHEDULING
+    parser = argparse.ArgumentParser(description="AI Town Simulation")
+    parser.add_argument("--headless", action="store_true", help="Run without a window, advancing game time as fast as the agents allow")
+    parser.add_argument("--days", type=int, default=GAME_DAYS_TO_RUN, help="Number of game days to simulate")
+    parser.add_argument("--workers", type=int, default=TICK_WORKERS, help="Agents updated concurrently per tick (1 = serial)")
+    parser.add_argument("--resume", action="store_true", help="Continue from the last checkpoint instead of starting fresh")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="Where checkpoints are written and resumed from")
+    parser.add_argument("--lod", action="store_true", default=LOD_ENABLED, help="Drop lone, settled agents to rule-based cognition (no LLM calls)")
+    parser.add_argument("--every-minute", action="store_true", default=not EVENT_SCHEDULING, help="Update every agent every game minute instead of only the agents with an event due")
+    parser.add_argument("--backend", choices=("ollama", "mock"), default=LLM_BACKEND, help="LLM backend ('mock' runs offline and deterministically)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed the simulation's random streams (with --backend mock, runs with the same --workers repeat exactly)")
+    parser.add_argument("--shards", type=int, default=1, help="Headless only: split the town's regions over this many worker processes")
+    args = parser.parse_args(argv)
+    if args.shards > 1 and not args.headless:
+        parser.error("--shards requires --headless")
+    LOD_ENABLED = args.lod
+    EVENT_SCHEDULING = not args.every_minute
+    set_llm_backend(args.backend, args.seed)
+    if args.shards > 1:
+        run_sharded(args.days, args.shards, args.workers, args.resume, args.checkpoint_dir, args.seed)
+    elif args.headless:
+        run_headless(args.days, args.workers, args.resume, args.checkpoint_dir)
+    else:
+        run_gui(args.days, args.workers, args.resume, args.checkpoint_dir)
+
+if __name__ == "__main__":
+    main()